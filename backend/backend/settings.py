@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -81,9 +84,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: las lecturas no esperan a las escrituras. IMMEDIATE: cada
+            # transacción toma el bloqueo de escritura al empezar y, si está
+            # ocupado, espera hasta ``timeout`` segundos en lugar de fallar
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Base de datos de tests en fichero (no en memoria) para que los tests
+        # de concurrencia usen WAL como en producción
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# 'default' vive en la memoria de cada proceso. 'tienda_version' guarda el número
+# de versión de la caché de respuestas del catálogo en ficheros, compartido por
+# todos los procesos de la máquina; con varias máquinas debe apuntar a Redis o
+# Memcached (p. ej. django.core.cache.backends.redis.RedisCache)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'tienda_version': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'tienda-cache-version',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,6 +160,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -155,3 +186,102 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
 }
+
+# Búsqueda de productos (ver tienda/busqueda.py)
+TIENDA_BUSQUEDA_BACKEND = 'tienda.busqueda.FTS5Backend'
+
+# Caché de respuestas del catálogo (ver tienda/cache_respuestas.py). Las respuestas
+# se guardan en cada proceso; la versión, en una caché compartida para que una
+# escritura en un proceso invalide las respuestas de todos (cada proceso la relee
+# como mucho cada VERSION_TTL segundos)
+TIENDA_CACHE_RESPUESTAS = {
+    'BACKEND': 'tienda.cache_respuestas.LRUBackend',
+    'TTL': 30,
+    'OPTIONS': {'max_bytes': 16 * 1024 * 1024},
+    'VERSION_CACHE': 'tienda_version',
+    'VERSION_TTL': 1,
+}
+
+# Autocompletado en memoria (ver tienda/autocompletar.py)
+TIENDA_AUTOCOMPLETAR = {
+    'MAX_PRODUCTOS': 50000,
+    'MAX_PALABRAS': 8,
+    'REFRESCO': 600,
+}
+
+# Contadores de ventas (ver tienda/ventas.py): cada cuántos segundos se recalculan
+# las ventas de los últimos 30 y 7 días con tareas_periodicas (None = sólo con
+# python manage.py recalcular_ventas --ventanas)
+TIENDA_VENTAS = {
+    'INTERVALO_VENTANAS': 3600,
+}
+
+# Limpieza de carritos de invitados abandonados (ver tienda/limpieza.py)
+TIENDA_LIMPIEZA_CARRITOS = {
+    'TTL_DIAS': 30,
+    'LOTE': 1000,
+    'PAUSA': 0,
+    'INTERVALO': None,  # p. ej. 3600 para ejecutarla cada hora con tareas_periodicas
+}
+
+# Dónde se guardan los carritos. Con 'tienda.almacen_carrito.KVAlmacen' viven en un
+# almacén clave-valor ('memoria' en el proceso o una URL redis://) y se vuelcan a
+# la base de datos cada INTERVALO_VOLCADO segundos: con 'memoria', desde el propio
+# proceso; con Redis, desde tareas_periodicas (o con el comando volcar_carritos)
+TIENDA_ALMACEN_CARRITO = {
+    'BACKEND': 'tienda.almacen_carrito.ORMAlmacen',
+    'OPTIONS': {},
+    'INTERVALO_VOLCADO': 5,
+}
+
+# Idempotency-Key en checkout y al añadir al carrito: cuánto se guarda cada
+# respuesta (segundos), cuánto retiene su clave una petición en curso (si el
+# proceso muere, después se puede reintentar) y cada cuánto se purgan las
+# caducadas con tareas_periodicas (None = sólo con el comando
+# purgar_idempotencia, p. ej. desde cron cada hora)
+TIENDA_IDEMPOTENCIA = {
+    'TTL': 24 * 3600,
+    'PLAZO_EN_CURSO': 60,
+    'INTERVALO_PURGA': None,
+}
+
+# Reservas de stock: con ACTIVAS, añadir al carrito aparta las unidades durante
+# TTL segundos; las caducadas se liberan cada INTERVALO segundos (o con el
+# comando liberar_reservas), LOTE reservas por transacción
+TIENDA_RESERVAS = {
+    'ACTIVAS': False,
+    'TTL': 15 * 60,
+    'LOTE': 500,
+    'INTERVALO': 60,
+}
+
+# Cola de trabajos en segundo plano (python manage.py procesar_trabajos): trabajos
+# por lote, hilos, segundos antes de retomar uno sin terminar y reintentos con
+# espera creciente desde ESPERA_BASE hasta ESPERA_MAXIMA segundos
+TIENDA_COLA = {
+    'LOTE': 20,
+    'HILOS': 4,
+    'VISIBILIDAD': 300,
+    'MAX_INTENTOS': 5,
+    'ESPERA_BASE': 10,
+    'ESPERA_MAXIMA': 3600,
+}
+
+# Exportación de compras en streaming (GET /api/exportar/ y python manage.py
+# exportar_compras): filas por lectura de la base de datos y por trozo escrito
+TIENDA_EXPORTACION = {
+    'LOTE': 2000,
+}
+
+# Resumen diario de ventas para /api/analitica/ventas/: compras por transacción,
+# segundos que espera una compra antes de resumirse y segundos entre pasadas con
+# tareas_periodicas (None = sólo con python manage.py resumir_ventas, p. ej.
+# desde cron cada 5 minutos)
+TIENDA_ANALITICA = {
+    'LOTE': 1000,
+    'MARGEN': 60,
+    'INTERVALO': None,
+}
+
+# Los correos de la cola (confirmación de compra, bienvenida) salen por consola en desarrollo
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
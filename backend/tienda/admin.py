@@ -1,5 +1,59 @@
 from django.contrib import admin
-from .models import Categoria, Producto, CarritoItem, Compra, CompraItem
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import F, QuerySet
+from django.utils.functional import cached_property
+
+from .models import Categoria, Producto, CarritoItem, Compra, CompraItem, unidades_por_compra
+
+# Por debajo de estas filas (estimadas) se cuenta con COUNT(*): es barato y exacto
+UMBRAL_CONTEO_ESTIMADO = 10000
+
+
+def filas_estimadas(model, using='default'):
+    """
+    Filas de la tabla de ``model`` según las estadísticas de la base de datos
+    (sin recorrerla), o None si no hay: ``sqlite_stat1`` tras ``ANALYZE`` en
+    SQLite y ``pg_class.reltuples`` en PostgreSQL.
+    """
+    connection = connections[using]
+    tabla = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [tabla])
+                filas = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+                return max(filas) if filas else None
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [tabla])
+                fila = cursor.fetchone()
+                return fila[0] if fila and fila[0] >= 0 else None
+    except DatabaseError:
+        # Sin estadísticas todavía (p. ej. SQLite sin ANALYZE)
+        return None
+    return None
+
+
+class PaginadorEstimado(Paginator):
+    """
+    Paginador de los listados del admin de tablas grandes: sin filtros ni
+    búsqueda usa el número de filas estimado en lugar de un COUNT(*) que
+    recorre la tabla entera. Con filtros, o si la tabla es pequeña, cuenta.
+    """
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet) and not self.object_list.query.where:
+            estimado = filas_estimadas(self.object_list.model, self.object_list.db)
+            if estimado is not None and estimado >= UMBRAL_CONTEO_ESTIMADO:
+                return estimado
+        return super().count
+
+
+class TablaGrandeAdmin(admin.ModelAdmin):
+    """Listado sin el segundo COUNT(*) del total sin filtrar y con conteo estimado"""
+    paginator = PaginadorEstimado
+    show_full_result_count = False
 
 
 @admin.register(Categoria)
@@ -14,13 +68,32 @@ class ProductoAdmin(admin.ModelAdmin):
     list_filter = ['categoria', 'created_at']
     search_fields = ['nombre', 'autor']
     list_editable = ['precio', 'stock']
+    list_select_related = ['categoria']
+    autocomplete_fields = ['categoria']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if getattr(request.resolver_match, 'url_name', None) == 'tienda_producto_changelist':
+            # El listado no muestra los textos largos
+            queryset = queryset.defer('descripcion', 'contraportada')
+        return queryset
 
 
 @admin.register(CarritoItem)
-class CarritoItemAdmin(admin.ModelAdmin):
+class CarritoItemAdmin(TablaGrandeAdmin):
     list_display = ['usuario', 'producto', 'cantidad', 'subtotal', 'created_at']
     list_filter = ['created_at']
     search_fields = ['usuario__username', 'producto__nombre']
+    # usuario admite nulos: select_related() sin argumentos no lo seguiría
+    list_select_related = ['usuario', 'producto']
+    autocomplete_fields = ['usuario', 'producto']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_subtotal=F('producto__precio') * F('cantidad'))
+
+    @admin.display(description='Subtotal', ordering='_subtotal')
+    def subtotal(self, obj):
+        return obj._subtotal
 
 
 class CompraItemInline(admin.TabularInline):
@@ -28,19 +101,34 @@ class CompraItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ['producto', 'cantidad', 'precio_unitario', 'subtotal']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('producto')
+
 
 @admin.register(Compra)
-class CompraAdmin(admin.ModelAdmin):
+class CompraAdmin(TablaGrandeAdmin):
     list_display = ['id', 'usuario', 'total', 'total_items', 'fecha_compra', 'estado', 'metodo_pago']
     list_filter = ['estado', 'metodo_pago', 'fecha_compra']
     search_fields = ['usuario__username', 'id']
     readonly_fields = ['fecha_compra', 'total']
     inlines = [CompraItemInline]
     date_hierarchy = 'fecha_compra'
+    list_select_related = ['usuario']
+    autocomplete_fields = ['usuario']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(total_items=unidades_por_compra())
+
+    @admin.display(description='Unidades', ordering='total_items')
+    def total_items(self, obj):
+        return obj.total_items
 
 
 @admin.register(CompraItem)
-class CompraItemAdmin(admin.ModelAdmin):
+class CompraItemAdmin(TablaGrandeAdmin):
     list_display = ['compra', 'producto', 'cantidad', 'precio_unitario', 'subtotal']
     list_filter = ['compra__fecha_compra']
     search_fields = ['compra__id', 'producto__nombre']
+    # El nombre de la compra incluye el de su usuario
+    list_select_related = ['compra__usuario', 'producto']
+    autocomplete_fields = ['compra', 'producto']
@@ -0,0 +1,573 @@
+"""
+Dónde viven los carritos.
+
+``ORMAlmacen`` (por defecto) guarda cada línea en ``CarritoItem``.
+
+``KVAlmacen`` guarda cada carrito como un hash clave-valor (producto ->
+cantidad) en un cliente con la interfaz de redis-py: ``MemoriaKV`` dentro del
+proceso (un solo nodo) o un servidor compatible con Redis (varios nodos, con
+el paquete opcional ``redis``). Las lecturas y escrituras del carrito no tocan
+la base de datos salvo para cargar los productos. Los carritos modificados se
+apuntan en un conjunto y ``volcar()`` los escribe por lotes en ``CarritoItem``
+(write-behind) y sólo después los quita del conjunto, desde el comando ``volcar_carritos`` o como tarea periódica
+(``INTERVALO_VOLCADO``): con Redis, en ``tareas_periodicas``; con
+``MemoriaKV``, en un hilo del propio proceso que arranca con el primer uso
+del almacén, porque otro proceso no ve su memoria. Antes del checkout, ``instantanea()`` vuelca el
+carrito del comprador para que la compra lea exactamente lo que hay en el almacén.
+Con ``KVAlmacen``, el id de cada línea en la API es el id del producto; el
+hash guarda también cuándo se añadió cada uno (``created_at``).
+
+Configuración (``TIENDA_ALMACEN_CARRITO`` en settings)::
+
+    {
+        'BACKEND': 'tienda.almacen_carrito.KVAlmacen',
+        'OPTIONS': {'cliente': 'memoria'},  # o 'redis://localhost:6379/0'
+        'INTERVALO_VOLCADO': 5,
+    }
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum, Window
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .configuracion import leer
+from .models import CarritoItem, Producto
+
+CONFIGURACION_POR_DEFECTO = {
+    'BACKEND': 'tienda.almacen_carrito.ORMAlmacen',
+    'OPTIONS': {},
+    # Segundos entre volcados del write-behind; None = sólo con el comando
+    'INTERVALO_VOLCADO': None,
+}
+
+
+def get_configuracion():
+    return leer('TIENDA_ALMACEN_CARRITO', CONFIGURACION_POR_DEFECTO)
+
+
+class Propietario(namedtuple('Propietario', ['usuario_id', 'session_key'])):
+    """Dueño de un carrito: un usuario autenticado o un invitado (``session_key``)"""
+
+    @classmethod
+    def de(cls, usuario, session_key=None):
+        if usuario is not None and usuario.is_authenticated:
+            return cls(usuario.id, None)
+        return cls(None, session_key or None)
+
+    @classmethod
+    def desde_clave(cls, clave):
+        tipo, valor = clave.split(':', 1)
+        return cls(int(valor), None) if tipo == 'u' else cls(None, valor)
+
+    @property
+    def clave(self):
+        return f'u:{self.usuario_id}' if self.usuario_id else f's:{self.session_key}'
+
+    @property
+    def vacio(self):
+        return not self.usuario_id and not self.session_key
+
+    def filtro(self):
+        if self.usuario_id:
+            return {'usuario_id': self.usuario_id}
+        return {'session_key': self.session_key}
+
+
+def escribir_lineas(cambios):
+    """
+    Dejar en ``CarritoItem`` las cantidades indicadas con un bulk_create, un
+    bulk_update y un borrado (dentro de la transacción de quien llama).
+    ``cambios``: tuplas (propietario, {producto_id: CarritoItem existente},
+    {producto_id: cantidad final, 0 = quitar}).
+    """
+    ahora = timezone.now()
+    nuevos, cambiados, quitados = [], [], []
+    for propietario, existentes, cantidades in cambios:
+        for producto_id, cantidad in cantidades.items():
+            item = existentes.get(producto_id)
+            if item is None or item.pk is None:
+                if cantidad:
+                    nuevos.append(CarritoItem(producto_id=producto_id, cantidad=cantidad, **propietario.filtro()))
+            elif not cantidad:
+                quitados.append(item.pk)
+            elif cantidad != item.cantidad:
+                item.cantidad = cantidad
+                item.updated_at = ahora
+                cambiados.append(item)
+    if nuevos:
+        CarritoItem.objects.bulk_create(nuevos)
+    if cambiados:
+        CarritoItem.objects.bulk_update(cambiados, ['cantidad', 'updated_at'])
+    if quitados:
+        CarritoItem.objects.filter(pk__in=quitados).delete()
+
+
+class ORMAlmacen:
+    """Carritos en la tabla ``CarritoItem``"""
+
+    def __init__(self, **opciones):
+        pass
+
+    def items(self, propietario, diferir=()):
+        """Líneas del carrito con producto y categoría cargados"""
+        if propietario.vacio:
+            return CarritoItem.objects.none()
+        return (
+            CarritoItem.objects.select_related('producto__categoria').defer(*diferir)
+            .filter(**propietario.filtro())
+        )
+
+    def resumen(self, propietario, diferir=()):
+        """
+        (items, total, unidades) con el total y las unidades calculados por la
+        base de datos en la misma consulta (funciones de ventana sobre todo el carrito)
+        """
+        importe = ExpressionWrapper(
+            F('cantidad') * F('producto__precio'), output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+        items = list(self.items(propietario, diferir).annotate(
+            total_carrito=Window(Sum(importe)),
+            unidades_carrito=Window(Sum('cantidad')),
+        ))
+        if not items:
+            return items, Decimal('0'), 0
+        return items, items[0].total_carrito, items[0].unidades_carrito
+
+    def linea(self, propietario, pk, diferir=()):
+        """La línea ``pk`` del carrito, o None"""
+        try:
+            return self.items(propietario, diferir).get(pk=pk)
+        except (CarritoItem.DoesNotExist, ValueError):
+            return None
+
+    def lineas(self, propietario, producto_ids):
+        """{producto_id: CarritoItem} de esos productos que ya están en el carrito"""
+        return {
+            item.producto_id: item
+            for item in CarritoItem.objects.filter(producto_id__in=producto_ids, **propietario.filtro()).order_by()
+        }
+
+    def agregar(self, propietario, producto, cantidad):
+        """Sumar ``cantidad`` de ``producto`` sin superar su stock; devuelve la línea o None si no cabe"""
+        # Incremento en una sola sentencia (UPDATE ... SET cantidad = cantidad + n
+        # WHERE cantidad + n <= stock): sin leer y reescribir la cantidad, dos
+        # pestañas que añaden a la vez no pierden unidades. El stock se compara
+        # con la columna, no con ``producto.stock``, que puede haber cambiado
+        # desde que se leyó
+        linea = CarritoItem.objects.filter(producto=producto, **propietario.filtro())
+
+        def incrementar():
+            return linea.filter(cantidad__lte=F('producto__stock') - cantidad).update(
+                cantidad=F('cantidad') + cantidad, updated_at=timezone.now()
+            )
+
+        if not incrementar():
+            if not Producto.objects.filter(pk=producto.pk, stock__gte=cantidad).exists():
+                return None
+            # No había línea (o ya no cabe): se intenta crearla; si otra petición
+            # la creó entre medias, la restricción única lo impide y se vuelve a incrementar
+            try:
+                with transaction.atomic():
+                    return CarritoItem.objects.create(producto=producto, cantidad=cantidad, **propietario.filtro())
+            except IntegrityError:
+                if not incrementar():
+                    return None
+        carrito_item = linea.get()
+        carrito_item.producto = producto
+        return carrito_item
+
+    def aplicar(self, propietario, cantidades, lineas):
+        """Fijar las cantidades finales ({producto_id: cantidad}, 0 = quitar); ``lineas`` viene de ``lineas()``"""
+        escribir_lineas([(propietario, lineas, cantidades)])
+
+    def instantanea(self, propietario):
+        """Garantizar que ``CarritoItem`` refleja el carrito (antes del checkout)"""
+
+    def tras_compra(self, propietario, cantidades):
+        """Descontar lo comprado; aquí el checkout ya borró las filas"""
+
+    def invalidar(self, propietario):
+        """Olvidar la copia del carrito tras cambiarlo directamente en la base de datos"""
+
+
+class KVAlmacen(ORMAlmacen):
+    """Carritos en un almacén clave-valor, volcados a ``CarritoItem`` en segundo plano"""
+    # Campo del hash que indica que el carrito ya se cargó de la base de datos
+    MARCA = '_'
+    # Prefijo del campo con la fecha en que se añadió cada producto (``created_at``)
+    CREADO = 'creado:'
+
+    def __init__(self, cliente='memoria', prefijo='tienda:carrito:', ttl=7 * 24 * 3600, lote_volcado=500):
+        if cliente == 'memoria':
+            self.cliente = MemoriaKV()
+        elif isinstance(cliente, str):
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured('KVAlmacen con una URL de Redis necesita el paquete "redis"')
+            self.cliente = redis.Redis.from_url(cliente, decode_responses=True)
+        else:
+            self.cliente = cliente
+        self.prefijo = prefijo
+        self.ttl = ttl
+        self.lote_volcado = lote_volcado
+        self.sucios = prefijo + 'sucios'
+
+    def _clave(self, propietario):
+        return self.prefijo + propietario.clave
+
+    def _datos(self, propietario):
+        """Hash del carrito; la primera vez se carga de ``CarritoItem``"""
+        if propietario.vacio:
+            return {}
+        clave = self._clave(propietario)
+        datos = self.cliente.hgetall(clave)
+        if not datos:
+            filas = CarritoItem.objects.filter(**propietario.filtro()).values_list('producto_id', 'cantidad', 'created_at')
+            pipe = self.cliente.pipeline()
+            # hsetnx: no pisar un incremento hecho mientras se cargaba
+            for producto_id, cantidad, creado in filas:
+                pipe.hsetnx(clave, str(producto_id), cantidad)
+                pipe.hsetnx(clave, self.CREADO + str(producto_id), creado.isoformat())
+            pipe.hsetnx(clave, self.MARCA, 1)
+            pipe.expire(clave, self.ttl)
+            pipe.hgetall(clave)
+            datos = pipe.execute()[-1]
+        return datos
+
+    @staticmethod
+    def _cantidades(datos):
+        return {int(campo): int(valor) for campo, valor in datos.items() if campo.isdigit()}
+
+    def cantidades(self, propietario):
+        """{producto_id: cantidad}; la primera vez se carga de ``CarritoItem``"""
+        return self._cantidades(self._datos(propietario))
+
+    def _item(self, propietario, producto, cantidad, creado=None):
+        # El id de la línea es el del producto
+        return CarritoItem(
+            id=producto.id, producto=producto, cantidad=cantidad,
+            usuario_id=propietario.usuario_id, session_key=propietario.session_key,
+            created_at=datetime.fromisoformat(creado) if creado else None,
+        )
+
+    def _crear(self, pipe, clave, producto_id):
+        """Apuntar cuándo se añadió el producto, si es una línea nueva"""
+        pipe.hsetnx(clave, self.CREADO + str(producto_id), timezone.now().isoformat())
+
+    def _quitar(self, cliente, clave, producto_ids):
+        """Borrar la cantidad y la fecha de esos productos"""
+        campos = [campo for producto_id in producto_ids for campo in (str(producto_id), self.CREADO + str(producto_id))]
+        cliente.hdel(clave, *campos)
+
+    def _marcar(self, propietario, pipe=None):
+        cliente = pipe or self.cliente
+        cliente.expire(self._clave(propietario), self.ttl)
+        cliente.sadd(self.sucios, propietario.clave)
+
+    def items(self, propietario, diferir=()):
+        datos = self._datos(propietario)
+        cantidades = self._cantidades(datos)
+        if not cantidades:
+            return []
+        diferir_producto = [campo[len('producto__'):] for campo in diferir if campo.startswith('producto__')]
+        productos = (
+            Producto.objects.select_related('categoria').defer(*diferir_producto).order_by().in_bulk(cantidades)
+        )
+        return [
+            self._item(propietario, productos[producto_id], cantidad, datos.get(self.CREADO + str(producto_id)))
+            for producto_id, cantidad in sorted(cantidades.items(), reverse=True)
+            if producto_id in productos
+        ]
+
+    def resumen(self, propietario, diferir=()):
+        items = self.items(propietario, diferir)
+        total = sum((item.subtotal for item in items), Decimal('0'))
+        return items, total, sum(item.cantidad for item in items)
+
+    def linea(self, propietario, pk, diferir=()):
+        try:
+            producto_id = int(pk)
+        except ValueError:
+            return None
+        datos = self._datos(propietario)
+        cantidad = self._cantidades(datos).get(producto_id)
+        if cantidad is None:
+            return None
+        diferir_producto = [campo[len('producto__'):] for campo in diferir if campo.startswith('producto__')]
+        producto = Producto.objects.select_related('categoria').defer(*diferir_producto).filter(pk=producto_id).first()
+        creado = datos.get(self.CREADO + str(producto_id))
+        return self._item(propietario, producto, cantidad, creado) if producto else None
+
+    def lineas(self, propietario, producto_ids):
+        cantidades = self.cantidades(propietario)
+        return {
+            producto_id: CarritoItem(producto_id=producto_id, cantidad=cantidades[producto_id])
+            for producto_id in producto_ids if producto_id in cantidades
+        }
+
+    def agregar(self, propietario, producto, cantidad):
+        self._datos(propietario)
+        clave = self._clave(propietario)
+        pipe = self.cliente.pipeline()
+        pipe.hincrby(clave, str(producto.id), cantidad)
+        self._crear(pipe, clave, producto.id)
+        pipe.hget(clave, self.CREADO + str(producto.id))
+        nueva, _, creado = pipe.execute()
+        if nueva > producto.stock:
+            if self.cliente.hincrby(clave, str(producto.id), -cantidad) <= 0:
+                self._quitar(self.cliente, clave, [producto.id])
+            return None
+        self._marcar(propietario)
+        return self._item(propietario, producto, nueva, creado)
+
+    def aplicar(self, propietario, cantidades, lineas):
+        clave = self._clave(propietario)
+        self.cantidades(propietario)
+        pipe = self.cliente.pipeline()
+        for producto_id, cantidad in cantidades.items():
+            if cantidad:
+                pipe.hset(clave, str(producto_id), cantidad)
+                self._crear(pipe, clave, producto_id)
+            else:
+                self._quitar(pipe, clave, [producto_id])
+            if producto_id in lineas:
+                lineas[producto_id].cantidad = cantidad
+        self._marcar(propietario, pipe)
+        pipe.execute()
+
+    def instantanea(self, propietario):
+        self._volcar([propietario])
+
+    def tras_compra(self, propietario, cantidades):
+        clave = self._clave(propietario)
+        pipe = self.cliente.pipeline()
+        for producto_id, cantidad in cantidades.items():
+            pipe.hincrby(clave, str(producto_id), -cantidad)
+        restantes = pipe.execute()
+        agotados = [producto_id for producto_id, resto in zip(cantidades, restantes) if resto <= 0]
+        if agotados:
+            self._quitar(self.cliente, clave, agotados)
+        # Lo añadido durante la compra (si hay algo) se vuelca después
+        self._marcar(propietario)
+
+    def invalidar(self, propietario):
+        self.cliente.delete(self._clave(propietario))
+
+    def volcar(self):
+        """Escribir en ``CarritoItem`` los carritos modificados, por lotes; devuelve cuántos se volcaron"""
+        claves = sorted(self.cliente.smembers(self.sucios))
+        for inicio in range(0, len(claves), self.lote_volcado):
+            self._volcar([Propietario.desde_clave(clave) for clave in claves[inicio:inicio + self.lote_volcado]])
+        return len(claves)
+
+    def _volcar(self, propietarios):
+        """
+        Escribir los carritos y sólo entonces quitarlos de los pendientes: si
+        la escritura falla siguen apuntados. Los que cambiaron mientras se
+        escribían se quedan para el siguiente volcado.
+        """
+        escritos = self._escribir(propietarios)
+        pipe = self.cliente.pipeline()
+        for propietario in propietarios:
+            pipe.hgetall(self._clave(propietario))
+        actuales = pipe.execute()
+        volcados = [
+            propietario.clave for propietario, actual in zip(propietarios, actuales)
+            if actual == escritos.get(propietario, {})
+        ]
+        if volcados:
+            self.cliente.srem(self.sucios, *volcados)
+
+    def _escribir(self, propietarios):
+        """Escribir los carritos en ``CarritoItem``; devuelve {propietario: hash escrito}"""
+        pipe = self.cliente.pipeline()
+        for propietario in propietarios:
+            pipe.hgetall(self._clave(propietario))
+        carritos = pipe.execute()
+
+        # Carritos que no están en el almacén (caducados) no se tocan
+        cargados = [(propietario, datos) for propietario, datos in zip(propietarios, carritos) if datos]
+        if not cargados:
+            return {}
+        with transaction.atomic():
+            usuarios = [propietario.usuario_id for propietario, _ in cargados if propietario.usuario_id]
+            sesiones = [propietario.session_key for propietario, _ in cargados if not propietario.usuario_id]
+            existentes = {}
+            filas = CarritoItem.objects.filter(
+                Q(usuario_id__in=usuarios) | Q(session_key__in=sesiones, usuario__isnull=True)
+            ).order_by()
+            for item in filas:
+                propietario = Propietario(item.usuario_id, None if item.usuario_id else item.session_key)
+                existentes.setdefault(propietario, {})[item.producto_id] = item
+
+            cambios = []
+            for propietario, datos in cargados:
+                filas_propietario = existentes.get(propietario, {})
+                cantidades = self._cantidades(datos)
+                # Lo que está en la base de datos y ya no en el almacén se quita
+                for producto_id in filas_propietario.keys() - cantidades.keys():
+                    cantidades[producto_id] = 0
+                cambios.append((propietario, filas_propietario, cantidades))
+            escribir_lineas(cambios)
+        return dict(cargados)
+
+
+class MemoriaKV:
+    """
+    Subconjunto de la interfaz de redis-py (hashes, conjuntos, caducidad y
+    pipelines) en memoria del proceso. Cada operación, y cada pipeline
+    completo, es atómica.
+    """
+
+    def __init__(self):
+        self._datos = {}
+        self._caducidad = {}
+        self._lock = threading.RLock()
+
+    def _valor(self, clave, tipo):
+        if clave in self._caducidad and self._caducidad[clave] <= time.monotonic():
+            self._datos.pop(clave, None)
+            self._caducidad.pop(clave)
+        return self._datos.setdefault(clave, tipo())
+
+    def _limpiar(self, clave):
+        if not self._datos.get(clave):
+            self._datos.pop(clave, None)
+            self._caducidad.pop(clave, None)
+
+    def hgetall(self, clave):
+        with self._lock:
+            datos = dict(self._valor(clave, dict))
+            self._limpiar(clave)
+            return datos
+
+    def hset(self, clave, campo, valor):
+        with self._lock:
+            hash_ = self._valor(clave, dict)
+            nuevo = campo not in hash_
+            hash_[campo] = str(valor)
+            return int(nuevo)
+
+    def hsetnx(self, clave, campo, valor):
+        with self._lock:
+            hash_ = self._valor(clave, dict)
+            if campo in hash_:
+                return 0
+            hash_[campo] = str(valor)
+            return 1
+
+    def hget(self, clave, campo):
+        with self._lock:
+            valor = self._valor(clave, dict).get(campo)
+            self._limpiar(clave)
+            return valor
+
+    def hincrby(self, clave, campo, incremento):
+        with self._lock:
+            hash_ = self._valor(clave, dict)
+            hash_[campo] = str(int(hash_.get(campo, 0)) + incremento)
+            return int(hash_[campo])
+
+    def hdel(self, clave, *campos):
+        with self._lock:
+            hash_ = self._valor(clave, dict)
+            borrados = sum(1 for campo in campos if hash_.pop(campo, None) is not None)
+            self._limpiar(clave)
+            return borrados
+
+    def delete(self, *claves):
+        with self._lock:
+            for clave in claves:
+                self._caducidad.pop(clave, None)
+            return sum(1 for clave in claves if self._datos.pop(clave, None) is not None)
+
+    def expire(self, clave, segundos):
+        with self._lock:
+            if clave not in self._datos:
+                return False
+            self._caducidad[clave] = time.monotonic() + segundos
+            return True
+
+    def sadd(self, clave, *miembros):
+        with self._lock:
+            conjunto = self._valor(clave, set)
+            antes = len(conjunto)
+            conjunto.update(miembros)
+            return len(conjunto) - antes
+
+    def srem(self, clave, *miembros):
+        with self._lock:
+            conjunto = self._valor(clave, set)
+            antes = len(conjunto)
+            conjunto.difference_update(miembros)
+            self._limpiar(clave)
+            return antes - len(conjunto)
+
+    def smembers(self, clave):
+        with self._lock:
+            miembros = set(self._valor(clave, set))
+            self._limpiar(clave)
+            return miembros
+
+    def spop(self, clave, count):
+        with self._lock:
+            conjunto = self._valor(clave, set)
+            sacados = [conjunto.pop() for _ in range(min(count, len(conjunto)))]
+            self._limpiar(clave)
+            return sacados
+
+    def pipeline(self, transaction=True):
+        return _PipelineMemoria(self)
+
+
+class _PipelineMemoria:
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._operaciones = []
+
+    def __getattr__(self, nombre):
+        metodo = getattr(self._cliente, nombre)
+
+        def encolar(*args, **kwargs):
+            self._operaciones.append((metodo, args, kwargs))
+            return self
+        return encolar
+
+    def execute(self):
+        with self._cliente._lock:
+            resultados = [metodo(*args, **kwargs) for metodo, args, kwargs in self._operaciones]
+        self._operaciones = []
+        return resultados
+
+
+def compartido(almacen):
+    """True si el almacén escribe en diferido y otro proceso puede volcarlo (no está en esta memoria)"""
+    return hasattr(almacen, 'volcar') and not isinstance(almacen.cliente, MemoriaKV)
+
+
+@lru_cache(maxsize=None)
+def get_almacen():
+    """Almacén configurado (una instancia por proceso)"""
+    configuracion = get_configuracion()
+    almacen = import_string(configuracion['BACKEND'])(**configuracion['OPTIONS'])
+    if hasattr(almacen, 'volcar') and not compartido(almacen) and configuracion['INTERVALO_VOLCADO']:
+        from .tareas import TareaPeriodica
+        TareaPeriodica(almacen.volcar, configuracion['INTERVALO_VOLCADO'], 'volcar_carritos').iniciar()
+    return almacen
+
+
+@receiver(setting_changed)
+def _reiniciar_almacen(setting, **kwargs):
+    if setting == 'TIENDA_ALMACEN_CARRITO':
+        get_almacen.cache_clear()
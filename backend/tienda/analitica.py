@@ -0,0 +1,159 @@
+"""
+Resumen diario de ventas para la analítica. ``VentaDiaria`` guarda una fila
+por día, categoría y método de pago con las líneas, unidades e ingresos de
+las compras no canceladas; ``GET /api/analitica/ventas/`` suma esas filas
+para cualquier rango de fechas sin leer ``Compra`` ni ``CompraItem``.
+
+``actualizar()`` incorpora las compras con id posterior al punto de control
+``resumen_ventas``, de ``LOTE`` en ``LOTE`` (una transacción por lote, que
+agrupa en la base de datos y avanza el punto de control), con ``python
+manage.py resumir_ventas`` desde cron o, si se define ``INTERVALO``, con
+``python manage.py tareas_periodicas``.
+Las compras de los últimos ``MARGEN`` segundos esperan a la siguiente pasada:
+con transacciones concurrentes, una compra puede confirmarse después de otra
+con un id mayor.
+
+El incremental sólo ve compras nuevas: tras cancelar compras ya resumidas o
+cambiar productos de categoría, ``actualizar(completo=True)``
+(``resumir_ventas --completo``) lo reconstruye en una sola transacción.
+"""
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .configuracion import ResultadoLotes, leer
+from .models import Compra, CompraItem, PuntoControl, VentaDiaria
+
+PUNTO_CONTROL = 'resumen_ventas'
+
+CONFIGURACION_POR_DEFECTO = {
+    # Compras por transacción
+    'LOTE': 1000,
+    # Segundos que espera una compra antes de resumirse
+    'MARGEN': 60,
+    # Segundos entre pasadas de la tarea periódica; None = desactivada
+    'INTERVALO': None,
+}
+
+# Agrupaciones de /api/analitica/ventas/ y las columnas de cada una
+AGRUPACIONES = {
+    'dia': ['dia'],
+    'mes': ['mes'],
+    'categoria': ['categoria_id', 'categoria__nombre'],
+    'metodo_pago': ['metodo_pago'],
+}
+MEDIDAS = ('lineas', 'unidades', 'ingresos')
+
+
+def get_configuracion():
+    return leer('TIENDA_ANALITICA', CONFIGURACION_POR_DEFECTO)
+
+
+def agregar(desde_compra, hasta_compra):
+    """{(dia, categoria_id, metodo_pago): (lineas, unidades, ingresos)} de las compras en (desde, hasta]"""
+    filas = (
+        CompraItem.objects.filter(compra_id__gt=desde_compra, compra_id__lte=hasta_compra)
+        .exclude(compra__estado='cancelada')
+        .annotate(dia=TruncDate('compra__fecha_compra'))
+        .values('dia', 'producto__categoria_id', 'compra__metodo_pago')
+        .annotate(lineas=Count('id'), unidades=Sum('cantidad'), ingresos=Sum('subtotal'))
+        .order_by()
+        .values_list('dia', 'producto__categoria_id', 'compra__metodo_pago', *MEDIDAS)
+    )
+    return {tuple(fila[:3]): fila[3:] for fila in filas}
+
+
+def sumar(cambios):
+    """Sumar ``cambios`` (ver ``agregar``) a las filas de ``VentaDiaria``, creando las que falten"""
+    if not cambios:
+        return
+    totales = {clave: list(medidas) for clave, medidas in cambios.items()}
+    # Un lote cae en pocos días: se leen sus filas y se descartan las que no cambian
+    dias, categorias, metodos = (set(columna) for columna in zip(*cambios))
+    existentes = VentaDiaria.objects.filter(
+        dia__in=dias, categoria_id__in=categorias, metodo_pago__in=metodos
+    ).values_list('dia', 'categoria_id', 'metodo_pago', *MEDIDAS)
+    for fila in existentes:
+        if tuple(fila[:3]) in totales:
+            for posicion, valor in enumerate(fila[3:]):
+                totales[tuple(fila[:3])][posicion] += valor
+    VentaDiaria.objects.bulk_create(
+        [
+            VentaDiaria(dia=dia, categoria_id=categoria_id, metodo_pago=metodo_pago,
+                        **dict(zip(MEDIDAS, medidas)))
+            for (dia, categoria_id, metodo_pago), medidas in totales.items()
+        ],
+        update_conflicts=True, unique_fields=['dia', 'categoria', 'metodo_pago'], update_fields=list(MEDIDAS),
+    )
+
+
+@dataclass
+class ResultadoResumen(ResultadoLotes):
+    compras: int = 0
+    filas: int = 0
+
+    def __str__(self):
+        return (f'{self.compras} compras resumidas en {self.filas} filas de ventas diarias '
+                f'({self.lotes} lotes, {self.segundos:.2f}s)')
+
+
+def actualizar(completo=False, lote=None, ahora=None):
+    """Incorporar las compras nuevas (o todas, con ``completo``) a ``VentaDiaria``; devuelve un ResultadoResumen"""
+    configuracion = get_configuracion()
+    lote = lote or configuracion['LOTE']
+    ahora = ahora or timezone.now()
+    resultado = ResultadoResumen()
+    with resultado.cronometrar():
+        # La primera compra demasiado reciente y las posteriores quedan para la siguiente pasada
+        tope = Compra.objects.filter(
+            fecha_compra__gt=ahora - timedelta(seconds=configuracion['MARGEN'])
+        ).aggregate(tope=Min('id'))['tope']
+
+        with transaction.atomic() if completo else nullcontext():
+            if completo:
+                VentaDiaria.objects.all().delete()
+                PuntoControl.objects.update_or_create(nombre=PUNTO_CONTROL, defaults={'ultimo_id': 0})
+            while True:
+                with transaction.atomic():
+                    punto, _ = PuntoControl.objects.select_for_update().get_or_create(nombre=PUNTO_CONTROL)
+                    compras = Compra.objects.filter(id__gt=punto.ultimo_id)
+                    if tope is not None:
+                        compras = compras.filter(id__lt=tope)
+                    ids = list(compras.order_by('id').values_list('id', flat=True)[:lote])
+                    if not ids:
+                        break
+                    cambios = agregar(punto.ultimo_id, ids[-1])
+                    sumar(cambios)
+                    punto.ultimo_id = ids[-1]
+                    punto.save()
+                resultado.compras += len(ids)
+                resultado.filas += len(cambios)
+                resultado.lotes += 1
+    return resultado
+
+
+def consultar(desde=None, hasta=None, agrupar=('dia',)):
+    """
+    Líneas, unidades e ingresos de ``desde`` a ``hasta`` (fechas incluidas)
+    sumando ``VentaDiaria``, agrupados por las claves de ``AGRUPACIONES``.
+    """
+    filas = VentaDiaria.objects.all()
+    if desde:
+        filas = filas.filter(dia__gte=desde)
+    if hasta:
+        filas = filas.filter(dia__lte=hasta)
+    if 'mes' in agrupar:
+        filas = filas.annotate(mes=TruncMonth('dia'))
+    columnas = [columna for clave in agrupar for columna in AGRUPACIONES[clave]]
+    filas = filas.values(*columnas).annotate(**{medida: Sum(medida) for medida in MEDIDAS}).order_by(*columnas)
+    resultado = []
+    for fila in filas:
+        if 'categoria__nombre' in fila:
+            fila['categoria'] = fila.pop('categoria__nombre')
+        resultado.append(fila)
+    return resultado
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class TiendaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tienda'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .busqueda import instalar_indice
+        post_migrate.connect(instalar_indice, sender=self)
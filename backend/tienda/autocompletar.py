@@ -0,0 +1,170 @@
+"""
+Índice de prefijos en memoria para el autocompletado de títulos y autores.
+
+Cada palabra de ``nombre`` y ``autor`` genera una clave normalizada (sin
+acentos, en minúsculas) desde esa palabra hasta el final del texto, de modo
+que "garcia marq" encuentra "Gabriel García Márquez". Las claves se guardan
+en listas ordenadas y se buscan con ``bisect``: una consulta no toca la base
+de datos.
+
+El índice se construye la primera vez que se usa, se actualiza con las
+señales de ``Producto`` y se reconstruye cada ``REFRESCO`` segundos para
+recoger cambios que no emiten señales (``QuerySet.update()``) o hechos en
+otros procesos; mientras una petición lo reconstruye, el resto sigue
+respondiendo con el anterior. Configuración en ``TIENDA_AUTOCOMPLETAR``.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from .busqueda import tokenizar
+from .configuracion import leer
+
+CONFIGURACION_POR_DEFECTO = {
+    # Límite de memoria: productos indexados (los más recientes) y palabras por campo
+    'MAX_PRODUCTOS': 50000,
+    'MAX_PALABRAS': 8,
+    'REFRESCO': 600,
+}
+
+
+def get_configuracion():
+    return leer('TIENDA_AUTOCOMPLETAR', CONFIGURACION_POR_DEFECTO)
+
+
+def claves(texto, max_palabras):
+    """Sufijos por palabra del texto normalizado: "El Señor" -> ["el senor", "senor"]"""
+    palabras = tokenizar(texto)[:max_palabras]
+    return [' '.join(palabras[i:]) for i in range(len(palabras))]
+
+
+class IndicePrefijos:
+    def __init__(self, max_productos=50000, max_palabras=8):
+        self.max_productos = max_productos
+        self.max_palabras = max_palabras
+        self.construido_en = None
+        self._lock = threading.RLock()
+        # Listas ordenadas de (clave, id); las coincidencias de título van antes que las de autor
+        self._nombres = []
+        self._autores = []
+        self._productos = {}  # id -> (nombre, autor)
+
+    def construir(self, filas):
+        """Reconstruir a partir de tuplas (id, nombre, autor)"""
+        nombres, autores, productos = [], [], {}
+        for producto_id, nombre, autor in filas:
+            if len(productos) >= self.max_productos:
+                break
+            productos[producto_id] = (nombre, autor)
+            nombres.extend((clave, producto_id) for clave in claves(nombre, self.max_palabras))
+            autores.extend((clave, producto_id) for clave in claves(autor, self.max_palabras))
+        nombres.sort()
+        autores.sort()
+        with self._lock:
+            self._nombres, self._autores, self._productos = nombres, autores, productos
+            self.construido_en = time.monotonic()
+
+    def agregar(self, producto_id, nombre, autor):
+        with self._lock:
+            self.eliminar(producto_id)
+            if len(self._productos) >= self.max_productos:
+                return
+            self._productos[producto_id] = (nombre, autor)
+            for clave in claves(nombre, self.max_palabras):
+                insort(self._nombres, (clave, producto_id))
+            for clave in claves(autor, self.max_palabras):
+                insort(self._autores, (clave, producto_id))
+
+    def eliminar(self, producto_id):
+        with self._lock:
+            datos = self._productos.pop(producto_id, None)
+            if datos is None:
+                return
+            nombre, autor = datos
+            for lista, texto in ((self._nombres, nombre), (self._autores, autor)):
+                for clave in claves(texto, self.max_palabras):
+                    i = bisect_left(lista, (clave, producto_id))
+                    if i < len(lista) and lista[i] == (clave, producto_id):
+                        del lista[i]
+
+    def buscar(self, texto, limite=8):
+        """Hasta ``limite`` productos cuyo título o autor tenga una palabra que empiece por ``texto``"""
+        prefijo = ' '.join(tokenizar(texto))
+        if not prefijo:
+            return []
+        resultados, vistos = [], set()
+        with self._lock:
+            for lista in (self._nombres, self._autores):
+                i = bisect_left(lista, (prefijo,))
+                while i < len(lista) and len(resultados) < limite:
+                    clave, producto_id = lista[i]
+                    if not clave.startswith(prefijo):
+                        break
+                    if producto_id not in vistos:
+                        vistos.add(producto_id)
+                        nombre, autor = self._productos[producto_id]
+                        resultados.append({'id': producto_id, 'nombre': nombre, 'autor': autor})
+                    i += 1
+        return resultados
+
+    def __len__(self):
+        return len(self._productos)
+
+
+_indice = None
+_lock_indice = threading.Lock()
+
+
+def _construir(configuracion):
+    from .models import Producto
+    indice = IndicePrefijos(configuracion['MAX_PRODUCTOS'], configuracion['MAX_PALABRAS'])
+    indice.construir(
+        Producto.objects.order_by('-created_at')
+        .values_list('id', 'nombre', 'autor')[:indice.max_productos]
+        .iterator()
+    )
+    return indice
+
+
+def get_indice():
+    """
+    Índice del proceso; se construye al usarlo por primera vez. Cuando
+    caduca, la petición que consigue el cerrojo lo reconstruye y las demás
+    siguen usando el actual mientras tanto, sin esperar a la base de datos.
+    """
+    global _indice
+    configuracion = get_configuracion()
+    indice = _indice
+    if indice is None:
+        with _lock_indice:
+            if _indice is None:
+                _indice = _construir(configuracion)
+            return _indice
+    if time.monotonic() - indice.construido_en > configuracion['REFRESCO'] and _lock_indice.acquire(blocking=False):
+        try:
+            if _indice is indice:
+                _indice = _construir(configuracion)
+            indice = _indice
+        finally:
+            _lock_indice.release()
+    return indice
+
+
+def reiniciar_indice():
+    """Descartar el índice; se reconstruirá en el próximo uso"""
+    global _indice
+    with _lock_indice:
+        _indice = None
+
+
+def producto_guardado(sender, instance, update_fields=None, **kwargs):
+    """Receptor de post_save de Producto: sólo actualiza un índice ya construido"""
+    if update_fields is not None and not {'nombre', 'autor'} & set(update_fields):
+        return
+    if _indice is not None:
+        _indice.agregar(instance.pk, instance.nombre, instance.autor)
+
+
+def producto_eliminado(sender, instance, **kwargs):
+    if _indice is not None:
+        _indice.eliminar(instance.pk)
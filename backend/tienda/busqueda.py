@@ -0,0 +1,186 @@
+"""
+Búsqueda de texto completo sobre el catálogo de productos.
+
+El backend activo se elige con el setting ``TIENDA_BUSQUEDA_BACKEND`` (ruta
+de importación de la clase). Por defecto se usa un índice FTS5 de SQLite que
+cubre nombre, autor, descripción y contraportada, pliega acentos y ordena
+los resultados por relevancia (bm25). En otras bases de datos se usa
+``BasicBackend``, que también pliega acentos pero recorre la tabla.
+"""
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+BACKEND_POR_DEFECTO = 'tienda.busqueda.FTS5Backend'
+
+CAMPOS_INDEXADOS = ['nombre', 'autor', 'descripcion', 'contraportada']
+
+
+def normalizar(texto):
+    """Pasar a minúsculas y quitar acentos ("García" -> "garcia")"""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return sin_acentos.casefold()
+
+
+def tokenizar(texto):
+    """Dividir un texto normalizado en palabras"""
+    return re.findall(r'\w+', normalizar(texto))
+
+
+class BusquedaBackend(ABC):
+    """Interfaz común de los backends de búsqueda; los que no implementan ``filtrar`` no se pueden instanciar"""
+
+    def instalar(self, using='default'):
+        """Crear las estructuras del índice si no existen. Devuelve True si se crearon."""
+        return False
+
+    def reconstruir(self, using='default'):
+        """Regenerar el índice completo a partir de la tabla de productos"""
+
+    @abstractmethod
+    def filtrar(self, queryset, termino):
+        """Filtrar el queryset por el término, sin ordenar (p. ej. para agregaciones)"""
+
+    def buscar(self, queryset, termino):
+        """Filtrar el queryset por el término y anotarlo con ``relevancia``"""
+        return self.filtrar(queryset, termino)
+
+
+# Variantes de cada letra que BasicBackend acepta en el texto, mayúsculas
+# incluidas (las regex de algunas bases de datos sólo ignoran el caso en ASCII)
+PLIEGUES = {
+    'a': 'áàâäãåÁÀÂÄÃÅ', 'e': 'éèêëÉÈÊË', 'i': 'íìîïÍÌÎÏ', 'o': 'óòôöõÓÒÔÖÕ',
+    'u': 'úùûüÚÙÛÜ', 'n': 'ñÑ', 'c': 'çÇ',
+}
+
+
+def patron_plegado(palabra):
+    """Expresión regular que encuentra ``palabra`` (ya normalizada) con o sin acentos"""
+    return ''.join(f'[{letra}{PLIEGUES[letra]}]' if letra in PLIEGUES else re.escape(letra) for letra in palabra)
+
+
+class BasicBackend(BusquedaBackend):
+    """
+    Búsqueda por subcadena sobre los cuatro campos; sirve para cualquier base
+    de datos. Pliega acentos y mayúsculas ("garcia marquez" encuentra "García
+    Márquez") con ``iregex``, pero recorre la tabla y no ordena por relevancia.
+    """
+
+    def filtrar(self, queryset, termino):
+        palabras = tokenizar(termino)
+        if not palabras:
+            return queryset.none()
+        for palabra in palabras:
+            patron = patron_plegado(palabra)
+            condicion = Q()
+            for campo in CAMPOS_INDEXADOS:
+                condicion |= Q(**{f'{campo}__iregex': patron})
+            queryset = queryset.filter(condicion)
+        return queryset
+
+
+class FTS5Backend(BusquedaBackend):
+    """
+    Índice FTS5 de contenido externo sobre ``tienda_producto``.
+
+    La tabla virtual se mantiene sincronizada con triggers, de modo que
+    ``save()``, ``QuerySet.update()``, ``bulk_update()``, los borrados en
+    cascada y la edición desde el admin actualizan el índice sin pasar por
+    Python. El tokenizer ``unicode61`` con ``remove_diacritics 2`` pliega los
+    acentos del contenido indexado.
+    """
+    tabla = 'tienda_producto_fts'
+    # Pesos bm25 por columna, en el orden de CAMPOS_INDEXADOS
+    pesos = (10.0, 6.0, 2.0, 1.0)
+
+    def _sentencias(self):
+        columnas = ', '.join(CAMPOS_INDEXADOS)
+        nuevos = ', '.join(f'new.{c}' for c in CAMPOS_INDEXADOS)
+        viejos = ', '.join(f'old.{c}' for c in CAMPOS_INDEXADOS)
+        cambio = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in CAMPOS_INDEXADOS)
+        t = self.tabla
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {t} USING fts5("
+            f"{columnas}, content='tienda_producto', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER IF NOT EXISTS {t}_ai AFTER INSERT ON tienda_producto BEGIN "
+            f"INSERT INTO {t}(rowid, {columnas}) VALUES (new.id, {nuevos}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {t}_ad AFTER DELETE ON tienda_producto BEGIN "
+            f"INSERT INTO {t}({t}, rowid, {columnas}) VALUES ('delete', old.id, {viejos}); END",
+            # Sólo se reindexa si cambia algún campo de texto (no por cambios de stock o precio)
+            f"CREATE TRIGGER IF NOT EXISTS {t}_au AFTER UPDATE ON tienda_producto "
+            f"WHEN {cambio} BEGIN "
+            f"INSERT INTO {t}({t}, rowid, {columnas}) VALUES ('delete', old.id, {viejos}); "
+            f"INSERT INTO {t}(rowid, {columnas}) VALUES (new.id, {nuevos}); END",
+        ]
+
+    def instalar(self, using='default'):
+        conexion = connections[using]
+        if conexion.vendor != 'sqlite':
+            return False
+        with conexion.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+                [self.tabla, f'{self.tabla}_ai', f'{self.tabla}_ad', f'{self.tabla}_au'],
+            )
+            if cursor.fetchone()[0] == 4:
+                return False
+            for sentencia in self._sentencias():
+                cursor.execute(sentencia)
+        # Los triggers pudieron perderse (p. ej. al reconstruir la tabla en una migración)
+        self.reconstruir(using)
+        return True
+
+    def reconstruir(self, using='default'):
+        conexion = connections[using]
+        if conexion.vendor != 'sqlite':
+            return
+        with conexion.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.tabla}({self.tabla}) VALUES ('rebuild')")
+
+    @staticmethod
+    def consulta_fts(termino):
+        """Convertir el texto del usuario en una expresión MATCH segura (AND de prefijos)"""
+        return ' '.join(f'"{palabra}"*' for palabra in tokenizar(termino))
+
+    def filtrar(self, queryset, termino):
+        if connections[queryset.db].vendor != 'sqlite':
+            return BasicBackend().filtrar(queryset, termino)
+        expresion = self.consulta_fts(termino)
+        if not expresion:
+            return queryset.none()
+        t = self.tabla
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {t} WHERE {t} MATCH %s', [expresion]))
+
+    def buscar(self, queryset, termino):
+        if connections[queryset.db].vendor != 'sqlite':
+            return BasicBackend().buscar(queryset, termino)
+        expresion = self.consulta_fts(termino)
+        if not expresion:
+            return queryset.none()
+        t = self.tabla
+        pesos = ', '.join(str(p) for p in self.pesos)
+        # Un solo MATCH: se une la tabla FTS por rowid y bm25 se lee de esa misma fila
+        queryset = queryset.extra(
+            tables=[t], where=[f'{t}.rowid = tienda_producto.id', f'{t} MATCH %s'], params=[expresion],
+        )
+        # bm25 devuelve valores negativos: cuanto menor, más relevante
+        return queryset.annotate(relevancia=RawSQL(f'bm25({t}, {pesos})', [])).order_by('relevancia', 'id')
+
+
+def get_backend():
+    """Instancia del backend de búsqueda configurado"""
+    ruta = getattr(settings, 'TIENDA_BUSQUEDA_BACKEND', BACKEND_POR_DEFECTO)
+    return import_string(ruta)()
+
+
+def instalar_indice(sender, using='default', **kwargs):
+    """Receptor de post_migrate: asegura que el índice exista tras cada migrate"""
+    get_backend().instalar(using)
@@ -0,0 +1,217 @@
+"""
+Caché de respuestas del catálogo (categorías y productos).
+
+Las respuestas se guardan ya serializadas, con una clave formada por la ruta,
+los parámetros de consulta normalizados y la versión actual del catálogo. Al
+cambiar un producto, una categoría o el stock, o al agotarse un producto por
+las reservas, ``incrementar_version()`` cambia la versión y las entradas anteriores dejan
+de usarse sin tener que borrarlas; en todo caso caducan tras ``TTL`` segundos.
+
+La versión vive en la caché de Django ``VERSION_CACHE``. Sólo invalida las
+respuestas de todos los procesos si esa caché es compartida: ``FileBasedCache``
+en una máquina, Redis o Memcached en varias. Con ``LocMemCache`` (lo que
+Django usa sin ``CACHES``) cada proceso tiene su propia versión y sólo ve
+sus propias escrituras hasta que caduca el ``TTL``. Cada proceso guarda en
+memoria la última versión leída durante ``VERSION_TTL`` segundos, así que las
+escrituras de otros procesos tardan eso en verse; las propias, nada.
+
+Configuración (``TIENDA_CACHE_RESPUESTAS`` en settings)::
+
+    {
+        'BACKEND': 'tienda.cache_respuestas.LRUBackend',  # None para desactivar
+        'TTL': 30,
+        'OPTIONS': {'max_bytes': 16 * 1024 * 1024},
+        'VERSION_CACHE': 'tienda_version',  # alias de CACHES
+        'VERSION_TTL': 1,
+    }
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .configuracion import leer
+
+CONFIGURACION_POR_DEFECTO = {
+    'BACKEND': 'tienda.cache_respuestas.LRUBackend',
+    'TTL': 30,
+    'OPTIONS': {},
+    # Caché de Django donde vive el contador de versión; debe ser compartida
+    # entre procesos (ficheros, Redis, Memcached), no LocMemCache
+    'VERSION_CACHE': 'default',
+    # Segundos que cada proceso reutiliza la versión leída sin volver a VERSION_CACHE
+    'VERSION_TTL': 1,
+}
+
+CLAVE_VERSION = 'tienda:catalogo:version'
+
+
+def get_configuracion():
+    return leer('TIENDA_CACHE_RESPUESTAS', CONFIGURACION_POR_DEFECTO)
+
+
+class LRUBackend:
+    """Caché en memoria del proceso; descarta las entradas menos usadas al superar ``max_bytes``"""
+
+    def __init__(self, ttl, max_bytes=16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entradas = OrderedDict()  # clave -> (expira, tamaño, valor)
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] <= time.monotonic():
+                self._quitar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada[2]
+
+    def set(self, clave, valor):
+        tamano = len(json.dumps(valor, cls=JSONEncoder))
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (time.monotonic() + self.ttl, tamano, valor)
+            self.bytes += tamano
+            while self.bytes > self.max_bytes:
+                self._quitar(next(iter(self._entradas)))
+
+    def clear(self):
+        with self._lock:
+            self._entradas.clear()
+            self.bytes = 0
+
+    def _quitar(self, clave):
+        self.bytes -= self._entradas.pop(clave)[1]
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+class DjangoCacheBackend:
+    """Guarda las respuestas en una caché de Django (``alias``), compartida entre procesos"""
+
+    def __init__(self, ttl, alias='default'):
+        self.ttl = ttl
+        self.cache = caches[alias]
+
+    def get(self, clave):
+        return self.cache.get(clave)
+
+    def set(self, clave, valor):
+        self.cache.set(clave, valor, self.ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """Backend configurado (una instancia por proceso) o None si la caché está desactivada"""
+    configuracion = get_configuracion()
+    if not configuracion['BACKEND']:
+        return None
+    clase = import_string(configuracion['BACKEND'])
+    return clase(ttl=configuracion['TTL'], **configuracion['OPTIONS'])
+
+
+@receiver(setting_changed)
+def _reiniciar_backend(setting, **kwargs):
+    if setting == 'TIENDA_CACHE_RESPUESTAS':
+        get_backend.cache_clear()
+        olvidar_version()
+
+
+def _cache_version():
+    return caches[get_configuracion()['VERSION_CACHE']]
+
+
+# Última versión leída o escrita por este proceso: (versión, hasta cuándo vale)
+_version_local = (None, 0.0)
+
+
+def _recordar_version(version):
+    global _version_local
+    _version_local = (version, time.monotonic() + get_configuracion()['VERSION_TTL'])
+
+
+def olvidar_version():
+    """Volver a leer la versión de ``VERSION_CACHE`` en la próxima petición"""
+    global _version_local
+    _version_local = (None, 0.0)
+
+
+def version_catalogo():
+    """Versión actual del catálogo"""
+    version, vale_hasta = _version_local
+    if version is not None and time.monotonic() < vale_hasta:
+        return version
+    # Si la clave se pierde (reinicio, desalojo) se parte de un valor nuevo,
+    # nunca de uno ya usado, para no servir entradas antiguas
+    version = _cache_version().get(CLAVE_VERSION)
+    if version is None:
+        _cache_version().add(CLAVE_VERSION, time.time_ns(), None)
+        version = _cache_version().get(CLAVE_VERSION)
+    _recordar_version(version)
+    return version
+
+
+def incrementar_version(**kwargs):
+    """Invalidar todas las respuestas cacheadas del catálogo (también sirve como receptor de señales)"""
+    try:
+        version = _cache_version().incr(CLAVE_VERSION)
+    except ValueError:
+        version = time.time_ns()
+        _cache_version().set(CLAVE_VERSION, version, None)
+    _recordar_version(version)
+
+
+def clave_respuesta(request):
+    """Clave a partir de host, ruta, parámetros normalizados y versión del catálogo"""
+    parametros = sorted(
+        (nombre, sorted(v for v in valores if v))
+        for nombre, valores in request.query_params.lists()
+    )
+    parametros = [(nombre, valores) for nombre, valores in parametros if valores]
+    base = json.dumps([request.get_host(), request.path, parametros, version_catalogo()])
+    return 'tienda:respuesta:' + hashlib.md5(base.encode()).hexdigest()
+
+
+class CacheRespuestasMixin:
+    """Sirve ``list`` y ``retrieve`` desde la caché de respuestas"""
+
+    def list(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().retrieve, request, *args, **kwargs)
+
+    def _respuesta_cacheada(self, vista, request, *args, **kwargs):
+        backend = get_backend()
+        if backend is None:
+            return vista(request, *args, **kwargs)
+        clave = clave_respuesta(request)
+        datos = backend.get(clave)
+        if datos is not None:
+            return Response(datos, headers={'X-Cache': 'HIT'})
+        response = vista(request, *args, **kwargs)
+        if response.status_code == 200:
+            backend.set(clave, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
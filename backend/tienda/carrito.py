@@ -0,0 +1,79 @@
+"""
+Operaciones sobre carritos completos.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import reservas
+from .almacen_carrito import Propietario, get_almacen
+from .models import CarritoItem
+
+
+def fusionar_carrito_invitado(usuario, session_key):
+    """
+    Pasar el carrito del invitado ``session_key`` al de ``usuario`` con un
+    número fijo de consultas: una lectura de ambos carritos, un bulk_update
+    (cantidades sumadas, sin superar el stock, y líneas del invitado que pasan
+    al usuario) y un borrado de las líneas del invitado ya sumadas.
+    Devuelve cuántas líneas del invitado se incorporaron.
+    """
+    if not session_key:
+        return 0
+    # Con un almacén write-behind se fusiona lo último que hay en él, y
+    # después se descarta su copia de los dos carritos
+    almacen = get_almacen()
+    propietarios = [Propietario.de(usuario), Propietario(None, session_key)]
+    for propietario in propietarios:
+        almacen.instantanea(propietario)
+    try:
+        fusionadas = _fusionar(usuario, session_key)
+        if reservas.activas():
+            reservas.transferir(propietarios[1], propietarios[0])
+        return fusionadas
+    finally:
+        for propietario in propietarios:
+            almacen.invalidar(propietario)
+
+
+def _fusionar(usuario, session_key):
+    with transaction.atomic():
+        lineas = list(
+            CarritoItem.objects.filter(Q(usuario=usuario) | Q(session_key=session_key, usuario__isnull=True))
+            .select_related('producto')
+            .only('id', 'usuario_id', 'session_key', 'cantidad', 'producto__stock')
+            .order_by()
+        )
+        invitado = [linea for linea in lineas if linea.usuario_id is None]
+        if not invitado:
+            return 0
+        del_usuario = {linea.producto_id: linea for linea in lineas if linea.usuario_id is not None}
+
+        ahora = timezone.now()
+        cambiadas, borrar = [], []
+        for linea in invitado:
+            destino = del_usuario.get(linea.producto_id)
+            stock = linea.producto.stock
+            if destino is not None:
+                # El producto ya estaba en el carrito del usuario: se suman las cantidades
+                cantidad = min(destino.cantidad + linea.cantidad, max(stock, destino.cantidad))
+                if cantidad != destino.cantidad:
+                    destino.cantidad = cantidad
+                    destino.updated_at = ahora
+                    cambiadas.append(destino)
+                borrar.append(linea.id)
+            elif stock < 1:
+                borrar.append(linea.id)
+            else:
+                # Línea nueva para el usuario: se reasigna la del invitado en lugar de copiarla
+                linea.usuario = usuario
+                linea.session_key = None
+                linea.cantidad = min(linea.cantidad, stock)
+                linea.updated_at = ahora
+                cambiadas.append(linea)
+
+        if borrar:
+            CarritoItem.objects.filter(id__in=borrar).delete()
+        if cambiadas:
+            CarritoItem.objects.bulk_update(cambiadas, ['usuario', 'session_key', 'cantidad', 'updated_at'])
+    return len(invitado)
@@ -0,0 +1,155 @@
+"""
+Cola de trabajos en segundo plano sobre la base de datos (sin broker externo).
+
+``encolar(funcion, **argumentos)`` guarda un ``Trabajo`` cuando la transacción
+en curso se confirma (``transaction.on_commit``): si la transacción se
+deshace no queda nada encolado, y la petición sólo paga un INSERT. Los
+argumentos deben poder guardarse como JSON (ids, no objetos).
+
+``python manage.py procesar_trabajos`` los ejecuta con un pool de hilos:
+
+- Toma lotes de ``LOTE`` trabajos de una vez y los marca ``en_curso`` durante
+  ``VISIBILIDAD`` segundos; si el worker muere, al vencer ese plazo otro los
+  vuelve a tomar (cuenta como un intento más).
+- Un trabajo que termina bien se borra. Uno que falla se reintenta con
+  espera exponencial (``ESPERA_BASE`` * 2^(intentos-1), hasta ``ESPERA_MAXIMA``)
+  y, tras ``MAX_INTENTOS``, queda como ``fallido`` con su último error.
+
+Configuración en ``TIENDA_COLA``.
+"""
+import logging
+import os
+import socket
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .configuracion import leer
+from .models import Trabajo
+
+logger = logging.getLogger(__name__)
+
+CONFIGURACION_POR_DEFECTO = {
+    'LOTE': 20,
+    'HILOS': 4,
+    'VISIBILIDAD': 300,
+    'MAX_INTENTOS': 5,
+    'ESPERA_BASE': 10,
+    'ESPERA_MAXIMA': 3600,
+}
+
+
+def get_configuracion():
+    return leer('TIENDA_COLA', CONFIGURACION_POR_DEFECTO)
+
+
+def encolar(funcion, max_intentos=None, **argumentos):
+    """Ejecutar ``funcion(**argumentos)`` en segundo plano cuando se confirme la transacción en curso"""
+    tarea = funcion if isinstance(funcion, str) else f'{funcion.__module__}.{funcion.__qualname__}'
+    max_intentos = max_intentos or get_configuracion()['MAX_INTENTOS']
+    transaction.on_commit(lambda: Trabajo.objects.create(
+        tarea=tarea, argumentos=argumentos, max_intentos=max_intentos
+    ))
+
+
+def nombre_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def tomar(trabajador, lote, visibilidad, ahora=None):
+    """Reservar hasta ``lote`` trabajos visibles para ``trabajador`` durante ``visibilidad`` segundos"""
+    ahora = ahora or timezone.now()
+    with transaction.atomic():
+        # Un trabajo que agotó sus intentos sin terminar (el worker murió o se
+        # colgó) no se vuelve a tomar: ejecutar() nunca llegó a marcarlo fallido
+        vencidos = Trabajo.objects.filter(
+            estado='en_curso', visible_desde__lte=ahora, intentos__gte=F('max_intentos')
+        ).update(estado='fallido', ultimo_error='El último intento no terminó antes de que venciera su plazo')
+        if vencidos:
+            logger.error('%s trabajos fallidos por agotar los intentos sin terminar', vencidos)
+        # skip_locked: en bases de datos con bloqueo por fila, varios workers
+        # toman lotes distintos sin esperarse; SQLite serializa la transacción
+        ids = list(
+            Trabajo.objects.filter(estado__in=['pendiente', 'en_curso'], visible_desde__lte=ahora)
+            .order_by('visible_desde', 'id').select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:lote]
+        )
+        if not ids:
+            return []
+        Trabajo.objects.filter(id__in=ids).update(
+            estado='en_curso', trabajador=trabajador, intentos=F('intentos') + 1,
+            visible_desde=ahora + timedelta(seconds=visibilidad),
+        )
+        return list(Trabajo.objects.filter(id__in=ids).order_by('visible_desde', 'id'))
+
+
+def espera(intentos):
+    """Segundos hasta el siguiente intento tras ``intentos`` fallos"""
+    configuracion = get_configuracion()
+    return min(configuracion['ESPERA_BASE'] * 2 ** (intentos - 1), configuracion['ESPERA_MAXIMA'])
+
+
+def ejecutar(trabajo):
+    """Ejecutar un trabajo ya tomado y registrar el resultado; devuelve True si terminó bien"""
+    # Sólo si sigue siendo de este worker: si se le pasó el plazo, puede tenerlo otro
+    propio = Trabajo.objects.filter(pk=trabajo.pk, trabajador=trabajo.trabajador, intentos=trabajo.intentos)
+    try:
+        import_string(trabajo.tarea)(**trabajo.argumentos)
+    except Exception:
+        error = traceback.format_exc()
+        if trabajo.intentos >= trabajo.max_intentos:
+            logger.error('Trabajo %s fallido tras %s intentos:\n%s', trabajo, trabajo.intentos, error)
+            propio.update(estado='fallido', ultimo_error=error)
+        else:
+            logger.warning('Trabajo %s falló, se reintentará:\n%s', trabajo, error)
+            propio.update(
+                estado='pendiente', ultimo_error=error,
+                visible_desde=timezone.now() + timedelta(seconds=espera(trabajo.intentos)),
+            )
+        return False
+    propio.delete()
+    return True
+
+
+@dataclass
+class ResultadoRonda:
+    hechos: int = 0
+    fallidos: int = 0
+
+    @property
+    def tomados(self):
+        return self.hechos + self.fallidos
+
+    def __str__(self):
+        return f'{self.hechos} trabajos hechos, {self.fallidos} con error'
+
+
+def _ejecutar_en_hilo(trabajo):
+    close_old_connections()
+    try:
+        return ejecutar(trabajo)
+    finally:
+        close_old_connections()
+
+
+def procesar(lote=None, visibilidad=None, trabajador=None, pool=None):
+    """
+    Tomar un lote y ejecutarlo en ``pool`` (un ThreadPoolExecutor) o, sin
+    él, en el hilo actual; devuelve un ResultadoRonda.
+    """
+    configuracion = get_configuracion()
+    trabajos = tomar(
+        trabajador or nombre_trabajador(),
+        lote or configuracion['LOTE'],
+        visibilidad or configuracion['VISIBILIDAD'],
+    )
+    if pool is not None:
+        resultados = list(pool.map(_ejecutar_en_hilo, trabajos))
+    else:
+        resultados = [ejecutar(trabajo) for trabajo in trabajos]
+    return ResultadoRonda(hechos=resultados.count(True), fallidos=resultados.count(False))
@@ -0,0 +1,32 @@
+"""
+Piezas comunes de los módulos de la tienda: la lectura de su configuración
+(un dict ``TIENDA_*`` en settings sobre unos valores por defecto) y el
+resultado de los procesos que trabajan por lotes.
+"""
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+
+
+def leer(nombre, por_defecto):
+    """Valores de ``por_defecto`` con los que el setting ``nombre`` sobrescriba"""
+    configuracion = dict(por_defecto)
+    configuracion.update(getattr(settings, nombre, {}))
+    return configuracion
+
+
+@dataclass
+class ResultadoLotes:
+    lotes: int = 0
+    segundos: float = 0.0
+
+    @contextmanager
+    def cronometrar(self):
+        """Guardar en ``segundos`` lo que tarda el bloque"""
+        inicio = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.segundos = time.monotonic() - inicio
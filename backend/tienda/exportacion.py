@@ -0,0 +1,162 @@
+"""
+Exportación completa de compras y líneas de compra en CSV o NDJSON, en
+streaming: ``GET /api/exportar/`` (sólo staff) y ``python manage.py
+exportar_compras``.
+
+Las filas se leen con ``values_list`` (sin instanciar modelos) y
+``.iterator(chunk_size=LOTE)`` (sin cargar el resultado entero) y se
+escriben de ``LOTE`` en ``LOTE``: la memoria no depende del tamaño de la
+exportación. Se puede filtrar por rango de ``fecha_compra`` y por estado.
+Configuración en ``TIENDA_EXPORTACION``.
+"""
+import csv
+import io
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .configuracion import leer
+from .models import Compra, CompraItem
+
+CONFIGURACION_POR_DEFECTO = {
+    # Filas por lectura de la base de datos y por trozo escrito
+    'LOTE': 2000,
+}
+
+# (columna del fichero, campo) de cada tipo de exportación
+COLUMNAS = {
+    'compras': [
+        ('id', 'id'),
+        ('usuario_id', 'usuario_id'),
+        ('usuario', 'usuario__username'),
+        ('fecha_compra', 'fecha_compra'),
+        ('estado', 'estado'),
+        ('metodo_pago', 'metodo_pago'),
+        ('total', 'total'),
+    ],
+    'lineas': [
+        ('id', 'id'),
+        ('compra_id', 'compra_id'),
+        ('fecha_compra', 'compra__fecha_compra'),
+        ('estado', 'compra__estado'),
+        ('usuario_id', 'compra__usuario_id'),
+        ('producto_id', 'producto_id'),
+        ('producto', 'producto__nombre'),
+        ('cantidad', 'cantidad'),
+        ('precio_unitario', 'precio_unitario'),
+        ('subtotal', 'subtotal'),
+    ],
+}
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+ESTADOS = [estado for estado, _ in Compra._meta.get_field('estado').choices]
+
+
+def get_configuracion():
+    return leer('TIENDA_EXPORTACION', CONFIGURACION_POR_DEFECTO)
+
+
+def parsear_fecha(valor, fin_del_dia=False):
+    """
+    Fecha y hora ISO 8601 con zona horaria. Una fecha sola es el inicio de
+    ese día o, con ``fin_del_dia``, el del siguiente. ValueError si no es válida.
+    """
+    dia = parse_date(valor)
+    if dia is not None:
+        fecha = datetime.combine(dia + timedelta(days=fin_del_dia), time.min)
+    else:
+        fecha = parse_datetime(valor)
+        if fecha is None:
+            raise ValueError(valor)
+    return timezone.make_aware(fecha) if timezone.is_naive(fecha) else fecha
+
+
+def parsear_estados(valor):
+    """Estados separados por comas; ValueError si alguno no existe"""
+    estados = [estado.strip() for estado in valor.split(',') if estado.strip()]
+    if any(estado not in ESTADOS for estado in estados):
+        raise ValueError(valor)
+    return estados
+
+
+def filtro_compras(desde=None, hasta=None, estados=None, prefijo=''):
+    """Compras con ``desde <= fecha_compra < hasta`` y en ``estados`` (``prefijo``: ruta hasta la compra)"""
+    filtro = Q()
+    if desde:
+        filtro &= Q(**{f'{prefijo}fecha_compra__gte': desde})
+    if hasta:
+        filtro &= Q(**{f'{prefijo}fecha_compra__lt': hasta})
+    if estados:
+        filtro &= Q(**{f'{prefijo}estado__in': estados})
+    return filtro
+
+
+class Exportacion:
+    """
+    Iterable con el contenido de la exportación en trozos de texto, listo
+    para ``StreamingHttpResponse`` o para escribirlo en un fichero. Tras
+    recorrerlo, ``filas`` tiene el número de filas exportadas.
+    """
+
+    def __init__(self, tipo='compras', formato='csv', desde=None, hasta=None, estados=None, lote=None):
+        if tipo not in COLUMNAS:
+            raise ValueError(f'Tipo no válido. Opciones: {", ".join(COLUMNAS)}')
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato no válido. Opciones: {", ".join(FORMATOS)}')
+        self.tipo, self.formato = tipo, formato
+        self.desde, self.hasta, self.estados = desde, hasta, estados
+        self.lote = lote or get_configuracion()['LOTE']
+        self.filas = 0
+
+    @property
+    def content_type(self):
+        return FORMATOS[self.formato]
+
+    @property
+    def nombre_archivo(self):
+        return f'{self.tipo}-{timezone.localdate():%Y%m%d}.{self.formato}'
+
+    def queryset(self):
+        campos = [campo for _, campo in COLUMNAS[self.tipo]]
+        if self.tipo == 'compras':
+            # compra_fecha_idx entrega las filas ya ordenadas
+            return Compra.objects.filter(filtro_compras(self.desde, self.hasta, self.estados)).order_by(
+                'fecha_compra', 'id'
+            ).values_list(*campos)
+        return CompraItem.objects.filter(filtro_compras(self.desde, self.hasta, self.estados, 'compra__')).order_by(
+            'compra_id', 'id'
+        ).values_list(*campos)
+
+    def _texto_csv(self, filas):
+        salida = io.StringIO()
+        escritor = csv.writer(salida)
+        escritor.writerows(
+            [valor.isoformat() if isinstance(valor, datetime) else valor for valor in fila] for fila in filas
+        )
+        return salida.getvalue()
+
+    def _texto_ndjson(self, filas):
+        columnas = [columna for columna, _ in COLUMNAS[self.tipo]]
+        return ''.join(json.dumps(dict(zip(columnas, fila)), cls=DjangoJSONEncoder) + '\n' for fila in filas)
+
+    def __iter__(self):
+        texto = self._texto_csv if self.formato == 'csv' else self._texto_ndjson
+        self.filas = 0
+        if self.formato == 'csv':
+            yield texto([[columna for columna, _ in COLUMNAS[self.tipo]]])
+        pendientes = []
+        for fila in self.queryset().iterator(chunk_size=self.lote):
+            pendientes.append(fila)
+            if len(pendientes) == self.lote:
+                self.filas += len(pendientes)
+                yield texto(pendientes)
+                pendientes = []
+        if pendientes:
+            self.filas += len(pendientes)
+            yield texto(pendientes)
@@ -0,0 +1,156 @@
+"""
+Cabecera ``Idempotency-Key`` para las escrituras que los clientes reintentan
+(checkout y añadir al carrito).
+
+La primera petición con una clave la reserva (una fila de
+``ClaveIdempotencia``, única por dueño y clave) y, al terminar, guarda su
+estado y su respuesta. Un reintento con la misma clave recibe esa respuesta
+sin volver a ejecutar la vista (con la cabecera ``Idempotent-Replayed``); si
+la original sigue en curso recibe un 409 y, si los datos no coinciden, un 422.
+Las respuestas 5xx y las excepciones liberan la clave para poder reintentar;
+si el proceso muere sin llegar a liberarla, la reserva vence a los
+``PLAZO_EN_CURSO`` segundos y el siguiente reintento la toma. Los invitados
+sin carrito comparten dueño sólo si vienen de la misma dirección y navegador.
+
+Las claves con respuesta caducan a los ``TTL`` segundos. ``purgar_claves()`` borra las
+caducadas, con ``python manage.py purgar_idempotencia`` desde cron o, si se
+define ``INTERVALO_PURGA``, con ``python manage.py tareas_periodicas``.
+Configuración en ``TIENDA_IDEMPOTENCIA``.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .almacen_carrito import Propietario
+from .configuracion import leer
+from .models import ClaveIdempotencia
+
+CABECERA = 'Idempotency-Key'
+LONGITUD_MAXIMA = ClaveIdempotencia._meta.get_field('clave').max_length
+
+CONFIGURACION_POR_DEFECTO = {
+    'TTL': 24 * 3600,
+    # Segundos que una petición en curso retiene su clave; debe superar lo que tarda la vista
+    'PLAZO_EN_CURSO': 60,
+    # Segundos entre purgas de la tarea periódica; None = desactivada
+    'INTERVALO_PURGA': None,
+}
+
+
+def get_configuracion():
+    return leer('TIENDA_IDEMPOTENCIA', CONFIGURACION_POR_DEFECTO)
+
+
+def ambito(request):
+    """Dueño de la clave: el usuario, el carrito de invitado o, sin carrito, la dirección y el navegador"""
+    session_key = request.query_params.get('session_key')
+    if isinstance(request.data, dict):
+        session_key = request.data.get('session_key') or session_key
+    propietario = Propietario.de(request.user, session_key)
+    if not propietario.vacio:
+        return propietario.clave
+    cliente = f"{request.META.get('REMOTE_ADDR', '')} {request.headers.get('User-Agent', '')}"
+    return 'a:' + hashlib.sha256(cliente.encode()).hexdigest()[:40]
+
+
+def huella(request):
+    """Hash de método, ruta y datos: una clave sólo vale para la misma petición"""
+    datos = request.data
+    if hasattr(datos, 'lists'):
+        datos = dict(datos.lists())
+    contenido = json.dumps([request.method, request.path, datos], sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+def reservar(ambito, clave, huella, plazo):
+    """
+    (registro, reservada): la fila de la clave y si esta petición la acaba de
+    reservar (es nueva o había caducado) o ya era de otra. La reserva vale
+    ``plazo`` segundos mientras la petición no termina.
+    """
+    while True:
+        ahora = timezone.now()
+        caduca = ahora + timedelta(seconds=plazo)
+        # Lo habitual en un reintento: una lectura por el índice único
+        registro = ClaveIdempotencia.objects.filter(ambito=ambito, clave=clave).first()
+        if registro is None:
+            try:
+                with transaction.atomic():
+                    return ClaveIdempotencia.objects.create(
+                        ambito=ambito, clave=clave, huella=huella, caduca=caduca
+                    ), True
+            except IntegrityError:
+                # Otra petición con la misma clave la reservó a la vez
+                continue
+        if registro.caduca > ahora:
+            return registro, False
+        # Caducada: se reutiliza, salvo que otra petición la haya tomado antes
+        renovada = ClaveIdempotencia.objects.filter(pk=registro.pk, caduca=registro.caduca).update(
+            huella=huella, estado_http=None, respuesta=None, creada=ahora, caduca=caduca
+        )
+        if renovada:
+            registro.huella, registro.estado_http, registro.respuesta = huella, None, None
+            registro.creada = ahora
+            return registro, True
+
+
+def idempotente(vista):
+    """Decorador para métodos de un ViewSet que aceptan ``Idempotency-Key``"""
+    @wraps(vista)
+    def envoltura(self, request, *args, **kwargs):
+        clave = request.headers.get(CABECERA)
+        if clave is None:
+            return vista(self, request, *args, **kwargs)
+        if not clave or len(clave) > LONGITUD_MAXIMA:
+            return Response(
+                {'error': f'{CABECERA} debe tener entre 1 y {LONGITUD_MAXIMA} caracteres'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        configuracion = get_configuracion()
+        firma = huella(request)
+        registro, reservada = reservar(ambito(request), clave, firma, configuracion['PLAZO_EN_CURSO'])
+        if not reservada:
+            if registro.huella != firma:
+                return Response(
+                    {'error': f'Esta {CABECERA} ya se usó con otra petición'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if registro.estado_http is None:
+                return Response(
+                    {'error': f'Ya hay una petición en curso con esta {CABECERA}'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            return Response(registro.respuesta, status=registro.estado_http, headers={'Idempotent-Replayed': 'true'})
+
+        # Sólo mientras siga siendo de esta petición (otra la toma si vence el plazo)
+        liberar = ClaveIdempotencia.objects.filter(pk=registro.pk, creada=registro.creada)
+        try:
+            response = vista(self, request, *args, **kwargs)
+        except Exception:
+            liberar.delete()
+            raise
+        if response.status_code >= 500:
+            liberar.delete()
+        else:
+            # Se guarda tal como lo recibe el cliente (decimales, fechas...) en JSON
+            liberar.update(
+                estado_http=response.status_code,
+                respuesta=json.loads(JSONRenderer().render(response.data)),
+                caduca=timezone.now() + timedelta(seconds=configuracion['TTL']),
+            )
+        return response
+    return envoltura
+
+
+def purgar_claves(ahora=None):
+    """Borrar las claves caducadas; devuelve cuántas"""
+    borradas, _ = ClaveIdempotencia.objects.filter(caduca__lte=ahora or timezone.now()).delete()
+    return borradas
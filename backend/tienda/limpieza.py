@@ -0,0 +1,74 @@
+"""
+Limpieza de carritos de invitados abandonados.
+
+Los carritos de invitados son filas de ``CarritoItem`` con ``session_key`` y
+nada las caduca. ``limpiar_carritos_invitados()`` borra los carritos sin
+actividad (ninguna línea modificada) en los últimos ``TTL_DIAS`` días. Borra
+por rangos de id de ``LOTE`` filas, cada uno en su propia transacción corta,
+para no bloquear la tabla mientras el checkout escribe.
+
+Se ejecuta con ``python manage.py limpiar_carritos`` (p. ej. desde cron) o
+como tarea periódica de ``python manage.py tareas_periodicas`` si se define
+``INTERVALO`` (ver ``tienda/tareas.py``). Configuración en ``TIENDA_LIMPIEZA_CARRITOS``.
+"""
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .configuracion import ResultadoLotes, leer
+from .models import CarritoItem
+
+CONFIGURACION_POR_DEFECTO = {
+    'TTL_DIAS': 30,
+    'LOTE': 1000,
+    # Segundos de espera entre lotes para dejar paso a otras escrituras
+    'PAUSA': 0,
+    # Segundos entre ejecuciones de la tarea periódica; None = desactivada
+    'INTERVALO': None,
+}
+
+
+def get_configuracion():
+    return leer('TIENDA_LIMPIEZA_CARRITOS', CONFIGURACION_POR_DEFECTO)
+
+
+@dataclass
+class ResultadoLimpieza(ResultadoLotes):
+    borrados: int = 0
+
+    @property
+    def por_segundo(self):
+        return self.borrados / self.segundos if self.segundos else 0.0
+
+    def __str__(self):
+        return (f'{self.borrados} líneas borradas en {self.lotes} lotes '
+                f'({self.segundos:.2f}s, {self.por_segundo:.0f} líneas/s)')
+
+
+def limpiar_carritos_invitados(ttl_dias=None, lote=None, pausa=None, ahora=None):
+    """Borrar los carritos de invitados sin actividad en ``ttl_dias``; devuelve un ResultadoLimpieza"""
+    configuracion = get_configuracion()
+    ttl_dias = configuracion['TTL_DIAS'] if ttl_dias is None else ttl_dias
+    lote = lote or configuracion['LOTE']
+    pausa = configuracion['PAUSA'] if pausa is None else pausa
+    limite = (ahora or timezone.now()) - timedelta(days=ttl_dias)
+
+    invitados = CarritoItem.objects.filter(session_key__isnull=False)
+    # Sesiones con alguna línea reciente: se conservan enteras (índice session_key, updated_at)
+    activas = invitados.filter(updated_at__gte=limite).values('session_key')
+    caducadas = invitados.filter(updated_at__lt=limite).exclude(session_key__in=activas)
+
+    resultado = ResultadoLimpieza()
+    with resultado.cronometrar():
+        rango = caducadas.aggregate(desde=Min('id'), hasta=Max('id'))
+        if rango['desde'] is not None:
+            for desde in range(rango['desde'], rango['hasta'] + 1, lote):
+                borrados, _ = caducadas.filter(id__gte=desde, id__lt=desde + lote).delete()
+                resultado.borrados += borrados
+                resultado.lotes += 1
+                if pausa:
+                    time.sleep(pausa)
+    return resultado
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from tienda import recomendaciones
+
+
+class Command(BaseCommand):
+    help = 'Calcula los productos comprados juntos a menudo a partir de las compras nuevas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true',
+                            help='Recalcular desde cero con todas las compras')
+        parser.add_argument('--top', type=int, default=recomendaciones.TOP_K,
+                            help='Productos relacionados que se guardan por producto')
+
+    def handle(self, *args, **options):
+        actualizados = recomendaciones.actualizar(completo=options['completo'], top_k=options['top'])
+        self.stdout.write(self.style.SUCCESS(f'[OK] Relacionados actualizados para {actualizados} productos'))
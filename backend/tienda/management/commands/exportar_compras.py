@@ -0,0 +1,52 @@
+from argparse import ArgumentTypeError
+
+from django.core.management.base import BaseCommand, CommandError
+from tienda.exportacion import COLUMNAS, FORMATOS, Exportacion, parsear_estados, parsear_fecha
+
+
+def fecha(fin_del_dia=False):
+    def convertir(valor):
+        try:
+            return parsear_fecha(valor, fin_del_dia)
+        except ValueError:
+            raise ArgumentTypeError('formato AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS')
+    return convertir
+
+
+def estados(valor):
+    try:
+        return parsear_estados(valor)
+    except ValueError:
+        raise ArgumentTypeError('estados separados por comas')
+
+
+class Command(BaseCommand):
+    help = 'Exporta las compras o sus líneas en CSV o NDJSON, en streaming (memoria constante)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=list(COLUMNAS), default='compras')
+        parser.add_argument('--formato', choices=list(FORMATOS), default='csv')
+        parser.add_argument('--desde', type=fecha(), help='Desde esta fecha (incluida)')
+        parser.add_argument('--hasta', type=fecha(fin_del_dia=True), help='Hasta esta fecha (incluida)')
+        parser.add_argument('--estado', type=estados, help='Uno o varios estados separados por comas')
+        parser.add_argument('--lote', type=int, help='Filas por lectura (por defecto LOTE)')
+        parser.add_argument('--salida', default='-', help='Fichero de salida (por defecto, la salida estándar)')
+
+    def handle(self, *args, **options):
+        exportacion = Exportacion(
+            tipo=options['tipo'], formato=options['formato'], desde=options['desde'],
+            hasta=options['hasta'], estados=options['estado'], lote=options['lote'],
+        )
+        if options['salida'] == '-':
+            destino, mensajes = self.stdout, self.stderr
+            for trozo in exportacion:
+                destino.write(trozo, ending='')
+        else:
+            mensajes = self.stdout
+            try:
+                with open(options['salida'], 'w', encoding='utf-8', newline='') as destino:
+                    for trozo in exportacion:
+                        destino.write(trozo)
+            except OSError as error:
+                raise CommandError(f'No se pudo escribir {options["salida"]}: {error}')
+        mensajes.write(self.style.SUCCESS(f'[OK] {exportacion.filas} filas exportadas ({options["tipo"]})'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from tienda.reservas import liberar_caducadas
+
+
+class Command(BaseCommand):
+    help = 'Devuelve al stock libre las reservas de carrito caducadas, por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, help='Reservas por lote (por defecto LOTE)')
+
+    def handle(self, *args, **options):
+        resultado = liberar_caducadas(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'[OK] {resultado}'))
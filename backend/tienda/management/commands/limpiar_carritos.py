@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from tienda.limpieza import limpiar_carritos_invitados
+
+
+class Command(BaseCommand):
+    help = 'Borra los carritos de invitados sin actividad reciente, por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, help='Días sin actividad (por defecto TTL_DIAS)')
+        parser.add_argument('--lote', type=int, help='Filas por lote (por defecto LOTE)')
+        parser.add_argument('--pausa', type=float, help='Segundos de espera entre lotes')
+
+    def handle(self, *args, **options):
+        resultado = limpiar_carritos_invitados(
+            ttl_dias=options['dias'], lote=options['lote'], pausa=options['pausa']
+        )
+        self.stdout.write(self.style.SUCCESS(f'[OK] {resultado}'))
@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+from tienda import cola
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta los trabajos en segundo plano encolados en la base de datos'
+
+    def add_arguments(self, parser):
+        configuracion = cola.get_configuracion()
+        parser.add_argument('--hilos', type=int, default=configuracion['HILOS'],
+                            help='Trabajos que se ejecutan a la vez')
+        parser.add_argument('--lote', type=int, default=configuracion['LOTE'],
+                            help='Trabajos que se toman de cada vez')
+        parser.add_argument('--visibilidad', type=int, default=configuracion['VISIBILIDAD'],
+                            help='Segundos antes de que otro worker pueda retomar un trabajo sin terminar')
+        parser.add_argument('--espera', type=float, default=1.0,
+                            help='Segundos de espera cuando no hay trabajo')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesar lo pendiente y salir')
+
+    def handle(self, *args, **options):
+        trabajador = cola.nombre_trabajador()
+        total = cola.ResultadoRonda()
+        # Con un solo hilo se ejecutan en el del comando
+        hilos = options['hilos']
+        with ThreadPoolExecutor(hilos) if hilos > 1 else nullcontext() as pool:
+            try:
+                while True:
+                    ronda = cola.procesar(options['lote'], options['visibilidad'], trabajador, pool)
+                    total.hechos += ronda.hechos
+                    total.fallidos += ronda.fallidos
+                    if not ronda.tomados:
+                        if options['una_vez']:
+                            break
+                        time.sleep(options['espera'])
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(self.style.SUCCESS(f'[OK] {total}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from tienda.prueba_carga import simular_checkout, validar_prefijo
+
+
+class Command(BaseCommand):
+    help = ('Prueba de carga del checkout: muchos compradores a la vez por las últimas unidades. '
+            'Crea y borra sus propios datos; no usar contra la base de datos de producción')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compradores', type=int, default=100, help='Checkouts a lanzar')
+        parser.add_argument('--stock', type=int, default=10, help='Unidades del producto que todos quieren')
+        parser.add_argument('--hilos', type=int, default=8, help='Checkouts a la vez')
+        parser.add_argument('--prefijo', default='carga-', help='Prefijo de los usuarios y productos de la prueba')
+        parser.add_argument('--conservar', action='store_true', help='No borrar los datos de la prueba al terminar')
+
+    def handle(self, *args, **options):
+        try:
+            validar_prefijo(options['prefijo'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        resultado = simular_checkout(
+            compradores=options['compradores'], stock=options['stock'], hilos=options['hilos'],
+            prefijo=options['prefijo'], conservar=options['conservar'],
+        )
+        self.stdout.write(str(resultado))
+        if not resultado.correcto:
+            raise CommandError('El checkout vendió de más o dejó compras descuadradas')
+        self.stdout.write(self.style.SUCCESS('[OK] Sin ventas de más ni compras descuadradas'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from tienda.idempotencia import purgar_claves
+
+
+class Command(BaseCommand):
+    help = 'Borra las claves de idempotencia caducadas'
+
+    def handle(self, *args, **options):
+        borradas = purgar_claves()
+        self.stdout.write(self.style.SUCCESS(f'[OK] {borradas} claves de idempotencia caducadas borradas'))
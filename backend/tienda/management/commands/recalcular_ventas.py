@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from tienda import ventas
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los contadores de ventas de los productos a partir de las compras'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ventanas', action='store_true',
+                            help='Recalcular sólo las ventas de los últimos 30 y 7 días (ejecutar a diario)')
+
+    def handle(self, *args, **options):
+        con_ventas = ventas.recalcular(ventanas=options['ventanas'])
+        self.stdout.write(self.style.SUCCESS(f'[OK] Contadores de ventas recalculados ({con_ventas} productos con ventas)'))
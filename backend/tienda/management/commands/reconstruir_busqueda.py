@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from tienda.busqueda import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Crea (si falta) y reconstruye el índice de búsqueda de productos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Alias de la base de datos')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        using = options['database']
+        if not backend.instalar(using):
+            backend.reconstruir(using)
+        self.stdout.write(self.style.SUCCESS(f'[OK] Índice de búsqueda reconstruido ({type(backend).__name__})'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from tienda import analitica
+
+
+class Command(BaseCommand):
+    help = 'Suma las compras nuevas al resumen diario de ventas (día, categoría y método de pago)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true',
+                            help='Reconstruir el resumen desde cero con todas las compras')
+        parser.add_argument('--lote', type=int, help='Compras por transacción (por defecto LOTE)')
+
+    def handle(self, *args, **options):
+        resultado = analitica.actualizar(completo=options['completo'], lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'[OK] {resultado}'))
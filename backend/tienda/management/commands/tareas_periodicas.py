@@ -0,0 +1,43 @@
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from tienda.tareas import TareaPeriodica, tareas_configuradas
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta las tareas periódicas con intervalo configurado (un solo proceso por despliegue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solo', nargs='+', metavar='TAREA',
+                            help='Ejecutar sólo estas tareas')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Ejecutar cada tarea una vez y salir')
+
+    def handle(self, *args, **options):
+        tareas = tareas_configuradas()
+        if options['solo']:
+            desconocidas = set(options['solo']) - {nombre for nombre, _, _ in tareas}
+            if desconocidas:
+                raise CommandError(f'Tareas sin intervalo configurado: {", ".join(sorted(desconocidas))}')
+            tareas = [tarea for tarea in tareas if tarea[0] in options['solo']]
+        if not tareas:
+            self.stdout.write(self.style.SUCCESS('[OK] No hay tareas periódicas con intervalo configurado'))
+            return
+
+        if options['una_vez']:
+            for nombre, funcion, _ in tareas:
+                self.stdout.write(f'{nombre}: {funcion()}')
+            self.stdout.write(self.style.SUCCESS(f'[OK] {len(tareas)} tareas ejecutadas'))
+            return
+
+        tareas = [TareaPeriodica(funcion, intervalo, nombre) for nombre, funcion, intervalo in tareas]
+        for tarea in tareas:
+            tarea.iniciar()
+            self.stdout.write(f'{tarea.nombre}: cada {tarea.intervalo}s')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        for tarea in tareas:
+            tarea.detener()
+        self.stdout.write(self.style.SUCCESS('[OK] Tareas periódicas detenidas'))
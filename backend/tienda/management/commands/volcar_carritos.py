@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from tienda.almacen_carrito import get_almacen
+
+
+class Command(BaseCommand):
+    help = 'Escribe en la base de datos los carritos modificados en el almacén clave-valor'
+
+    def handle(self, *args, **options):
+        almacen = get_almacen()
+        if not hasattr(almacen, 'volcar'):
+            self.stdout.write(self.style.SUCCESS('[OK] El almacén de carritos escribe directamente en la base de datos'))
+            return
+        volcados = almacen.volcar()
+        self.stdout.write(self.style.SUCCESS(f'[OK] {volcados} carritos volcados'))
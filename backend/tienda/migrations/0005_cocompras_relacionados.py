@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0004_producto_indices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuntoControl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Punto de control',
+                'verbose_name_plural': 'Puntos de control',
+            },
+        ),
+        migrations.CreateModel(
+            name='CoCompra',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('veces', models.PositiveIntegerField()),
+                ('otro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tienda.producto')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tienda.producto')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('producto', 'otro'), name='cocompra_unica')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductoRelacionado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posicion', models.PositiveSmallIntegerField()),
+                ('veces', models.PositiveIntegerField()),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='relacionados', to='tienda.producto')),
+                ('relacionado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tienda.producto')),
+            ],
+            options={
+                'verbose_name': 'Producto relacionado',
+                'verbose_name_plural': 'Productos relacionados',
+                'ordering': ['producto', 'posicion'],
+                'constraints': [models.UniqueConstraint(fields=('producto', 'posicion'), name='relacionado_posicion_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0006_contadores_ventas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carritoitem',
+            index=models.Index(fields=['session_key', 'updated_at'], name='carrito_sesion_act_idx'),
+        ),
+    ]
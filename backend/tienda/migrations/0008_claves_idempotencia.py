@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0007_carrito_sesion_indice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaveIdempotencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ambito', models.CharField(max_length=64)),
+                ('clave', models.CharField(max_length=255)),
+                ('huella', models.CharField(max_length=64)),
+                ('estado_http', models.PositiveSmallIntegerField(null=True)),
+                ('respuesta', models.JSONField(null=True)),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+                ('caduca', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Clave de idempotencia',
+                'verbose_name_plural': 'Claves de idempotencia',
+                'indexes': [models.Index(fields=['caduca'], name='idempotencia_caduca_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ambito', 'clave'), name='idempotencia_clave_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0008_claves_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='reservado',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('propietario', models.CharField(max_length=64)),
+                ('cantidad', models.PositiveIntegerField()),
+                ('caduca', models.DateTimeField()),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='tienda.producto')),
+            ],
+            options={
+                'verbose_name': 'Reserva',
+                'verbose_name_plural': 'Reservas',
+                'indexes': [models.Index(fields=['caduca'], name='reserva_caduca_idx')],
+                'constraints': [models.UniqueConstraint(fields=('propietario', 'producto'), name='reserva_unica')],
+            },
+        ),
+    ]
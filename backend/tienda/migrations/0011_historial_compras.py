@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0010_cola_trabajos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='compra',
+            index=models.Index(fields=['usuario', '-fecha_compra', '-id'], name='compra_usuario_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0011_historial_compras'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('metodo_pago', models.CharField(max_length=50)),
+                ('lineas', models.PositiveIntegerField(default=0)),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tienda.categoria')),
+            ],
+            options={
+                'verbose_name': 'Venta diaria',
+                'verbose_name_plural': 'Ventas diarias',
+                'ordering': ['dia', 'categoria', 'metodo_pago'],
+                'constraints': [models.UniqueConstraint(fields=('dia', 'categoria', 'metodo_pago'), name='venta_diaria_unica')],
+            },
+        ),
+    ]
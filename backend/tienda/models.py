@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Categoria(models.Model):
@@ -27,15 +29,60 @@ class Producto(models.Model):
     stock = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Contadores de ventas desnormalizados (ver tienda/ventas.py). Sólo se
+    # modifican con UPDATE y expresiones F(); save() no los escribe
+    unidades_vendidas = models.PositiveIntegerField(default=0, editable=False)
+    ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    unidades_30d = models.PositiveIntegerField(default=0, editable=False)
+    unidades_7d = models.PositiveIntegerField(default=0, editable=False)
+    # Unidades apartadas por carritos en modo reserva (ver tienda/reservas.py); igual que los contadores
+    reservado = models.PositiveIntegerField(default=0, editable=False)
+
+    CAMPOS_VENTAS = ('unidades_vendidas', 'ingresos', 'unidades_30d', 'unidades_7d')
+    CAMPOS_CONTADORES = CAMPOS_VENTAS + ('reservado',)
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
+        # Un índice por cada combinación de filtro y ordenamiento que expone la API
+        # (ver ProductoViewSet.ORDENAMIENTOS). SQLite añade el id al final de cada
+        # índice y lo recorre en ambos sentidos, así que todos son ascendentes: con
+        # created_at descendente el desempate "-created_at, -id" no saldría del índice
+        indexes = [
+            models.Index(fields=['categoria', 'precio'], name='producto_cat_precio_idx'),
+            models.Index(fields=['categoria', 'created_at'], name='producto_cat_creado_idx'),
+            models.Index(fields=['categoria', 'nombre'], name='producto_cat_nombre_idx'),
+            models.Index(fields=['precio'], name='producto_precio_idx'),
+            models.Index(fields=['created_at'], name='producto_creado_idx'),
+            models.Index(fields=['nombre'], name='producto_nombre_idx'),
+            models.Index(fields=['unidades_vendidas'], name='producto_vendidos_idx'),
+            # Más vendidos por categoría (/api/categorias/{id}/mas-vendidos/)
+            models.Index(fields=['categoria', 'unidades_vendidas'], name='producto_cat_vendidos_idx'),
+            models.Index(fields=['categoria', 'unidades_30d'], name='producto_cat_vendidos_30d_idx'),
+            models.Index(fields=['categoria', 'unidades_7d'], name='producto_cat_vendidos_7d_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nombre} - {self.autor}"
 
+    def save(self, *args, **kwargs):
+        # Un producto cargado antes de una venta o reserva no debe pisar los
+        # contadores; los campos diferidos (.only()/.defer()) tampoco se escriben,
+        # como hace Django, para no leerlos uno a uno
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            omitidos = self.get_deferred_fields() | set(self.CAMPOS_CONTADORES)
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.attname not in omitidos and campo.name not in omitidos
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def disponible(self):
+        """Stock que no está reservado por ningún carrito"""
+        return max(self.stock - self.reservado, 0)
+
 
 class CarritoItem(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='carrito_items')
@@ -49,6 +96,10 @@ class CarritoItem(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Item del Carrito'
         verbose_name_plural = 'Items del Carrito'
+        indexes = [
+            # Limpieza de carritos de invitados abandonados (ver tienda/limpieza.py)
+            models.Index(fields=['session_key', 'updated_at'], name='carrito_sesion_act_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['usuario', 'producto'],
@@ -95,13 +146,30 @@ class Compra(models.Model):
         ordering = ['-fecha_compra']
         verbose_name = 'Compra'
         verbose_name_plural = 'Compras'
+        indexes = [
+            # Ventanas de ventas recientes (ver tienda/ventas.py)
+            models.Index(fields=['fecha_compra'], name='compra_fecha_idx'),
+            # Historial de cada usuario, de la más reciente a la más antigua, por
+            # páginas: el id desempata el cursor sin ordenar aparte
+            models.Index(fields=['usuario', '-fecha_compra', '-id'], name='compra_usuario_fecha_idx'),
+        ]
     
     def __str__(self):
         return f"Compra #{self.id} - {self.usuario.username} - ${self.total}"
     
     @property
     def total_items(self):
-        return sum(item.cantidad for item in self.items.all())
+        # Anotado en la consulta (ver unidades_por_compra); si no, con
+        # prefetch_related('items') se suma en memoria y si no, lo suma la base de datos
+        if hasattr(self, '_total_items'):
+            return self._total_items
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            return sum(item.cantidad for item in self.items.all())
+        return self.items.aggregate(total=models.Sum('cantidad'))['total'] or 0
+
+    @total_items.setter
+    def total_items(self, valor):
+        self._total_items = valor
 
 
 class CompraItem(models.Model):
@@ -119,7 +187,169 @@ class CompraItem(models.Model):
     def __str__(self):
         return f"{self.compra} - {self.producto.nombre} x{self.cantidad}"
     
-    def save(self, *args, **kwargs):
-        # Calcular subtotal automáticamente
+    def calcular_subtotal(self):
         self.subtotal = self.precio_unitario * self.cantidad
-        super().save(*args, **kwargs)
\ No newline at end of file
+        return self
+
+    def save(self, *args, **kwargs):
+        # Calcular subtotal automáticamente (bulk_create no llama a save(): usar calcular_subtotal())
+        self.calcular_subtotal()
+        super().save(*args, **kwargs)
+
+def unidades_por_compra():
+    """Expresión para ``annotate(total_items=...)``: las unidades de cada compra en la misma consulta"""
+    unidades = CompraItem.objects.filter(compra=models.OuterRef('pk')).order_by().values('compra').annotate(
+        total=models.Sum('cantidad')
+    ).values('total')
+    return Coalesce(models.Subquery(unidades), 0)
+
+
+class PuntoControl(models.Model):
+    """Último id procesado por cada tarea incremental (p. ej. calcular_relacionados)"""
+    nombre = models.CharField(max_length=50, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Punto de control'
+        verbose_name_plural = 'Puntos de control'
+
+    def __str__(self):
+        return f"{self.nombre} #{self.ultimo_id}"
+
+
+class CoCompra(models.Model):
+    """Veces que dos productos aparecen en la misma compra (matriz dispersa; cada par en ambos sentidos)"""
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    otro = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    veces = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'otro'], name='cocompra_unica'),
+        ]
+
+
+class ProductoRelacionado(models.Model):
+    """Los productos más comprados junto a otro, precalculados (ver tienda/recomendaciones.py)"""
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='relacionados')
+    relacionado = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    posicion = models.PositiveSmallIntegerField()
+    veces = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['producto', 'posicion']
+        verbose_name = 'Producto relacionado'
+        verbose_name_plural = 'Productos relacionados'
+        constraints = [
+            # También es el índice de /api/productos/{id}/relacionados/
+            models.UniqueConstraint(fields=['producto', 'posicion'], name='relacionado_posicion_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} -> {self.relacionado_id} ({self.veces})"
+
+
+class ClaveIdempotencia(models.Model):
+    """Respuesta guardada para una cabecera Idempotency-Key (ver tienda/idempotencia.py)"""
+    # Dueño de la clave: 'u:<id>' o 's:<session_key>' (ver almacen_carrito.Propietario)
+    ambito = models.CharField(max_length=64)
+    clave = models.CharField(max_length=255)
+    # Hash de método, ruta y datos de la petición original
+    huella = models.CharField(max_length=64)
+    # Mientras la petición original está en curso, sin estado ni respuesta
+    estado_http = models.PositiveSmallIntegerField(null=True)
+    respuesta = models.JSONField(null=True)
+    creada = models.DateTimeField(auto_now_add=True)
+    caduca = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Clave de idempotencia'
+        verbose_name_plural = 'Claves de idempotencia'
+        constraints = [
+            # También es el índice de la búsqueda por clave en cada petición
+            models.UniqueConstraint(fields=['ambito', 'clave'], name='idempotencia_clave_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['caduca'], name='idempotencia_caduca_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ambito} {self.clave} ({self.estado_http or 'en curso'})"
+
+
+class Reserva(models.Model):
+    """Unidades de un producto apartadas para un carrito hasta ``caduca`` (ver tienda/reservas.py)"""
+    # Dueño del carrito: 'u:<id>' o 's:<session_key>' (ver almacen_carrito.Propietario)
+    propietario = models.CharField(max_length=64)
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='reservas')
+    cantidad = models.PositiveIntegerField()
+    caduca = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Reserva'
+        verbose_name_plural = 'Reservas'
+        constraints = [
+            models.UniqueConstraint(fields=['propietario', 'producto'], name='reserva_unica'),
+        ]
+        indexes = [
+            # El barrido de reservas caducadas (ver reservas.liberar_caducadas)
+            models.Index(fields=['caduca'], name='reserva_caduca_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.propietario} {self.producto_id} x{self.cantidad}"
+
+
+class Trabajo(models.Model):
+    """Trabajo en segundo plano pendiente de ejecutar (ver tienda/cola.py)"""
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('fallido', 'Fallido'),
+    ]
+
+    tarea = models.CharField(max_length=200, help_text="Ruta de la función, p. ej. tienda.trabajos.confirmar_compra")
+    argumentos = models.JSONField(default=dict)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='pendiente')
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=5)
+    # Desde cuándo puede tomarlo un worker: al encolarlo, tras un fallo (espera
+    # creciente) o cuando vence el plazo de un worker que no llegó a terminarlo
+    visible_desde = models.DateTimeField(default=timezone.now)
+    trabajador = models.CharField(max_length=100, blank=True)
+    ultimo_error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Trabajo'
+        verbose_name_plural = 'Trabajos'
+        indexes = [
+            # Lo que hace cada worker al pedir trabajo (ver cola.tomar)
+            models.Index(fields=['estado', 'visible_desde'], name='trabajo_cola_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tarea} #{self.id} ({self.estado}, {self.intentos}/{self.max_intentos})"
+
+
+class VentaDiaria(models.Model):
+    """Ventas de un día por categoría y método de pago, acumuladas desde las compras (ver tienda/analitica.py)"""
+    dia = models.DateField()
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name='+')
+    metodo_pago = models.CharField(max_length=50)
+    lineas = models.PositiveIntegerField(default=0)
+    unidades = models.PositiveIntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['dia', 'categoria', 'metodo_pago']
+        verbose_name = 'Venta diaria'
+        verbose_name_plural = 'Ventas diarias'
+        constraints = [
+            # También es el índice de los rangos de fechas de /api/analitica/ventas/
+            models.UniqueConstraint(fields=['dia', 'categoria', 'metodo_pago'], name='venta_diaria_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} {self.categoria_id} {self.metodo_pago}: {self.unidades} uds, ${self.ingresos}"
@@ -0,0 +1,152 @@
+"""
+Paginación por cursor (keyset) para listados grandes.
+
+A diferencia de ``PageNumberPagination``, no usa OFFSET ni ``COUNT(*)`` en
+cada página: el cursor guarda el valor de la columna de ordenamiento y el
+``id`` del último elemento entregado, y la siguiente página se obtiene con
+``WHERE (columna, id) > (valor, id)``. El total se calcula una sola vez por
+combinación de filtros y se guarda en caché durante un tiempo corto.
+"""
+import base64
+import binascii
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginación hacia adelante por (columna de ordenamiento, id)"""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, 'REST_FRAMEWORK', {}).get('PAGE_SIZE') or 12
+        valor = request.query_params.get(self.page_size_query_param)
+        if valor:
+            try:
+                page_size = min(max(int(valor), 1), self.max_page_size)
+            except ValueError:
+                pass
+        return page_size
+
+    @staticmethod
+    def get_ordering(queryset):
+        """Columna y dirección por las que se pagina: la primera del order_by"""
+        ordering = queryset.query.order_by or queryset.model._meta.ordering or ['pk']
+        campo = ordering[0]
+        if not isinstance(campo, str) or '__' in campo.lstrip('-'):
+            raise ValidationError({'ordering': 'Este ordenamiento no admite paginación por cursor.'})
+        descendente = campo.startswith('-')
+        campo = campo.lstrip('-')
+        if campo == 'pk':
+            campo = 'id'
+        return campo, descendente
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.campo, self.descendente = self.get_ordering(queryset)
+        self.count = self.get_count(queryset)
+
+        prefijo = '-' if self.descendente else ''
+        queryset = queryset.order_by(f'{prefijo}{self.campo}', f'{prefijo}id')
+
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            valor, ultimo_id = cursor
+            lookup = 'lt' if self.descendente else 'gt'
+            if self.campo == 'id':
+                queryset = queryset.filter(**{f'id__{lookup}': ultimo_id})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{self.campo}__{lookup}': valor})
+                    | Q(**{self.campo: valor, f'id__{lookup}': ultimo_id})
+                )
+
+        resultados = list(queryset[:self.page_size + 1])
+        self.has_next = len(resultados) > self.page_size
+        self.page = resultados[:self.page_size]
+        return self.page
+
+    def get_count(self, queryset):
+        """Total de resultados de los filtros actuales, cacheado por consulta"""
+        ttl = getattr(settings, 'TIENDA_CURSOR_CONTEO_TTL', 60)
+        sin_orden = queryset.order_by()
+        try:
+            sql = str(sin_orden.query)
+        except EmptyResultSet:
+            return 0
+        clave = 'tienda:conteo:' + hashlib.md5(sql.encode()).hexdigest()
+        count = cache.get(clave)
+        if count is None:
+            count = sin_orden.count()
+            cache.set(clave, count, ttl)
+        return count
+
+    @property
+    def clave_orden(self):
+        return f"{'-' if self.descendente else ''}{self.campo}"
+
+    def encode_cursor(self, instancia):
+        valor = getattr(instancia, self.campo)
+        posicion = {'o': self.clave_orden, 'v': None if valor is None else str(valor), 'id': instancia.pk}
+        token = base64.urlsafe_b64encode(json.dumps(posicion).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            posicion = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if posicion['o'] != self.clave_orden:
+                raise ValueError
+            ultimo_id = int(posicion['id'])
+            valor = self.to_python(model, posicion['v'])
+        except (binascii.Error, ValueError, KeyError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return valor, ultimo_id
+
+    def to_python(self, model, valor):
+        if valor is None:
+            raise ValueError
+        try:
+            return model._meta.get_field(self.campo).to_python(valor)
+        except FieldDoesNotExist:
+            # Anotaciones como la relevancia de la búsqueda
+            return float(valor)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['count', 'results'],
+            'properties': {
+                'count': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,231 @@
+"""
+Prueba de carga del checkout: muchos compradores a la vez por las últimas
+unidades de un producto (``python manage.py prueba_carga_checkout``).
+
+Crea ``compradores`` usuarios con una unidad de un producto escaso (con
+``stock`` unidades) y otra de uno abundante en el carrito, lanza todos los
+checkouts a la vez desde un pool de ``hilos`` con el cliente de tests de DRF
+(sin servidor ni red: se mide la vista y la base de datos) y mide el
+rendimiento, las latencias y los errores de bloqueo de SQLite. Después
+comprueba que no se vendió de más:
+
+- ningún ``Producto.stock`` ni ``reservado`` quedó negativo;
+- las unidades vendidas de cada producto coinciden con sus ``CompraItem``;
+- el total de cada ``Compra`` es la suma de sus líneas;
+- hay tantas compras como checkouts con 201.
+
+Los datos de la prueba (prefijo ``prefijo`` en usuarios y productos) se
+borran al terminar salvo con ``conservar=True``. Sólo se borra lo que lleva
+la marca ``MARCA`` que pone ``preparar()`` (en el apellido de los usuarios y
+la descripción de la categoría), nunca un usuario real que empiece por el
+mismo prefijo, y el prefijo debe tener al menos ``PREFIJO_MINIMO``
+caracteres. Usar sobre una base de datos de desarrollo, nunca la de producción.
+"""
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import OperationalError, close_old_connections
+from django.db.models import F, Q, Sum
+from rest_framework.test import APIClient
+
+from .models import CarritoItem, Categoria, Compra, CompraItem, Producto, Trabajo
+
+# Apellido de los usuarios y descripción de la categoría que crea la prueba
+MARCA = 'prueba-carga-checkout'
+PREFIJO_MINIMO = 3
+
+
+def _host():
+    """Un host que acepte ALLOWED_HOSTS (fuera de los tests no vale ``testserver``)"""
+    return next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+
+
+def percentil(valores, p):
+    """Percentil ``p`` (0-100) por rango más cercano; ``valores`` ya ordenados"""
+    if not valores:
+        return 0.0
+    return valores[max(math.ceil(p / 100 * len(valores)), 1) - 1]
+
+
+@dataclass
+class ResultadoCarga:
+    compradores: int = 0
+    hilos: int = 0
+    stock: int = 0
+    segundos: float = 0.0
+    estados: Counter = field(default_factory=Counter)
+    latencias: list = field(default_factory=list)
+    bloqueos: int = 0
+    errores: list = field(default_factory=list)
+    vendidas: int = 0
+    incoherencias: list = field(default_factory=list)
+
+    @property
+    def correcto(self):
+        return not self.incoherencias and not self.errores
+
+    @property
+    def por_segundo(self):
+        return self.compradores / self.segundos if self.segundos else 0.0
+
+    def __str__(self):
+        latencias = sorted(self.latencias)
+        ms = {p: percentil(latencias, p) * 1000 for p in (50, 95, 99)}
+        estados = ', '.join(f'{estado}: {veces}' for estado, veces in sorted(self.estados.items(), key=str)) or '-'
+        lineas = [
+            f'{self.compradores} checkouts con {self.hilos} hilos en {self.segundos:.2f}s '
+            f'({self.por_segundo:.1f}/s)',
+            f'Latencia p50 {ms[50]:.1f} ms, p95 {ms[95]:.1f} ms, p99 {ms[99]:.1f} ms',
+            f'Respuestas {estados}; bloqueos de SQLite: {self.bloqueos}; otros errores: {len(self.errores)}',
+            f'Vendidas {self.vendidas} de {self.stock} unidades del producto escaso',
+        ]
+        lineas += [f'INCOHERENCIA: {incoherencia}' for incoherencia in self.incoherencias]
+        lineas += [f'ERROR: {error}' for error in self.errores[:5]]
+        return '\n'.join(lineas)
+
+
+def validar_prefijo(prefijo):
+    """ValueError si ``prefijo`` es tan corto que podría coincidir con datos reales"""
+    if len(prefijo) < PREFIJO_MINIMO:
+        raise ValueError(f'El prefijo debe tener al menos {PREFIJO_MINIMO} caracteres')
+
+
+def limpiar(prefijo, usuarios=None, categoria=None):
+    """
+    Borrar los datos de la prueba: los usuarios y la categoría con estos ids
+    o, sin ellos, los de una prueba anterior con ``prefijo`` y la marca ``MARCA``.
+    """
+    validar_prefijo(prefijo)
+    if usuarios is None:
+        usuarios = User.objects.filter(username__startswith=prefijo, last_name=MARCA).values_list('id', flat=True)
+    usuarios = list(usuarios)
+    categorias = Categoria.objects.filter(nombre=f'{prefijo}categoria', descripcion=MARCA)
+    if categoria is not None:
+        categorias = categorias.filter(pk=categoria)
+    compras = list(Compra.objects.filter(usuario_id__in=usuarios).values_list('id', flat=True))
+    Trabajo.objects.filter(tarea='tienda.trabajos.confirmar_compra', argumentos__compra_id__in=compras).delete()
+    # Las compras protegen a los productos: primero los usuarios (con sus compras y carritos)
+    User.objects.filter(id__in=usuarios, last_name=MARCA).delete()
+    categorias.delete()
+
+
+def preparar(prefijo, compradores, stock):
+    """Crear los productos y un usuario con carrito por comprador; devuelve (usuarios, escaso, abundante)"""
+    limpiar(prefijo)
+    categoria = Categoria.objects.create(nombre=f'{prefijo}categoria', descripcion=MARCA)
+    escaso, abundante = Producto.objects.bulk_create([
+        Producto(categoria=categoria, nombre=f'{prefijo}escaso', autor=prefijo, descripcion='',
+                 precio=Decimal('12.50'), imagen='', stock=stock),
+        Producto(categoria=categoria, nombre=f'{prefijo}abundante', autor=prefijo, descripcion='',
+                 precio=Decimal('7.25'), imagen='', stock=compradores),
+    ])
+    sin_clave = make_password(None)
+    User.objects.bulk_create([
+        User(username=f'{prefijo}{numero}', last_name=MARCA, password=sin_clave) for numero in range(compradores)
+    ])
+    usuarios = list(User.objects.filter(username__startswith=prefijo, last_name=MARCA).order_by('id'))
+    CarritoItem.objects.bulk_create([
+        CarritoItem(usuario=usuario, producto=producto, cantidad=1)
+        for usuario in usuarios for producto in (escaso, abundante)
+    ])
+    return usuarios, escaso, abundante
+
+
+def comprobar(resultado, productos, stock_inicial, prefijo):
+    """Añadir a ``resultado.incoherencias`` todo lo que indique una venta de más o una compra a medias"""
+    actuales = {producto.pk: producto for producto in Producto.objects.filter(pk__in=[p.pk for p in productos])}
+    vendidas = dict(
+        CompraItem.objects.filter(producto__in=productos).values('producto')
+        .annotate(total=Sum('cantidad')).values_list('producto', 'total')
+    )
+    for producto in productos:
+        actual = actuales[producto.pk]
+        if actual.stock < 0 or actual.reservado < 0:
+            resultado.incoherencias.append(
+                f'{actual.nombre}: stock {actual.stock}, reservado {actual.reservado}'
+            )
+        if stock_inicial[producto.pk] - actual.stock != vendidas.get(producto.pk, 0):
+            resultado.incoherencias.append(
+                f'{actual.nombre}: el stock bajó {stock_inicial[producto.pk] - actual.stock} unidades '
+                f'pero las líneas de compra suman {vendidas.get(producto.pk, 0)}'
+            )
+
+    compras = Compra.objects.filter(usuario__username__startswith=prefijo, usuario__last_name=MARCA)
+    descuadradas = compras.annotate(suma=Sum('items__subtotal')).filter(Q(suma__isnull=True) | ~Q(total=F('suma')))
+    for compra_id, total, suma in descuadradas.values_list('id', 'total', 'suma'):
+        resultado.incoherencias.append(f'Compra #{compra_id}: total {total}, sus líneas suman {suma}')
+    if compras.count() != resultado.estados[201]:
+        resultado.incoherencias.append(
+            f'{compras.count()} compras para {resultado.estados[201]} checkouts con 201'
+        )
+    # Sin errores, todo comprador debió comprar mientras quedaron unidades
+    esperadas = min(resultado.stock, resultado.compradores)
+    if not resultado.bloqueos and not resultado.errores and resultado.estados[201] != esperadas:
+        resultado.incoherencias.append(
+            f'{resultado.estados[201]} checkouts con 201 para {esperadas} unidades a la venta'
+        )
+
+
+def simular_checkout(compradores=100, stock=10, hilos=8, prefijo='carga-', conservar=False):
+    """Lanzar ``compradores`` checkouts a la vez por ``stock`` unidades; devuelve un ResultadoCarga"""
+    validar_prefijo(prefijo)
+    usuarios, escaso, abundante = preparar(prefijo, compradores, stock)
+    stock_inicial = {escaso.pk: escaso.stock, abundante.pk: abundante.stock}
+    resultado = ResultadoCarga(compradores=compradores, hilos=hilos, stock=stock)
+    salida = threading.Event()
+    cerrojo = threading.Lock()
+
+    def comprar(usuario):
+        close_old_connections()
+        client = APIClient(SERVER_NAME=_host())
+        client.force_authenticate(usuario)
+        salida.wait()
+        inicio = time.perf_counter()
+        try:
+            estado = client.post('/api/carrito/checkout/').status_code
+        except OperationalError as error:
+            estado = None
+            bloqueo = 'locked' in str(error)
+            with cerrojo:
+                resultado.bloqueos += bloqueo
+                if not bloqueo:
+                    resultado.errores.append(repr(error))
+        except Exception as error:  # noqa: BLE001 - se informa en el resultado
+            estado = None
+            with cerrojo:
+                resultado.errores.append(repr(error))
+        finally:
+            close_old_connections()
+        with cerrojo:
+            resultado.latencias.append(time.perf_counter() - inicio)
+            resultado.estados[estado or 'error'] += 1
+
+    # Cada 400 por falta de stock dejaría un aviso en el log
+    log_peticiones = logging.getLogger('django.request')
+    nivel = log_peticiones.level
+    log_peticiones.setLevel(logging.ERROR)
+    try:
+        with ThreadPoolExecutor(hilos) as pool:
+            pendientes = [pool.submit(comprar, usuario) for usuario in usuarios]
+            inicio = time.perf_counter()
+            salida.set()
+            for pendiente in pendientes:
+                pendiente.result()
+            resultado.segundos = time.perf_counter() - inicio
+
+        comprobar(resultado, [escaso, abundante], stock_inicial, prefijo)
+        resultado.vendidas = stock - Producto.objects.values_list('stock', flat=True).get(pk=escaso.pk)
+    finally:
+        log_peticiones.setLevel(nivel)
+        if not conservar:
+            limpiar(prefijo, [usuario.id for usuario in usuarios], escaso.categoria_id)
+    return resultado
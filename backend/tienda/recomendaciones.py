@@ -0,0 +1,181 @@
+"""
+"Comprados juntos a menudo", calculado fuera de las peticiones.
+
+``actualizar()`` recorre en streaming las líneas de compra posteriores al
+último punto de control, agrupadas por compra, y cuenta los pares de
+productos de cada cesta en una matriz dispersa (un ``Counter`` por
+producto). Los conteos se suman a ``CoCompra`` y, para cada producto
+afectado, se guardan sus ``TOP_K`` vecinos en ``ProductoRelacionado``, que es
+lo único que lee la API.
+
+Se cuenta fuera de cualquier transacción y se escribe en transacciones
+cortas: con ``transaction_mode: IMMEDIATE`` cada transacción toma el
+cerrojo de escritura de SQLite y el checkout no puede esperar a que termine
+un recorrido de todas las compras. Cada transacción suma los pares de
+``LOTE_COMPRAS`` compras y avanza el punto de control a la vez; si otra
+ejecución lo avanzó entretanto, el lote se vuelve a contar desde el nuevo punto.
+Como en ``analitica.py``, las compras de los últimos ``MARGEN`` segundos
+esperan a la siguiente pasada: con transacciones concurrentes, una compra
+puede confirmarse después de otra con un id mayor, y el punto de control ya
+la habría dejado atrás. Cada compra se cuenta una sola vez.
+
+``actualizar(completo=True)`` reconstruye los conteos de las compras ya
+incorporadas (por ejemplo, tras cancelar alguna) reemplazando las filas de
+``LOTE`` productos por transacción: la API sigue sirviendo las anteriores
+hasta que se reemplazan.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .cache_respuestas import incrementar_version
+from .models import CoCompra, Compra, CompraItem, ProductoRelacionado, PuntoControl
+
+TOP_K = 10
+PUNTO_CONTROL = 'relacionados'
+# Productos por escritura y compras por transacción
+LOTE = 500
+LOTE_COMPRAS = 1000
+# Segundos que espera una compra antes de contarse
+MARGEN = 60
+
+
+def cestas(desde_compra=0, hasta_compra=None, chunk_size=2000):
+    """(compra_id, {producto_id, ...}) de cada compra no cancelada con ``desde_compra < id <= hasta_compra``"""
+    filas = CompraItem.objects.filter(compra_id__gt=desde_compra)
+    if hasta_compra is not None:
+        filas = filas.filter(compra_id__lte=hasta_compra)
+    filas = (
+        filas
+        .exclude(compra__estado='cancelada')
+        .order_by('compra_id')
+        .values_list('compra_id', 'producto_id')
+        .iterator(chunk_size=chunk_size)
+    )
+    for compra_id, grupo in groupby(filas, key=itemgetter(0)):
+        yield compra_id, {producto_id for _, producto_id in grupo}
+
+
+def contar_pares(cestas):
+    """Matriz dispersa {producto: Counter({otro: veces})} y último id de compra recorrido"""
+    matriz, ultima_compra = defaultdict(Counter), None
+    for ultima_compra, productos in cestas:
+        if len(productos) < 2:
+            continue
+        for producto in productos:
+            matriz[producto].update(productos)
+    # La diagonal (cada producto consigo mismo) no interesa
+    for producto, fila in matriz.items():
+        del fila[producto]
+    return matriz, ultima_compra
+
+
+def vecinos(fila, top_k):
+    """Los ``top_k`` productos con más compras conjuntas; a igualdad, el de menor id"""
+    return sorted(fila.items(), key=lambda par: (-par[1], par[0]))[:top_k]
+
+
+def guardar(filas, top_k, pares=None):
+    """
+    Guardar los conteos acumulados ``filas`` ({producto: Counter}) y los
+    vecinos de esos productos. Con ``pares`` ({producto: iterable de otros})
+    sólo se escriben esos conteos; sin él, se reemplazan todos los del producto.
+    """
+    productos = list(filas)
+    if pares is None:
+        CoCompra.objects.filter(producto_id__in=productos).delete()
+        pares = filas
+    CoCompra.objects.bulk_create(
+        [
+            CoCompra(producto_id=producto, otro_id=otro, veces=filas[producto][otro])
+            for producto in productos for otro in pares[producto]
+        ],
+        update_conflicts=True, unique_fields=['producto', 'otro'], update_fields=['veces'],
+    )
+    ProductoRelacionado.objects.filter(producto_id__in=productos).delete()
+    ProductoRelacionado.objects.bulk_create([
+        ProductoRelacionado(producto_id=producto, relacionado_id=otro, posicion=posicion, veces=veces)
+        for producto in productos
+        for posicion, (otro, veces) in enumerate(vecinos(filas[producto], top_k))
+    ])
+
+
+def incorporar(top_k=TOP_K, lote=LOTE, lote_compras=LOTE_COMPRAS, ahora=None):
+    """Sumar los pares de las compras posteriores al punto de control; devuelve los productos afectados"""
+    ahora = ahora or timezone.now()
+    # La primera compra demasiado reciente y las posteriores quedan para la siguiente pasada
+    tope = Compra.objects.filter(fecha_compra__gt=ahora - timedelta(seconds=MARGEN)).aggregate(tope=Min('id'))['tope']
+    afectados = set()
+    while True:
+        desde = PuntoControl.objects.get_or_create(nombre=PUNTO_CONTROL)[0].ultimo_id
+        compras = Compra.objects.filter(id__gt=desde)
+        if tope is not None:
+            compras = compras.filter(id__lt=tope)
+        ids = list(compras.order_by('id').values_list('id', flat=True)[:lote_compras])
+        if not ids:
+            return afectados
+        nuevos, _ = contar_pares(cestas(desde, ids[-1]))
+        with transaction.atomic():
+            punto = PuntoControl.objects.select_for_update().get(nombre=PUNTO_CONTROL)
+            if punto.ultimo_id != desde:
+                # Otra ejecución incorporó estas compras: contar desde su punto de control
+                continue
+            productos = sorted(nuevos)
+            for inicio in range(0, len(productos), lote):
+                bloque = productos[inicio:inicio + lote]
+                # Conteos acumulados de las filas afectadas más los de este lote
+                filas = {producto: Counter() for producto in bloque}
+                existentes = CoCompra.objects.filter(producto_id__in=bloque).values_list(
+                    'producto_id', 'otro_id', 'veces'
+                )
+                for producto, otro, veces in existentes:
+                    filas[producto][otro] = veces
+                for producto in bloque:
+                    filas[producto].update(nuevos[producto])
+                guardar(filas, top_k, pares=nuevos)
+            punto.ultimo_id = ids[-1]
+            punto.save()
+            if productos:
+                transaction.on_commit(incrementar_version)
+        afectados.update(productos)
+
+
+def reconstruir(top_k=TOP_K, lote=LOTE):
+    """Recalcular desde cero los conteos de las compras ya incorporadas; devuelve los productos reescritos"""
+    hasta = PuntoControl.objects.get_or_create(nombre=PUNTO_CONTROL)[0].ultimo_id
+    matriz, _ = contar_pares(cestas(0, hasta))
+    # También los productos que ya no tienen pares (sus filas se borran)
+    anteriores = set(CoCompra.objects.values_list('producto_id', flat=True).distinct())
+    anteriores |= set(ProductoRelacionado.objects.values_list('producto_id', flat=True).distinct())
+    productos = sorted(set(matriz) | anteriores)
+    for inicio in range(0, len(productos), lote):
+        bloque = productos[inicio:inicio + lote]
+        while True:
+            with transaction.atomic():
+                punto = PuntoControl.objects.select_for_update().get(nombre=PUNTO_CONTROL)
+                if punto.ultimo_id == hasta:
+                    guardar({producto: matriz[producto] for producto in bloque}, top_k)
+                    transaction.on_commit(incrementar_version)
+                    break
+            # incorporar() avanzó mientras tanto: sus compras también cuentan en lo que falta por reescribir
+            delta, _ = contar_pares(cestas(hasta, punto.ultimo_id))
+            for producto, fila in delta.items():
+                matriz[producto].update(fila)
+            hasta = punto.ultimo_id
+    return set(productos)
+
+
+def actualizar(completo=False, top_k=TOP_K, lote=LOTE, lote_compras=LOTE_COMPRAS, ahora=None):
+    """
+    Incorporar las compras nuevas (reconstruyendo antes las ya incorporadas,
+    con ``completo``) y recalcular los vecinos de los productos afectados.
+    Devuelve cuántos productos se actualizaron.
+    """
+    afectados = reconstruir(top_k, lote) if completo else set()
+    afectados |= incorporar(top_k, lote, lote_compras, ahora)
+    return len(afectados)
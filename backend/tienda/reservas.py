@@ -0,0 +1,190 @@
+"""
+Reservas de stock con caducidad (modo opcional, ``ACTIVAS`` en ``TIENDA_RESERVAS``).
+
+Con las reservas activas, añadir al carrito aparta las unidades: una fila de
+``Reserva`` por carrito y producto y el total apartado en ``Producto.reservado``,
+que sólo cambia con un UPDATE condicional (``WHERE stock >= reservado + n``).
+Así, en una venta relámpago, el carrito que no alcanza el stock falla al
+añadir y no en el checkout; y el checkout convierte lo reservado en venta sin
+competir por esas unidades (ver ``ventas.vender``).
+
+Cada cambio del carrito renueva la reserva de sus productos durante ``TTL``
+segundos. ``liberar_caducadas()`` devuelve al stock las reservas vencidas por
+lotes de ``LOTE``, con ``python manage.py liberar_reservas`` o como tarea
+periódica si se define ``INTERVALO``. Si una reserva caduca, la línea del
+carrito sigue ahí y el checkout la vende si queda stock libre.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .cache_respuestas import incrementar_version
+from .configuracion import ResultadoLotes, leer
+from .models import Producto, Reserva
+from .ventas import StockAgotado
+
+CONFIGURACION_POR_DEFECTO = {
+    'ACTIVAS': False,
+    'TTL': 15 * 60,
+    'LOTE': 500,
+    # Segundos entre barridos de la tarea periódica; None = desactivada
+    'INTERVALO': None,
+}
+
+
+def get_configuracion():
+    return leer('TIENDA_RESERVAS', CONFIGURACION_POR_DEFECTO)
+
+
+def activas():
+    return get_configuracion()['ACTIVAS']
+
+
+def _sumar_reservado(cambios, condicion):
+    """UPDATE de ``Producto.reservado`` con ``cambios`` ({producto_id: delta}); devuelve las filas cambiadas"""
+    cambiadas = Producto.objects.filter(condicion).update(reservado=Case(
+        *(When(pk=producto_id, then=Greatest(F('reservado') + delta, 0)) for producto_id, delta in cambios.items()),
+        default=F('reservado'), output_field=Producto._meta.get_field('reservado'),
+    ))
+    if cambiadas and Producto.objects.filter(_cruza_cero(cambios)).exists():
+        transaction.on_commit(incrementar_version)
+    return cambiadas
+
+
+def _cruza_cero(cambios):
+    """
+    Productos cuyo ``disponible`` acaba de pasar de positivo a 0 o al revés.
+    Sólo entonces se invalida la caché del catálogo: invalidarla en cada
+    reserva la dejaría sin aciertos en plena venta; ``reservado`` y
+    ``disponible`` de las respuestas cacheadas pueden ir hasta ``TTL``
+    segundos por detrás, y el UPDATE condicional sigue decidiendo.
+    """
+    return reduce(or_, (
+        Q(pk=producto_id, stock__lte=F('reservado'), stock__gt=F('reservado') - delta) if delta > 0
+        else Q(pk=producto_id, stock__gt=F('reservado'), stock__lte=F('reservado') - delta)
+        for producto_id, delta in cambios.items()
+    ))
+
+
+def reservadas(propietario, producto_ids=None):
+    """{producto_id: unidades} reservadas por el carrito (aunque hayan caducado y no se hayan liberado)"""
+    reservas = Reserva.objects.filter(propietario=propietario.clave)
+    if producto_ids is not None:
+        reservas = reservas.filter(producto_id__in=producto_ids)
+    return dict(reservas.select_for_update().values_list('producto_id', 'cantidad'))
+
+
+def reservar(propietario, cambios):
+    """
+    Sumar ``cambios`` ({producto_id: delta}) a las reservas del carrito y
+    renovarlas. Una reserva nunca baja de 0. Si alguno de los aumentos no cabe
+    en el stock libre no se reserva nada y se lanza ``StockAgotado``.
+    """
+    with transaction.atomic():
+        actuales = reservadas(propietario, cambios)
+        finales = {
+            producto_id: max(actuales.get(producto_id, 0) + delta, 0)
+            for producto_id, delta in cambios.items()
+        }
+        deltas = {
+            producto_id: cantidad - actuales.get(producto_id, 0)
+            for producto_id, cantidad in finales.items() if cantidad != actuales.get(producto_id, 0)
+        }
+        if deltas:
+            condicion = reduce(or_, (
+                Q(pk=producto_id, stock__gte=F('reservado') + delta) if delta > 0 else Q(pk=producto_id)
+                for producto_id, delta in deltas.items()
+            ))
+            if _sumar_reservado(deltas, condicion) != len(deltas):
+                raise StockAgotado
+
+        caduca = timezone.now() + timedelta(seconds=get_configuracion()['TTL'])
+        renovadas = [
+            Reserva(propietario=propietario.clave, producto_id=producto_id, cantidad=cantidad, caduca=caduca)
+            for producto_id, cantidad in finales.items() if cantidad
+        ]
+        if renovadas:
+            Reserva.objects.bulk_create(
+                renovadas, update_conflicts=True,
+                unique_fields=['propietario', 'producto'], update_fields=['cantidad', 'caduca'],
+            )
+        if len(renovadas) != len(finales):
+            Reserva.objects.filter(
+                propietario=propietario.clave,
+                producto_id__in=[producto_id for producto_id, cantidad in finales.items() if not cantidad],
+            ).delete()
+
+
+def cerrar(propietario, reservadas, vendidos):
+    """
+    Borrar las reservas del carrito tras el checkout. ``ventas.vender`` ya
+    descontó de ``Producto.reservado`` las de los productos ``vendidos``; las
+    demás vuelven al stock libre.
+    """
+    sobrantes = {producto_id: -cantidad for producto_id, cantidad in reservadas.items() if producto_id not in vendidos}
+    if sobrantes:
+        _sumar_reservado(sobrantes, Q(pk__in=sobrantes))
+    Reserva.objects.filter(propietario=propietario.clave).delete()
+
+
+def transferir(origen, destino):
+    """Pasar las reservas del carrito ``origen`` al de ``destino`` (al fusionar el carrito de invitado)"""
+    with transaction.atomic():
+        filas = Reserva.objects.filter(propietario__in=[origen.clave, destino.clave]).select_for_update()
+        totales, caduca = Counter(), None
+        for reserva in filas:
+            totales[reserva.producto_id] += reserva.cantidad
+            caduca = max(caduca or reserva.caduca, reserva.caduca)
+        if not totales:
+            return
+        # El total apartado de cada producto no cambia, sólo su dueño
+        Reserva.objects.filter(propietario=origen.clave).delete()
+        Reserva.objects.bulk_create(
+            [Reserva(propietario=destino.clave, producto_id=producto_id, cantidad=cantidad, caduca=caduca)
+             for producto_id, cantidad in totales.items()],
+            update_conflicts=True, unique_fields=['propietario', 'producto'], update_fields=['cantidad', 'caduca'],
+        )
+
+
+@dataclass
+class ResultadoLiberacion(ResultadoLotes):
+    liberadas: int = 0
+    unidades: int = 0
+
+    def __str__(self):
+        return (f'{self.liberadas} reservas caducadas liberadas ({self.unidades} unidades) '
+                f'en {self.lotes} lotes ({self.segundos:.2f}s)')
+
+
+def liberar_caducadas(lote=None, ahora=None):
+    """Devolver al stock libre las reservas caducadas, ``lote`` a lote; devuelve un ResultadoLiberacion"""
+    lote = lote or get_configuracion()['LOTE']
+    ahora = ahora or timezone.now()
+    resultado = ResultadoLiberacion()
+    with resultado.cronometrar():
+        while True:
+            with transaction.atomic():
+                # skip_locked: en bases de datos con bloqueo por fila, las que otro proceso
+                # esté renovando o comprando se quedan para el siguiente barrido
+                caducadas = list(
+                    Reserva.objects.filter(caduca__lte=ahora).select_for_update(skip_locked=True)
+                    .values_list('id', 'producto_id', 'cantidad')[:lote]
+                )
+                if not caducadas:
+                    break
+                por_producto = Counter()
+                for _, producto_id, cantidad in caducadas:
+                    por_producto[producto_id] -= cantidad
+                _sumar_reservado(por_producto, Q(pk__in=por_producto))
+                Reserva.objects.filter(id__in=[id_ for id_, _, _ in caducadas]).delete()
+            resultado.liberadas += len(caducadas)
+            resultado.unidades -= sum(por_producto.values())
+            resultado.lotes += 1
+    return resultado
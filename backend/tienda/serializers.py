@@ -4,6 +4,73 @@ from django.contrib.auth.password_validation import validate_password
 from .models import Categoria, Producto, CarritoItem, Compra, CompraItem
 
 
+class CamposDinamicosMixin:
+    """
+    Campos a medida con ``?fields=`` y ``?omit=`` (separados por comas). Los
+    serializers anidados se seleccionan con notación de punto:
+    ``?fields=id,cantidad,producto.nombre`` o ``?omit=producto.categoria``.
+
+    ``campos_diferibles`` lista las columnas pesadas del modelo que la vista
+    puede excluir del SELECT cuando no se devuelven (ver ``campos_a_diferir``).
+    """
+    campos_diferibles = ()
+
+    def _ruta(self):
+        partes, nodo = [], self
+        while nodo.parent is not None:
+            if nodo.field_name:
+                partes.append(nodo.field_name)
+            nodo = nodo.parent
+        return list(reversed(partes))
+
+    def _parametro(self, nombre):
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return []
+        ruta = self._ruta()
+        rutas = []
+        for valor in request.query_params.getlist(nombre):
+            for campo in valor.split(','):
+                partes = campo.strip().split('.')
+                if partes[0] and partes[:len(ruta)] == ruta and len(partes) > len(ruta):
+                    rutas.append(partes[len(ruta):])
+        return rutas
+
+    def get_fields(self):
+        fields = super().get_fields()
+        incluir = {partes[0] for partes in self._parametro('fields')}
+        omitir = {partes[0] for partes in self._parametro('omit') if len(partes) == 1}
+        self.campos_omitidos = {}
+        for nombre in list(fields):
+            if (incluir and nombre not in incluir) or nombre in omitir:
+                self.campos_omitidos[nombre] = fields.pop(nombre)
+        return fields
+
+
+def campos_a_diferir(serializer, prefijo='', todos=False):
+    """
+    Columnas pesadas que ``serializer`` no va a leer, listas para ``QuerySet.defer()``.
+    Recorre los serializers anidados de relaciones cargadas con select_related;
+    de los que se omitieron con ``?fields=``/``?omit=`` (o con ``todos``) se
+    difieren todas.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    fields = serializer.fields
+    usados = set() if todos else {campo.source for campo in fields.values()}
+    diferir = [prefijo + campo for campo in getattr(serializer, 'campos_diferibles', ()) if campo not in usados]
+    anidados = [(campo.source, campo, todos) for campo in fields.values()]
+    # Los campos omitidos no llegan a enlazarse: su source por defecto es el nombre
+    anidados += [
+        (campo.source or nombre, campo, True)
+        for nombre, campo in getattr(serializer, 'campos_omitidos', {}).items()
+    ]
+    for source, campo, omitido in anidados:
+        if isinstance(campo, serializers.Serializer) and source != '*':
+            diferir += campos_a_diferir(campo, f'{prefijo}{source}__', omitido)
+    return diferir
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -58,23 +125,57 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
-class CategoriaSerializer(serializers.ModelSerializer):
+class CategoriaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    campos_diferibles = ('descripcion',)
+
     class Meta:
         model = Categoria
         fields = ['id', 'nombre', 'descripcion']
 
 
-class ProductoSerializer(serializers.ModelSerializer):
+class CategoriaResumenSerializer(CategoriaSerializer):
+    """Categoría embebida en listados: sin descripción"""
+    class Meta(CategoriaSerializer.Meta):
+        fields = ['id', 'nombre']
+
+
+class ProductoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    campos_diferibles = ('descripcion', 'contraportada')
     categoria = CategoriaSerializer(read_only=True)
     categoria_id = serializers.PrimaryKeyRelatedField(queryset=Categoria.objects.all(), source='categoria', write_only=True)
+    # Stock libre y apartado por carritos (ver tienda/reservas.py)
+    disponible = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Producto
-        fields = ['id', 'nombre', 'autor', 'descripcion', 'contraportada', 'precio', 'imagen', 'categoria', 'categoria_id', 'stock', 'created_at']
+        fields = ['id', 'nombre', 'autor', 'descripcion', 'contraportada', 'precio', 'imagen', 'categoria', 'categoria_id', 'stock', 'disponible', 'reservado', 'created_at']
+
+
+class ProductoResumenSerializer(ProductoSerializer):
+    """Producto embebido en carritos y compras: sin los textos largos"""
+    categoria = CategoriaResumenSerializer(read_only=True)
+
+    class Meta(ProductoSerializer.Meta):
+        fields = ['id', 'nombre', 'autor', 'precio', 'imagen', 'categoria', 'stock']
+
+
+class ProductoListSerializer(ProductoResumenSerializer):
+    """Representación compacta para el listado; el texto completo queda para el detalle"""
+    # Inicio de la contraportada, recortado en la base de datos (ver ProductoViewSet)
+    resumen = serializers.CharField(read_only=True, allow_null=True)
+
+    class Meta(ProductoResumenSerializer.Meta):
+        fields = ProductoResumenSerializer.Meta.fields + ['resumen', 'created_at']
+
+
+class ProductoVentasSerializer(ProductoResumenSerializer):
+    """Producto en los rankings de más vendidos"""
+    class Meta(ProductoResumenSerializer.Meta):
+        fields = ProductoResumenSerializer.Meta.fields + ['unidades_vendidas', 'unidades_30d', 'unidades_7d']
 
 
-class CarritoItemSerializer(serializers.ModelSerializer):
-    producto = ProductoSerializer(read_only=True)
+class CarritoItemSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    producto = ProductoResumenSerializer(read_only=True)
     producto_id = serializers.PrimaryKeyRelatedField(queryset=Producto.objects.all(), source='producto', write_only=True)
     subtotal = serializers.ReadOnlyField()
 
@@ -84,6 +185,8 @@ class CarritoItemSerializer(serializers.ModelSerializer):
 
 
 class CarritoItemCreateSerializer(serializers.ModelSerializer):
+    producto = serializers.PrimaryKeyRelatedField(queryset=Producto.objects.select_related('categoria'))
+
     class Meta:
         model = CarritoItem
         fields = ['producto', 'cantidad']
@@ -101,9 +204,29 @@ class CarritoItemUpdateSerializer(serializers.ModelSerializer):
         return value
 
 
-class CompraItemSerializer(serializers.ModelSerializer):
+class OperacionCarritoSerializer(serializers.Serializer):
+    accion = serializers.ChoiceField(choices=['agregar', 'fijar', 'quitar'])
+    # Sólo el id: la existencia y el stock se comprueban en bloque en la vista
+    producto = serializers.IntegerField(min_value=1)
+    cantidad = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, attrs):
+        if attrs['accion'] == 'agregar' and attrs['cantidad'] < 1:
+            raise serializers.ValidationError({'cantidad': 'La cantidad debe ser al menos 1'})
+        return attrs
+
+
+class CarritoLoteSerializer(serializers.Serializer):
+    """Operaciones de /api/carrito/lote/, aplicadas en orden"""
+    MAX_OPERACIONES = 100
+
+    session_key = serializers.CharField(max_length=40, required=False, allow_blank=True)
+    operaciones = OperacionCarritoSerializer(many=True, allow_empty=False, max_length=MAX_OPERACIONES)
+
+
+class CompraItemSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializer para items de compra"""
-    producto = ProductoSerializer(read_only=True)
+    producto = ProductoResumenSerializer(read_only=True)
     producto_nombre = serializers.CharField(source='producto.nombre', read_only=True)
     producto_imagen = serializers.CharField(source='producto.imagen', read_only=True)
     
@@ -112,10 +235,21 @@ class CompraItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'producto', 'producto_nombre', 'producto_imagen', 'cantidad', 'precio_unitario', 'subtotal']
 
 
-class CompraSerializer(serializers.ModelSerializer):
+class CompraItemResumenSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    """Línea de compra en el historial: el producto sólo por id, nombre e imagen"""
+    producto_nombre = serializers.CharField(source='producto.nombre', read_only=True)
+    producto_imagen = serializers.CharField(source='producto.imagen', read_only=True)
+
+    class Meta:
+        model = CompraItem
+        fields = ['id', 'producto', 'producto_nombre', 'producto_imagen', 'cantidad', 'precio_unitario', 'subtotal']
+        read_only_fields = fields
+
+
+class CompraSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializer para compras completas"""
     items = CompraItemSerializer(many=True, read_only=True)
-    total_items = serializers.ReadOnlyField()
+    total_items = serializers.IntegerField(read_only=True)
     usuario_username = serializers.CharField(source='usuario.username', read_only=True)
     
     class Meta:
@@ -124,6 +258,11 @@ class CompraSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'fecha_compra']
 
 
+class CompraListSerializer(CompraSerializer):
+    """Historial de compras: líneas compactas; el producto completo queda para el detalle"""
+    items = CompraItemResumenSerializer(many=True, read_only=True)
+
+
 class CompraCreateSerializer(serializers.ModelSerializer):
     """Serializer para crear una compra desde el carrito"""
     class Meta:
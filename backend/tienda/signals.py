@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+
+from .autocompletar import producto_eliminado, producto_guardado
+from .cache_respuestas import incrementar_version
+from .models import Categoria, Producto
+
+# Cualquier cambio en el catálogo invalida las respuestas cacheadas
+for modelo in (Producto, Categoria):
+    post_save.connect(incrementar_version, sender=modelo, dispatch_uid=f'version_catalogo_save_{modelo.__name__}')
+    post_delete.connect(incrementar_version, sender=modelo, dispatch_uid=f'version_catalogo_delete_{modelo.__name__}')
+
+# El índice de autocompletado se actualiza en el momento, sin reconstruirlo
+post_save.connect(producto_guardado, sender=Producto, dispatch_uid='autocompletar_save')
+post_delete.connect(producto_eliminado, sender=Producto, dispatch_uid='autocompletar_delete')
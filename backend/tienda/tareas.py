@@ -0,0 +1,74 @@
+"""
+Tareas periódicas dentro del proceso, para despliegues sin cron ni worker.
+
+Cada tarea corre en un hilo demonio que espera ``intervalo`` segundos entre
+ejecuciones. Los errores se registran y no detienen la tarea.
+
+Las tareas con intervalo configurado (``tareas_configuradas()``) se lanzan
+en un único proceso con ``python manage.py tareas_periodicas``, nunca al
+arrancar Django: cada worker de gunicorn, ``migrate`` o ``shell`` tendría su
+propia copia. Sin ese proceso, cada tarea tiene su comando para cron.
+"""
+import logging
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class TareaPeriodica:
+    def __init__(self, funcion, intervalo, nombre=None):
+        self.funcion = funcion
+        self.intervalo = intervalo
+        self.nombre = nombre or funcion.__name__
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name=self.nombre, daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def ejecutar(self):
+        close_old_connections()
+        try:
+            resultado = self.funcion()
+            logger.info('%s: %s', self.nombre, resultado)
+            return resultado
+        except Exception:
+            logger.exception('%s falló', self.nombre)
+        finally:
+            close_old_connections()
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            self.ejecutar()
+
+
+def tareas_configuradas():
+    """[(nombre, funcion, intervalo)] de las tareas periódicas con intervalo configurado"""
+    from . import almacen_carrito, analitica, idempotencia, limpieza, reservas, ventas
+
+    configuracion_reservas = reservas.get_configuracion()
+    tareas = [
+        ('limpiar_carritos', limpieza.limpiar_carritos_invitados, limpieza.get_configuracion()['INTERVALO']),
+        ('purgar_idempotencia', idempotencia.purgar_claves, idempotencia.get_configuracion()['INTERVALO_PURGA']),
+        ('liberar_reservas', reservas.liberar_caducadas,
+         configuracion_reservas['ACTIVAS'] and configuracion_reservas['INTERVALO']),
+        ('resumir_ventas', analitica.actualizar, analitica.get_configuracion()['INTERVALO']),
+        ('recalcular_ventanas', lambda: ventas.recalcular(ventanas=True),
+         ventas.get_configuracion()['INTERVALO_VENTANAS']),
+    ]
+    # Un almacén en la memoria del proceso sólo se puede volcar desde ese proceso (ver get_almacen)
+    if almacen_carrito.compartido(almacen_carrito.get_almacen()):
+        tareas.append(('volcar_carritos', lambda: almacen_carrito.get_almacen().volcar(),
+                       almacen_carrito.get_configuracion()['INTERVALO_VOLCADO']))
+    return [(nombre, funcion, intervalo) for nombre, funcion, intervalo in tareas if intervalo]
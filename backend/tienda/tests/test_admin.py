@@ -0,0 +1,81 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from tienda import admin as tienda_admin
+from tienda.models import Categoria, CarritoItem, Compra, CompraItem
+
+from .utils import crear_producto
+
+LISTADOS = ['categoria', 'producto', 'carritoitem', 'compra', 'compraitem']
+
+
+class ListadosAdminTests(TestCase):
+    """Los listados del admin ejecutan un número fijo de consultas sin importar cuántas filas muestran"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave-segura-123')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.tamano = 0
+
+    def poblar(self, tamano):
+        """Crear datos hasta ``tamano`` filas de cada listado, con usuarios, categorías y productos distintos"""
+        for i in range(self.tamano, tamano):
+            usuario = User.objects.create_user(f'lector{i}')
+            producto = crear_producto(Categoria.objects.create(nombre=f'Categoría {i}'), nombre=f'Libro {i}')
+            CarritoItem.objects.create(usuario=usuario, producto=producto, cantidad=i + 1)
+            compra = Compra.objects.create(usuario=usuario, total=Decimal('20.00'))
+            CompraItem.objects.create(compra=compra, producto=producto, cantidad=2,
+                                      precio_unitario=Decimal('10.00'), subtotal=Decimal('20.00'))
+        self.tamano = tamano
+
+    def consultas(self, modelo):
+        url = reverse(f'admin:tienda_{modelo}_changelist')
+        with CaptureQueriesContext(connection) as capturadas:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(capturadas)
+
+    def test_consultas_constantes(self):
+        self.poblar(2)
+        pocas = {modelo: self.consultas(modelo) for modelo in LISTADOS}
+        self.poblar(15)
+        for modelo in LISTADOS:
+            with self.subTest(modelo=modelo):
+                self.assertEqual(self.consultas(modelo), pocas[modelo])
+
+    def test_columnas_calculadas_en_la_consulta(self):
+        self.poblar(3)
+        response = self.client.get(reverse('admin:tienda_compra_changelist'), {'o': '4'})
+        self.assertEqual([compra.total_items for compra in response.context['cl'].result_list], [2, 2, 2])
+        response = self.client.get(reverse('admin:tienda_carritoitem_changelist'), {'o': '-4'})
+        self.assertEqual([item._subtotal for item in response.context['cl'].result_list],
+                         [Decimal('30.00'), Decimal('20.00'), Decimal('10.00')])
+
+    def test_conteo_estimado_en_tablas_grandes(self):
+        self.poblar(3)
+        url = reverse('admin:tienda_compra_changelist')
+        with mock.patch.object(tienda_admin, 'filas_estimadas', return_value=50000):
+            self.assertEqual(self.client.get(url).context['cl'].result_count, 50000)
+            # Con filtros se cuenta de verdad
+            self.assertEqual(self.client.get(url, {'estado': 'completada'}).context['cl'].result_count, 3)
+        # Por debajo del umbral, o sin estadísticas, también
+        with mock.patch.object(tienda_admin, 'filas_estimadas', return_value=40):
+            self.assertEqual(self.client.get(url).context['cl'].result_count, 3)
+        self.assertEqual(self.client.get(url).context['cl'].result_count, 3)
+
+    def test_filas_estimadas_con_estadisticas(self):
+        self.poblar(3)
+        if connection.vendor != 'sqlite':
+            self.skipTest('Estadísticas de SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE tienda_compra')
+        self.assertEqual(tienda_admin.filas_estimadas(Compra), 3)
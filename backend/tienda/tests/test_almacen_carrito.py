@@ -0,0 +1,180 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from tienda.almacen_carrito import MemoriaKV, Propietario, escribir_lineas, get_almacen
+from tienda.models import Categoria, CarritoItem, Compra
+
+from .utils import crear_producto, presupuesto_consultas
+
+
+@override_settings(TIENDA_ALMACEN_CARRITO={
+    'BACKEND': 'tienda.almacen_carrito.KVAlmacen', 'OPTIONS': {'cliente': 'memoria'},
+})
+class KVAlmacenTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(categoria, nombre='Dune', precio=Decimal('12.50'), stock=5)
+        cls.ubik = crear_producto(categoria, nombre='Ubik', precio=Decimal('7.25'), stock=2)
+
+    def setUp(self):
+        # Un almacén vacío por test (la base de datos se revierte, la memoria no)
+        get_almacen.cache_clear()
+
+    def cantidades(self, **propietario):
+        return dict(CarritoItem.objects.filter(**propietario).values_list('producto__nombre', 'cantidad'))
+
+    def test_carrito_de_invitado_y_volcado(self):
+        response = self.client.post('/api/carrito/', {'producto': self.dune.id, 'cantidad': 2})
+        self.assertEqual(response.status_code, 201)
+        session_key = response.data['session_key']
+        self.client.post('/api/carrito/', {'producto': self.dune.id, 'cantidad': 1, 'session_key': session_key})
+        self.client.post('/api/carrito/', {'producto': self.ubik.id, 'session_key': session_key})
+        response = self.client.patch(f'/api/carrito/{self.ubik.id}/?session_key={session_key}', {'cantidad': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cantidad'], 2)
+
+        with presupuesto_consultas(1):
+            response = self.client.get('/api/carrito/resumen/', {'session_key': session_key})
+        self.assertEqual(response.data['total'], 52.0)
+        self.assertEqual(response.data['cantidad_items'], 5)
+        # Nada llega a la base de datos hasta el volcado
+        self.assertEqual(self.cantidades(session_key=session_key), {})
+
+        self.assertEqual(get_almacen().volcar(), 1)
+        self.assertEqual(self.cantidades(session_key=session_key), {'Dune': 3, 'Ubik': 2})
+        self.assertEqual(get_almacen().volcar(), 0)
+
+        response = self.client.delete(f'/api/carrito/{self.dune.id}/?session_key={session_key}')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.delete(f'/api/carrito/{self.dune.id}/?session_key=otra').status_code, 404)
+        out = StringIO()
+        call_command('volcar_carritos', stdout=out)
+        self.assertIn('1 carritos volcados', out.getvalue())
+        self.assertEqual(self.cantidades(session_key=session_key), {'Ubik': 2})
+
+    def test_carga_el_carrito_guardado(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=4)
+        self.client.force_authenticate(self.usuario)
+        response = self.client.post('/api/carrito/', {'producto': self.dune.id, 'cantidad': 2})
+        # 4 + 2 supera el stock: se rechaza y el carrito no cambia
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/carrito/', {'producto': self.dune.id, 'cantidad': 1})
+        self.assertEqual(response.data['cantidad'], 5)
+        self.assertEqual(self.client.get('/api/carrito/').data['results'][0]['cantidad'], 5)
+
+    def test_lote(self):
+        self.client.force_authenticate(self.usuario)
+        response = self.client.post('/api/carrito/lote/', {'operaciones': [
+            {'accion': 'agregar', 'producto': self.dune.id, 'cantidad': 2},
+            {'accion': 'fijar', 'producto': self.ubik.id, 'cantidad': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cantidad_items'], 3)
+        response = self.client.post('/api/carrito/lote/', {'operaciones': [
+            {'accion': 'quitar', 'producto': self.dune.id},
+            {'accion': 'agregar', 'producto': self.ubik.id, 'cantidad': 5},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        get_almacen().volcar()
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 2, 'Ubik': 1})
+
+    def test_checkout_lee_el_carrito_del_almacen(self):
+        self.client.force_authenticate(self.usuario)
+        self.client.post('/api/carrito/', {'producto': self.dune.id, 'cantidad': 2})
+        self.client.post('/api/carrito/', {'producto': self.ubik.id, 'cantidad': 1})
+        response = self.client.post('/api/carrito/checkout/')
+        self.assertEqual(response.status_code, 201)
+        compra = Compra.objects.get(usuario=self.usuario)
+        self.assertEqual(compra.total, Decimal('32.25'))
+        self.assertEqual(self.client.get('/api/carrito/resumen/').data['items'], [])
+        get_almacen().volcar()
+        self.assertEqual(self.cantidades(usuario=self.usuario), {})
+
+    def test_login_fusiona_el_carrito_del_almacen(self):
+        self.usuario.set_password('clave-segura-123')
+        self.usuario.save()
+        session_key = self.client.post('/api/carrito/', {'producto': self.ubik.id}).data['session_key']
+        response = self.client.post('/api/auth/login/', {
+            'username': 'lector', 'password': 'clave-segura-123', 'session_key': session_key,
+        })
+        self.assertEqual(response.data['carrito_fusionado'], 1)
+        self.client.force_authenticate(self.usuario)
+        self.assertEqual(self.client.get('/api/carrito/resumen/').data['cantidad_items'], 1)
+        # El almacén ya no guarda el carrito del invitado
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/carrito/resumen/', {'session_key': session_key}).data['items'], [])
+
+    def test_volcado_fallido_se_reintenta(self):
+        almacen = get_almacen()
+        almacen.agregar(Propietario(self.usuario.id, None), self.dune, 1)
+        with mock.patch('tienda.almacen_carrito.escribir_lineas', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                almacen.volcar()
+        self.assertEqual(almacen.volcar(), 1)
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 1})
+
+    def test_instantanea_fallida_sigue_pendiente(self):
+        almacen, propietario = get_almacen(), Propietario(self.usuario.id, None)
+        almacen.agregar(propietario, self.dune, 1)
+        with mock.patch('tienda.almacen_carrito.escribir_lineas', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                almacen.instantanea(propietario)
+        self.assertEqual(almacen.volcar(), 1)
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 1})
+
+    def test_cambios_durante_el_volcado_siguen_pendientes(self):
+        almacen, propietario = get_almacen(), Propietario(self.usuario.id, None)
+        almacen.agregar(propietario, self.dune, 1)
+
+        def anadir_entre_medias(cambios):
+            almacen.agregar(propietario, self.dune, 1)
+            escribir_lineas(cambios)
+
+        with mock.patch('tienda.almacen_carrito.escribir_lineas', side_effect=anadir_entre_medias):
+            almacen.volcar()
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 1})
+        self.assertEqual(almacen.volcar(), 1)
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 2})
+
+    def test_created_at(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.ubik, cantidad=1)
+        self.client.force_authenticate(self.usuario)
+        creado = self.client.post('/api/carrito/', {'producto': self.dune.id}).data['created_at']
+        self.assertIsNotNone(creado)
+        self.client.post('/api/carrito/', {'producto': self.dune.id})
+        lineas = {item['producto']['nombre']: item for item in self.client.get('/api/carrito/').data['results']}
+        self.assertEqual(lineas['Dune']['created_at'], creado)
+        self.assertEqual(
+            lineas['Ubik']['created_at'], self.client.get(f'/api/carrito/{self.ubik.id}/').data['created_at']
+        )
+        self.assertIsNotNone(lineas['Ubik']['created_at'])
+
+
+class MemoriaKVTests(SimpleTestCase):
+    def test_hashes_conjuntos_y_pipeline(self):
+        kv = MemoriaKV()
+        pipe = kv.pipeline()
+        pipe.hsetnx('h', 'a', 1).hsetnx('h', 'a', 2).hincrby('h', 'b', 3).hgetall('h')
+        self.assertEqual(pipe.execute(), [1, 0, 3, {'a': '1', 'b': '3'}])
+        self.assertEqual(kv.hdel('h', 'a', 'x'), 1)
+        self.assertEqual(kv.sadd('s', 'x', 'y', 'x'), 2)
+        self.assertEqual(kv.smembers('s'), {'x', 'y'})
+        self.assertEqual(sorted(kv.spop('s', 5)), ['x', 'y'])
+        self.assertEqual(kv.spop('s', 5), [])
+
+    def test_caducidad(self):
+        kv = MemoriaKV()
+        kv.hset('h', 'a', 1)
+        self.assertFalse(kv.expire('otra', 10))
+        with mock.patch('tienda.almacen_carrito.time.monotonic', return_value=0):
+            kv.expire('h', 10)
+        with mock.patch('tienda.almacen_carrito.time.monotonic', return_value=11):
+            self.assertEqual(kv.hgetall('h'), {})
@@ -0,0 +1,119 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda import analitica
+from tienda.models import Categoria, Compra, CompraItem, PuntoControl, VentaDiaria
+
+from .utils import crear_producto
+
+# Posterior a todas las compras del test más el MARGEN
+DESPUES = timezone.now() + timedelta(days=1)
+
+
+class AnaliticaTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('finanzas', is_staff=True)
+        cls.cliente = User.objects.create_user('lector')
+        ficcion = Categoria.objects.create(nombre='Ficción')
+        ensayo = Categoria.objects.create(nombre='Ensayo')
+        cls.dune = crear_producto(ficcion, nombre='Dune')
+        cls.ubik = crear_producto(ficcion, nombre='Ubik')
+        cls.sapiens = crear_producto(ensayo, nombre='Sapiens')
+
+    def comprar(self, fecha, lineas, metodo_pago='stripe', estado='completada'):
+        compra = Compra.objects.create(
+            usuario=self.cliente, metodo_pago=metodo_pago, estado=estado,
+            total=sum(Decimal(precio) * cantidad for _, cantidad, precio in lineas),
+        )
+        Compra.objects.filter(pk=compra.pk).update(
+            fecha_compra=datetime.combine(fecha, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+            + timedelta(hours=12)
+        )
+        for producto, cantidad, precio in lineas:
+            CompraItem.objects.create(compra=compra, producto=producto, cantidad=cantidad,
+                                      precio_unitario=Decimal(precio))
+        return compra
+
+    def filas(self):
+        return {
+            (fila.dia, fila.categoria.nombre, fila.metodo_pago): (fila.lineas, fila.unidades, fila.ingresos)
+            for fila in VentaDiaria.objects.select_related('categoria')
+        }
+
+    def test_incremental(self):
+        self.comprar(date(2024, 3, 1), [(self.dune, 2, '10.00'), (self.ubik, 1, '5.00'), (self.sapiens, 1, '20.00')])
+        self.comprar(date(2024, 3, 1), [(self.dune, 1, '10.00')], metodo_pago='paypal')
+        self.comprar(date(2024, 3, 1), [(self.dune, 9, '10.00')], estado='cancelada')
+        resultado = analitica.actualizar(lote=2, ahora=DESPUES)
+        self.assertEqual((resultado.compras, resultado.lotes), (3, 2))
+        self.assertEqual(self.filas(), {
+            (date(2024, 3, 1), 'Ficción', 'stripe'): (2, 3, Decimal('25.00')),
+            (date(2024, 3, 1), 'Ensayo', 'stripe'): (1, 1, Decimal('20.00')),
+            (date(2024, 3, 1), 'Ficción', 'paypal'): (1, 1, Decimal('10.00')),
+        })
+
+        # Sólo las compras nuevas se suman a las filas existentes
+        self.comprar(date(2024, 3, 1), [(self.ubik, 4, '5.00')])
+        self.comprar(date(2024, 3, 2), [(self.sapiens, 1, '20.00')])
+        self.assertEqual(analitica.actualizar(ahora=DESPUES).compras, 2)
+        self.assertEqual(self.filas()[(date(2024, 3, 1), 'Ficción', 'stripe')], (3, 7, Decimal('45.00')))
+        self.assertEqual(self.filas()[(date(2024, 3, 2), 'Ensayo', 'stripe')], (1, 1, Decimal('20.00')))
+        self.assertEqual(analitica.actualizar(ahora=DESPUES).compras, 0)
+
+    def test_las_compras_recientes_esperan(self):
+        compra = self.comprar(date(2024, 3, 1), [(self.dune, 1, '10.00')])
+        Compra.objects.filter(pk=compra.pk).update(fecha_compra=timezone.now())
+        self.assertEqual(analitica.actualizar().compras, 0)
+        self.assertEqual(analitica.actualizar(ahora=timezone.now() + timedelta(minutes=2)).compras, 1)
+
+    def test_reconstruir(self):
+        compra = self.comprar(date(2024, 3, 1), [(self.dune, 1, '10.00')])
+        self.comprar(date(2024, 3, 1), [(self.dune, 2, '10.00')])
+        analitica.actualizar(ahora=DESPUES)
+        Compra.objects.filter(pk=compra.pk).update(estado='cancelada')
+        out = StringIO()
+        # El comando usa la hora actual: todas las compras son de hace más de MARGEN
+        call_command('resumir_ventas', '--completo', stdout=out)
+        self.assertIn('[OK] 2 compras resumidas en 1 filas', out.getvalue())
+        self.assertEqual(self.filas(), {(date(2024, 3, 1), 'Ficción', 'stripe'): (1, 2, Decimal('20.00'))})
+        self.assertEqual(PuntoControl.objects.get(nombre=analitica.PUNTO_CONTROL).ultimo_id, Compra.objects.latest('id').id)
+
+    def test_api(self):
+        self.comprar(date(2024, 2, 28), [(self.sapiens, 1, '20.00')])
+        self.comprar(date(2024, 3, 1), [(self.dune, 2, '10.00'), (self.sapiens, 1, '20.00')])
+        self.comprar(date(2024, 3, 2), [(self.ubik, 1, '5.00')], metodo_pago='paypal')
+        analitica.actualizar(ahora=DESPUES)
+        self.client.force_authenticate(self.staff)
+
+        response = self.client.get('/api/analitica/ventas/', {'desde': '2024-03-01', 'hasta': '2024-03-02'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(fila['dia'], fila['ingresos']) for fila in response.data['filas']],
+                         [(date(2024, 3, 1), Decimal('40.00')), (date(2024, 3, 2), Decimal('5.00'))])
+        self.assertEqual(response.data['totales'], {'lineas': 3, 'unidades': 4, 'ingresos': Decimal('45.00')})
+        self.assertIsNotNone(response.data['actualizado'])
+
+        response = self.client.get('/api/analitica/ventas/', {'agrupar': 'mes,categoria'})
+        self.assertEqual(
+            [(fila['mes'], fila['categoria'], fila['unidades']) for fila in response.data['filas']],
+            [(date(2024, 2, 1), 'Ensayo', 1), (date(2024, 3, 1), 'Ficción', 3), (date(2024, 3, 1), 'Ensayo', 1)],
+        )
+        response = self.client.get('/api/analitica/ventas/', {'agrupar': 'metodo_pago'})
+        self.assertEqual({fila['metodo_pago']: fila['ingresos'] for fila in response.data['filas']},
+                         {'paypal': Decimal('5.00'), 'stripe': Decimal('60.00')})
+
+    def test_api_no_valida(self):
+        self.client.force_authenticate(self.cliente)
+        self.assertEqual(self.client.get('/api/analitica/ventas/').status_code, 403)
+        self.client.force_authenticate(self.staff)
+        for params in [{'desde': 'ayer'}, {'hasta': '2024-02-30'}, {'agrupar': 'producto'}]:
+            with self.subTest(params=params):
+                response = self.client.get('/api/analitica/ventas/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(next(iter(params)), response.data)
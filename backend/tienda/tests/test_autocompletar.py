@@ -0,0 +1,109 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from tienda import autocompletar
+from tienda.autocompletar import IndicePrefijos, get_indice, reiniciar_indice
+from tienda.models import Categoria, Producto
+
+from .utils import crear_producto, presupuesto_consultas
+
+
+class IndicePrefijosTests(SimpleTestCase):
+    def setUp(self):
+        self.indice = IndicePrefijos()
+        self.indice.construir([
+            (1, 'Cien años de soledad', 'Gabriel García Márquez'),
+            (2, 'El amor en los tiempos del cólera', 'Gabriel García Márquez'),
+            (3, 'Ficciones', 'Jorge Luis Borges'),
+            (4, 'Garcia y los gatos', 'Ana Pérez'),
+        ])
+
+    def ids(self, texto, limite=8):
+        return [resultado['id'] for resultado in self.indice.buscar(texto, limite)]
+
+    def test_prefijo_de_cualquier_palabra_sin_acentos(self):
+        self.assertEqual(self.ids('sole'), [1])
+        self.assertEqual(self.ids('CÓLE'), [2])
+        self.assertEqual(self.ids('marq'), [1, 2])
+        self.assertEqual(self.ids('garcia marq'), [1, 2])
+        self.assertEqual(self.ids('borges jorge'), [])
+        self.assertEqual(self.ids('  '), [])
+
+    def test_titulos_antes_que_autores_y_limite(self):
+        self.assertEqual(self.ids('garc'), [4, 1, 2])
+        self.assertEqual(self.ids('garc', limite=2), [4, 1])
+
+    def test_actualizacion_incremental(self):
+        self.indice.agregar(3, 'Ficciones completas', 'Jorge Luis Borges')
+        self.indice.agregar(5, 'Soledades', 'Luis de Góngora')
+        self.assertEqual(self.ids('complet'), [3])
+        self.assertEqual(self.ids('sole'), [1, 5])
+        self.indice.eliminar(1)
+        self.indice.eliminar(99)
+        self.assertEqual(self.ids('sole'), [5])
+        self.assertEqual(self.ids('cien'), [])
+        self.assertEqual(len(self.indice), 4)
+
+    def test_memoria_acotada(self):
+        indice = IndicePrefijos(max_productos=2, max_palabras=2)
+        indice.construir([(1, 'Uno dos tres', 'A'), (2, 'Cuatro', 'B'), (3, 'Cinco', 'C')])
+        self.assertEqual(len(indice), 2)
+        self.assertEqual([r['id'] for r in indice.buscar('dos')], [1])
+        self.assertEqual(indice.buscar('tres'), [])
+        indice.agregar(4, 'Seis', 'D')
+        self.assertEqual(indice.buscar('seis'), [])
+
+
+class AutocompletarEndpointTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(cls.categoria, nombre='Dune', autor='Frank Herbert')
+
+    def setUp(self):
+        reiniciar_indice()
+        self.addCleanup(reiniciar_indice)
+
+    def test_sin_consultas_tras_construir(self):
+        get_indice()
+        with presupuesto_consultas(0):
+            response = self.client.get('/api/productos/autocompletar/', {'q': 'herb'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [{'id': self.dune.id, 'nombre': 'Dune', 'autor': 'Frank Herbert'}])
+
+    def test_sigue_las_senales_de_producto(self):
+        get_indice()
+        nuevo = crear_producto(self.categoria, nombre='Hijos de Dune', autor='Frank Herbert')
+        self.assertEqual(len(self.client.get('/api/productos/autocompletar/', {'q': 'dune'}).data), 2)
+        self.dune.nombre = 'Duna'
+        self.dune.save()
+        Producto.objects.get(pk=nuevo.pk).delete()
+        self.assertEqual(self.client.get('/api/productos/autocompletar/', {'q': 'dune'}).data, [])
+        self.assertEqual(len(self.client.get('/api/productos/autocompletar/', {'q': 'duna'}).data), 1)
+
+    @override_settings(TIENDA_AUTOCOMPLETAR={'REFRESCO': 60})
+    def test_se_reconstruye_periodicamente(self):
+        with mock.patch('tienda.autocompletar.time.monotonic', return_value=1000):
+            indice = get_indice()
+        # Los cambios con update() no emiten señales
+        Producto.objects.filter(pk=self.dune.pk).update(nombre='Duna')
+        with mock.patch('tienda.autocompletar.time.monotonic', return_value=1059):
+            self.assertIs(get_indice(), indice)
+        with mock.patch('tienda.autocompletar.time.monotonic', return_value=1061):
+            self.assertEqual([r['nombre'] for r in get_indice().buscar('dun')], ['Duna'])
+        self.assertIsNot(autocompletar._indice, indice)
+
+    @override_settings(TIENDA_AUTOCOMPLETAR={'REFRESCO': 60})
+    def test_no_espera_a_otra_reconstruccion(self):
+        with mock.patch('tienda.autocompletar.time.monotonic', return_value=1000):
+            indice = get_indice()
+        # Otro hilo está reconstruyendo: se responde con el índice caducado sin esperar
+        with autocompletar._lock_indice:
+            with mock.patch('tienda.autocompletar.time.monotonic', return_value=1061), presupuesto_consultas(0):
+                self.assertIs(get_indice(), indice)
+
+    def test_limite(self):
+        self.assertEqual(self.client.get('/api/productos/autocompletar/', {'q': 'dune', 'limit': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/productos/autocompletar/', {'q': 'dune', 'limit': '0'}).data, [])
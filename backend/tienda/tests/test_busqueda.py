@@ -0,0 +1,103 @@
+from django.contrib.auth.models import User
+from rest_framework.test import APITestCase
+
+from tienda.busqueda import BasicBackend, BusquedaBackend, get_backend, normalizar
+from tienda.models import Categoria, Producto
+
+from .utils import crear_producto, sin_cache_respuestas
+
+
+@sin_cache_respuestas
+class BusquedaTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Ficción')
+        cls.cien_anos = crear_producto(
+            cls.categoria, nombre='Cien Años de Soledad', autor='Gabriel García Márquez',
+            descripcion='La obra maestra del realismo mágico.',
+        )
+        cls.dune = crear_producto(
+            cls.categoria, nombre='Dune', autor='Frank Herbert',
+            descripcion='Ciencia ficción en Arrakis.',
+            contraportada='Paul Atreides y la especia; una historia sobre la soledad del poder.',
+        )
+
+    def buscar(self, termino):
+        return [p.id for p in get_backend().buscar(Producto.objects.all(), termino)]
+
+    def test_normalizar_pliega_acentos(self):
+        self.assertEqual(normalizar('García MÁRQUEZ'), 'garcia marquez')
+
+    def test_busqueda_sin_acentos(self):
+        self.assertEqual(self.buscar('garcia marquez'), [self.cien_anos.id])
+
+    def test_busqueda_en_descripcion_y_contraportada(self):
+        self.assertEqual(self.buscar('realismo'), [self.cien_anos.id])
+        self.assertEqual(self.buscar('especia'), [self.dune.id])
+
+    def test_un_solo_match(self):
+        sql = str(get_backend().buscar(Producto.objects.all(), 'soledad').query)
+        self.assertEqual(sql.count('MATCH'), 1)
+
+    def test_backend_incompleto_no_se_instancia(self):
+        class SinFiltrar(BusquedaBackend):
+            pass
+
+        with self.assertRaises(TypeError):
+            SinFiltrar()
+
+    def test_resultados_ordenados_por_relevancia(self):
+        # "soledad" aparece en el título de uno y sólo en la contraportada del otro
+        self.assertEqual(self.buscar('soledad'), [self.cien_anos.id, self.dune.id])
+
+    def test_busqueda_por_prefijo_y_caracteres_especiales(self):
+        self.assertEqual(self.buscar('herb'), [self.dune.id])
+        self.assertEqual(self.buscar('"dune" (*'), [self.dune.id])
+        self.assertEqual(self.buscar('  '), [])
+
+    def test_backend_basico_pliega_acentos(self):
+        basico = BasicBackend()
+        for termino, esperado in [('garcia marquez', [self.cien_anos.id]), ('GARCÍA', [self.cien_anos.id]),
+                                  ('ficcion', [self.dune.id]), ('"años" (*', [self.cien_anos.id]), ('  ', [])]:
+            with self.subTest(termino=termino):
+                self.assertEqual([p.id for p in basico.buscar(Producto.objects.order_by('id'), termino)], esperado)
+
+    def test_indice_sincronizado_con_save_update_y_delete(self):
+        self.dune.nombre = 'Hijos de Dune'
+        self.dune.save()
+        self.assertEqual(self.buscar('hijos'), [self.dune.id])
+
+        Producto.objects.filter(pk=self.dune.pk).update(autor='Brian Herbert')
+        self.assertEqual(self.buscar('brian'), [self.dune.id])
+
+        self.cien_anos.autor = 'Gabo'
+        Producto.objects.bulk_update([self.cien_anos], ['autor'])
+        self.assertEqual(self.buscar('marquez'), [])
+        self.assertEqual(self.buscar('gabo'), [self.cien_anos.id])
+
+        self.dune.delete()
+        self.assertEqual(self.buscar('hijos'), [])
+
+    def test_edicion_desde_list_editable_del_admin(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave-segura-123')
+        self.client.force_login(admin)
+        response = self.client.post('/admin/tienda/producto/', {
+            'form-TOTAL_FORMS': '2',
+            'form-INITIAL_FORMS': '2',
+            'form-0-id': str(self.dune.id),
+            'form-0-precio': '30.00',
+            'form-0-stock': '3',
+            'form-1-id': str(self.cien_anos.id),
+            'form-1-precio': '18.99',
+            'form-1-stock': '12',
+            '_save': 'Save',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.dune.refresh_from_db()
+        self.assertEqual(self.dune.stock, 3)
+        self.assertEqual(self.buscar('arrakis'), [self.dune.id])
+
+    def test_endpoint_usa_el_indice(self):
+        response = self.client.get('/api/productos/', {'search': 'garcia'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in response.data['results']], [self.cien_anos.id])
@@ -0,0 +1,150 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from tienda import cache_respuestas
+from tienda.cache_respuestas import LRUBackend
+from tienda.models import Categoria, CarritoItem, Producto
+
+from .utils import crear_producto, presupuesto_consultas
+
+
+class LRUBackendTests(SimpleTestCase):
+    def test_desaloja_las_menos_usadas_al_superar_el_tamano(self):
+        lru = LRUBackend(ttl=60, max_bytes=25)
+        lru.set('a', 'x' * 8)
+        lru.set('b', 'y' * 8)
+        lru.get('a')
+        lru.set('c', 'z' * 8)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 'x' * 8)
+        self.assertEqual(lru.get('c'), 'z' * 8)
+        self.assertLessEqual(lru.bytes, 25)
+
+    def test_no_guarda_valores_mayores_que_el_limite(self):
+        lru = LRUBackend(ttl=60, max_bytes=10)
+        lru.set('a', 'x' * 20)
+        self.assertEqual(len(lru), 0)
+
+    def test_caducidad(self):
+        lru = LRUBackend(ttl=30)
+        with mock.patch('tienda.cache_respuestas.time.monotonic', return_value=1000):
+            lru.set('a', [1, 2])
+        with mock.patch('tienda.cache_respuestas.time.monotonic', return_value=1029):
+            self.assertEqual(lru.get('a'), [1, 2])
+        with mock.patch('tienda.cache_respuestas.time.monotonic', return_value=1031):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.bytes, 0)
+
+
+class CacheRespuestasTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Ficción')
+        cls.producto = crear_producto(cls.categoria, nombre='Dune', stock=5)
+
+    def setUp(self):
+        cache.clear()
+        cache_respuestas.get_backend().clear()
+
+    def test_segunda_peticion_sin_consultas(self):
+        primera = self.client.get('/api/productos/', {'categoria': self.categoria.id, 'precio_min': ''})
+        self.assertEqual(primera['X-Cache'], 'MISS')
+        with presupuesto_consultas(0):
+            # Mismos parámetros en otro orden y con valores vacíos
+            segunda = self.client.get('/api/productos/', {'precio_max': '', 'categoria': self.categoria.id})
+        self.assertEqual(segunda['X-Cache'], 'HIT')
+        self.assertEqual(segunda.data, primera.data)
+
+        self.client.get('/api/categorias/')
+        self.assertEqual(self.client.get('/api/categorias/')['X-Cache'], 'HIT')
+        self.client.get(f'/api/productos/{self.producto.id}/')
+        self.assertEqual(self.client.get(f'/api/productos/{self.producto.id}/')['X-Cache'], 'HIT')
+
+    def test_parametros_distintos_no_comparten_entrada(self):
+        self.client.get('/api/productos/', {'ordering': 'precio'})
+        self.assertEqual(self.client.get('/api/productos/', {'ordering': '-precio'})['X-Cache'], 'MISS')
+
+    def test_cambios_en_el_catalogo_invalidan(self):
+        self.client.get('/api/productos/')
+        self.producto.precio = 99
+        self.producto.save()
+        response = self.client.get('/api/productos/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['precio'], '99.00')
+
+        self.client.get('/api/categorias/')
+        Categoria.objects.create(nombre='Mangas')
+        self.assertEqual(len(self.client.get('/api/categorias/').data), 2)
+
+        self.client.get('/api/productos/')
+        Producto.objects.get(pk=self.producto.pk).delete()
+        self.assertEqual(self.client.get('/api/productos/').data['count'], 0)
+
+    def test_checkout_invalida_el_stock(self):
+        usuario = User.objects.create_user('lector', password='clave-segura-123')
+        CarritoItem.objects.create(usuario=usuario, producto=self.producto, cantidad=2)
+        self.assertEqual(self.client.get(f'/api/productos/{self.producto.id}/').data['stock'], 5)
+        self.client.force_authenticate(usuario)
+        self.assertEqual(self.client.post('/api/carrito/checkout/').status_code, 201)
+        self.assertEqual(self.client.get(f'/api/productos/{self.producto.id}/').data['stock'], 3)
+
+    def test_version_perdida_no_reutiliza_entradas(self):
+        self.client.get('/api/productos/')
+        Producto.objects.filter(pk=self.producto.pk).update(nombre='Otro')
+        cache_respuestas._cache_version().clear()
+        cache_respuestas.olvidar_version()
+        response = self.client.get('/api/productos/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['nombre'], 'Otro')
+
+    def test_version_compartida_entre_procesos(self):
+        self.client.get('/api/productos/')
+        Producto.objects.filter(pk=self.producto.pk).update(nombre='Otro')
+        # Otro proceso (otra conexión a la misma caché) invalida tras escribir
+        caches.create_connection(cache_respuestas.get_configuracion()['VERSION_CACHE']).incr(
+            cache_respuestas.CLAVE_VERSION
+        )
+        # Este proceso la ve cuando caduca su copia en memoria, sin leerla en cada petición
+        with mock.patch.object(cache_respuestas, '_cache_version') as cache_version:
+            self.assertEqual(self.client.get('/api/productos/')['X-Cache'], 'HIT')
+        cache_version.assert_not_called()
+        ttl = cache_respuestas.get_configuracion()['VERSION_TTL']
+        with mock.patch('tienda.cache_respuestas.time.monotonic', return_value=time.monotonic() + ttl):
+            response = self.client.get('/api/productos/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['nombre'], 'Otro')
+
+    @override_settings(TIENDA_RESERVAS={'ACTIVAS': True, 'TTL': 60})
+    def test_reservar_solo_invalida_al_agotarse(self):
+        url = f'/api/productos/{self.producto.id}/'
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/carrito/', {'producto': self.producto.id, 'cantidad': 2, 'session_key': 'a'})
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/carrito/', {'producto': self.producto.id, 'cantidad': 3, 'session_key': 'b'})
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual((response.data['reservado'], response.data['disponible']), (5, 0))
+
+        # Y al volver a haber unidades libres
+        item = CarritoItem.objects.get(session_key='b')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/carrito/{item.id}/?session_key=b')
+        self.assertEqual(self.client.get(url).data['disponible'], 3)
+
+    @override_settings(TIENDA_CACHE_RESPUESTAS={'BACKEND': 'tienda.cache_respuestas.DjangoCacheBackend'})
+    def test_backend_cache_de_django(self):
+        self.client.get('/api/categorias/')
+        self.assertEqual(self.client.get('/api/categorias/')['X-Cache'], 'HIT')
+
+    @override_settings(TIENDA_CACHE_RESPUESTAS={'BACKEND': None})
+    def test_desactivada(self):
+        self.client.get('/api/categorias/')
+        self.assertNotIn('X-Cache', self.client.get('/api/categorias/'))
@@ -0,0 +1,85 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from tienda.models import Categoria, CarritoItem, Compra, CompraItem
+
+from .utils import crear_producto, sin_cache_respuestas
+
+CONTRAPORTADA = 'En el planeta desértico de Arrakis se encuentra la especia. ' * 10
+
+
+@sin_cache_respuestas
+class CamposDinamicosTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector', password='clave-segura-123')
+        cls.categoria = Categoria.objects.create(nombre='Ficción', descripcion='Novelas')
+        cls.producto = crear_producto(
+            cls.categoria, nombre='Dune', descripcion='Ciencia ficción', contraportada=CONTRAPORTADA,
+        )
+        CarritoItem.objects.create(usuario=cls.usuario, producto=cls.producto, cantidad=2)
+        cls.compra = Compra.objects.create(usuario=cls.usuario, total=20)
+        CompraItem.objects.create(compra=cls.compra, producto=cls.producto, cantidad=2, precio_unitario=10)
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data, ' '.join(consulta['sql'] for consulta in consultas)
+
+    def test_listado_compacto(self):
+        data, sql = self.get('/api/productos/')
+        producto = data['results'][0]
+        self.assertNotIn('descripcion', producto)
+        self.assertNotIn('contraportada', producto)
+        self.assertEqual(producto['resumen'], CONTRAPORTADA[:200])
+        self.assertEqual(producto['categoria'], {'id': self.categoria.id, 'nombre': 'Ficción'})
+        # Las columnas largas no se leen de la base de datos
+        self.assertNotIn('"tienda_producto"."descripcion"', sql)
+        self.assertEqual(
+            sql.count('"tienda_producto"."contraportada"'), sql.count('SUBSTR("tienda_producto"."contraportada"')
+        )
+        self.assertNotIn('"tienda_categoria"."descripcion"', sql)
+
+    def test_detalle_completo(self):
+        data, _ = self.get(f'/api/productos/{self.producto.id}/')
+        self.assertEqual(data['contraportada'], CONTRAPORTADA)
+        self.assertEqual(data['categoria']['descripcion'], 'Novelas')
+
+    def test_fields_y_omit(self):
+        data, _ = self.get('/api/productos/', {'fields': 'id,nombre,precio'})
+        self.assertEqual(set(data['results'][0]), {'id', 'nombre', 'precio'})
+
+        data, sql = self.get(f'/api/productos/{self.producto.id}/', {'omit': 'contraportada,categoria.descripcion'})
+        self.assertNotIn('contraportada', data)
+        self.assertEqual(set(data['categoria']), {'id', 'nombre'})
+        self.assertNotIn('contraportada', sql)
+        self.assertNotIn('"tienda_categoria"."descripcion"', sql)
+
+        data, _ = self.get('/api/categorias/', {'omit': 'descripcion'})
+        self.assertEqual(data, [{'id': self.categoria.id, 'nombre': 'Ficción'}])
+
+    def test_serializers_anidados(self):
+        self.client.force_authenticate(self.usuario)
+        data, _ = self.get('/api/carrito/', {'fields': 'id,cantidad,producto.nombre,producto.precio'})
+        self.assertEqual(data['results'][0], {
+            'id': data['results'][0]['id'], 'cantidad': 2, 'producto': {'nombre': 'Dune', 'precio': '10.00'},
+        })
+
+        data, sql = self.get(f'/api/compras/{self.compra.id}/', {'omit': 'items.producto'})
+        self.assertNotIn('producto', data['items'][0])
+        self.assertEqual(data['items'][0]['producto_nombre'], 'Dune')
+        self.assertNotIn('"tienda_producto"."contraportada"', sql)
+
+    def test_productos_embebidos_sin_textos_largos(self):
+        self.client.force_authenticate(self.usuario)
+        data, _ = self.get('/api/carrito/')
+        self.assertNotIn('contraportada', data['results'][0]['producto'])
+        data, _ = self.get(f'/api/compras/{self.compra.id}/')
+        self.assertNotIn('descripcion', data['items'][0]['producto'])
+        # En el historial, sólo el id del producto
+        data, sql = self.get('/api/compras/')
+        self.assertEqual(data['results'][0]['items'][0]['producto'], self.producto.id)
+        self.assertNotIn('"tienda_producto"."descripcion"', sql)
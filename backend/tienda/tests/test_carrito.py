@@ -0,0 +1,318 @@
+import threading
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient, APITestCase
+
+from tienda.almacen_carrito import ORMAlmacen, Propietario
+from tienda.models import Categoria, CarritoItem, Compra, CompraItem, Producto
+from tienda.ventas import StockAgotado, vender
+
+from .utils import crear_producto, presupuesto_consultas
+
+
+class ResumenCarritoTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(categoria, nombre='Dune', precio=Decimal('12.50'), stock=10)
+        cls.ubik = crear_producto(categoria, nombre='Ubik', precio=Decimal('7.25'), stock=1)
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+
+    def test_resumen(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=2)
+        ubik = CarritoItem.objects.create(usuario=self.usuario, producto=self.ubik, cantidad=3)
+        with presupuesto_consultas(1):
+            response = self.client.get('/api/carrito/resumen/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 46.75)
+        self.assertEqual(response.data['cantidad_items'], 5)
+        self.assertEqual(
+            sorted((item['producto']['nombre'], item['subtotal']) for item in response.data['items']),
+            [('Dune', Decimal('25.00')), ('Ubik', Decimal('21.75'))],
+        )
+        self.assertEqual(len(response.data['avisos_stock']), 1)
+        self.assertEqual(response.data['avisos_stock'][0]['item'], ubik.id)
+        self.assertEqual(response.data['avisos_stock'][0]['stock'], 1)
+
+        with presupuesto_consultas(1):
+            self.assertEqual(self.client.get('/api/carrito/total/').data, {'total': 46.75})
+
+    def test_carrito_vacio(self):
+        self.assertEqual(self.client.get('/api/carrito/resumen/').data, {
+            'items': [], 'total': 0.0, 'cantidad_items': 0, 'avisos_stock': [],
+        })
+        self.assertEqual(self.client.get('/api/carrito/total/').data, {'total': 0.0})
+
+    def test_invitado(self):
+        self.client.force_authenticate(None)
+        CarritoItem.objects.create(session_key='invitado', producto=self.dune, cantidad=1)
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.ubik, cantidad=1)
+        response = self.client.get('/api/carrito/resumen/', {'session_key': 'invitado'})
+        self.assertEqual(response.data['total'], 12.5)
+        self.assertEqual(len(response.data['items']), 1)
+        self.assertEqual(self.client.get('/api/carrito/resumen/').data['items'], [])
+
+
+class LoteCarritoTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(categoria, nombre='Dune', precio=Decimal('10.00'), stock=5)
+        cls.ubik = crear_producto(categoria, nombre='Ubik', precio=Decimal('5.00'), stock=2)
+        cls.solaris = crear_producto(categoria, nombre='Solaris', stock=9)
+
+    def lote(self, *operaciones, **extra):
+        return self.client.post('/api/carrito/lote/', {'operaciones': list(operaciones), **extra}, format='json')
+
+    def cantidades(self, **propietario):
+        return dict(CarritoItem.objects.filter(**propietario).values_list('producto__nombre', 'cantidad'))
+
+    def test_aplica_las_operaciones_en_orden(self):
+        self.client.force_authenticate(self.usuario)
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.solaris, cantidad=4)
+        response = self.lote(
+            {'accion': 'agregar', 'producto': self.dune.id, 'cantidad': 2},
+            {'accion': 'agregar', 'producto': self.ubik.id},
+            {'accion': 'agregar', 'producto': self.ubik.id},
+            {'accion': 'quitar', 'producto': self.solaris.id},
+            {'accion': 'agregar', 'producto': self.solaris.id, 'cantidad': 9},
+            {'accion': 'fijar', 'producto': self.solaris.id, 'cantidad': 0},
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 3, 'Ubik': 2})
+        self.assertEqual(response.data['total'], 40.0)
+        self.assertEqual(response.data['cantidad_items'], 5)
+        self.assertNotIn('session_key', response.data)
+
+    def test_todo_o_nada(self):
+        self.client.force_authenticate(self.usuario)
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        response = self.lote(
+            {'accion': 'fijar', 'producto': self.dune.id, 'cantidad': 4},
+            {'accion': 'agregar', 'producto': self.ubik.id, 'cantidad': 3},
+            {'accion': 'agregar', 'producto': 999999},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['productos']), {str(self.ubik.id), '999999'})
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 1})
+
+        response = self.lote({'accion': 'vaciar', 'producto': self.dune.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lote().status_code, 400)
+
+    def test_invitado(self):
+        response = self.lote({'accion': 'agregar', 'producto': self.dune.id})
+        self.assertEqual(response.status_code, 200)
+        session_key = response.data['session_key']
+        self.assertEqual(self.cantidades(session_key=session_key), {'Dune': 1})
+
+        response = self.lote({'accion': 'fijar', 'producto': self.ubik.id, 'cantidad': 2}, session_key=session_key)
+        self.assertEqual(response.data['session_key'], session_key)
+        self.assertEqual(self.cantidades(session_key=session_key), {'Dune': 1, 'Ubik': 2})
+        self.assertEqual(len(response.data['items']), 2)
+
+
+class IncrementosConcurrentesTests(TransactionTestCase):
+    """Varias pestañas añadiendo el mismo producto a la vez (SQLite en modo WAL, con hilos reales)"""
+    HILOS = 8
+    POR_HILO = 10
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('lector')
+        self.categoria = Categoria.objects.create(nombre='Ficción')
+
+    def añadir_en_paralelo(self, producto, **datos):
+        barrera = threading.Barrier(self.HILOS)
+        estados, errores = [], []
+
+        def trabajador():
+            try:
+                client = APIClient()
+                if 'session_key' not in datos:
+                    client.force_authenticate(self.usuario)
+                barrera.wait()
+                for _ in range(self.POR_HILO):
+                    response = client.post('/api/carrito/', {'producto': producto.id, 'cantidad': 1, **datos})
+                    estados.append(response.status_code)
+            except Exception as error:  # noqa: BLE001 - se comprueba en el hilo principal
+                errores.append(error)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajador) for _ in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        return estados
+
+    def test_modo_wal(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_no_se_pierden_incrementos(self):
+        producto = crear_producto(self.categoria, stock=1000)
+        estados = self.añadir_en_paralelo(producto)
+        self.assertEqual(estados, [201] * self.HILOS * self.POR_HILO)
+        self.assertEqual(CarritoItem.objects.get(usuario=self.usuario).cantidad, self.HILOS * self.POR_HILO)
+
+    def test_no_supera_el_stock(self):
+        producto = crear_producto(self.categoria, stock=15)
+        estados = self.añadir_en_paralelo(producto, session_key='invitado')
+        self.assertEqual(estados.count(201), 15)
+        self.assertEqual(estados.count(400), self.HILOS * self.POR_HILO - 15)
+        self.assertEqual(CarritoItem.objects.get(session_key='invitado').cantidad, 15)
+
+
+class AgregarTests(APITestCase):
+    def test_compara_con_el_stock_actual(self):
+        usuario = User.objects.create_user('lector')
+        producto = crear_producto(Categoria.objects.create(nombre='Ficción'), stock=5)
+        almacen, propietario = ORMAlmacen(), Propietario(usuario.id, None)
+        # Otra venta deja el stock en 2 después de cargar ``producto``
+        Producto.objects.filter(pk=producto.pk).update(stock=2)
+        self.assertIsNone(almacen.agregar(propietario, producto, 3))
+        self.assertFalse(CarritoItem.objects.exists())
+
+        self.assertEqual(almacen.agregar(propietario, producto, 2).cantidad, 2)
+        self.assertIsNone(almacen.agregar(propietario, producto, 1))
+        self.assertEqual(CarritoItem.objects.get().cantidad, 2)
+
+
+class CheckoutTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(categoria, nombre='Dune', precio=Decimal('12.50'), stock=5)
+        cls.ubik = crear_producto(categoria, nombre='Ubik', precio=Decimal('7.25'), stock=2)
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+
+    def test_compra_todo_el_carrito(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=2)
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.ubik, cantidad=2)
+        response = self.client.post('/api/carrito/checkout/')
+        self.assertEqual(response.status_code, 201)
+        compra = Compra.objects.get(pk=response.data['compra']['id'])
+        self.assertEqual(compra.total, Decimal('39.50'))
+        self.assertEqual(
+            sorted(compra.items.values_list('producto__nombre', 'cantidad', 'subtotal')),
+            [('Dune', 2, Decimal('25.00')), ('Ubik', 2, Decimal('14.50'))],
+        )
+        self.assertEqual(dict(Producto.objects.values_list('nombre', 'stock')), {'Dune': 3, 'Ubik': 0})
+        self.assertFalse(CarritoItem.objects.filter(usuario=self.usuario).exists())
+
+    def test_sin_stock_no_compra_nada(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.ubik, cantidad=3)
+        response = self.client.post('/api/carrito/checkout/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Ubik', response.data['error'])
+        self.assertFalse(Compra.objects.exists())
+        self.assertEqual(CarritoItem.objects.filter(usuario=self.usuario).count(), 2)
+
+    def test_el_update_no_vende_lo_que_no_hay(self):
+        with self.assertRaises(StockAgotado):
+            with transaction.atomic():
+                vender({self.dune.id: (1, Decimal('12.50')), self.ubik.id: (3, Decimal('21.75'))})
+        self.assertEqual(dict(Producto.objects.values_list('nombre', 'stock')), {'Dune': 5, 'Ubik': 2})
+
+
+class CheckoutConcurrenteTests(TransactionTestCase):
+    """Compradores a la vez por las últimas unidades: ni se vende de más ni quedan compras a medias"""
+    COMPRADORES = 8
+
+    def test_no_se_vende_de_mas(self):
+        categoria = Categoria.objects.create(nombre='Ficción')
+        escaso = crear_producto(categoria, nombre='Escaso', stock=3)
+        abundante = crear_producto(categoria, nombre='Abundante', stock=100)
+        usuarios = [User.objects.create_user(f'lector{i}') for i in range(self.COMPRADORES)]
+        for usuario in usuarios:
+            CarritoItem.objects.create(usuario=usuario, producto=abundante, cantidad=1)
+            CarritoItem.objects.create(usuario=usuario, producto=escaso, cantidad=1)
+
+        barrera = threading.Barrier(self.COMPRADORES)
+        estados, errores = [], []
+
+        def comprar(usuario):
+            try:
+                client = APIClient()
+                client.force_authenticate(usuario)
+                barrera.wait()
+                estados.append(client.post('/api/carrito/checkout/').status_code)
+            except Exception as error:  # noqa: BLE001 - se comprueba en el hilo principal
+                errores.append(error)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=comprar, args=(usuario,)) for usuario in usuarios]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        self.assertEqual(sorted(estados), [201] * 3 + [400] * (self.COMPRADORES - 3))
+        self.assertEqual(dict(Producto.objects.values_list('nombre', 'stock')), {'Escaso': 0, 'Abundante': 97})
+        self.assertEqual(Compra.objects.count(), 3)
+        self.assertEqual(CompraItem.objects.count(), 6)
+        self.assertEqual(CarritoItem.objects.count(), 2 * (self.COMPRADORES - 3))
+
+
+class FusionCarritoTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector', password='clave-segura-123')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(categoria, nombre='Dune', stock=5)
+        cls.ubik = crear_producto(categoria, nombre='Ubik', stock=2)
+        cls.solaris = crear_producto(categoria, nombre='Solaris', stock=0)
+
+    def cantidades(self, **propietario):
+        return dict(CarritoItem.objects.filter(**propietario).values_list('producto__nombre', 'cantidad'))
+
+    def test_login_fusiona_el_carrito_de_invitado(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=4)
+        CarritoItem.objects.create(session_key='invitado', producto=self.dune, cantidad=3)
+        CarritoItem.objects.create(session_key='invitado', producto=self.ubik, cantidad=5)
+        CarritoItem.objects.create(session_key='invitado', producto=self.solaris, cantidad=1)
+        CarritoItem.objects.create(session_key='otro', producto=self.ubik, cantidad=1)
+
+        response = self.client.post('/api/auth/login/', {
+            'username': 'lector', 'password': 'clave-segura-123', 'session_key': 'invitado',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['carrito_fusionado'], 3)
+        # Cantidades sumadas sin superar el stock; lo agotado no pasa
+        self.assertEqual(self.cantidades(usuario=self.usuario), {'Dune': 5, 'Ubik': 2})
+        self.assertEqual(self.cantidades(session_key='invitado'), {})
+        self.assertEqual(self.cantidades(session_key='otro'), {'Ubik': 1})
+
+    def test_login_sin_carrito(self):
+        response = self.client.post('/api/auth/login/', {'username': 'lector', 'password': 'clave-segura-123'})
+        self.assertEqual(response.data['carrito_fusionado'], 0)
+        response = self.client.post('/api/auth/login/', {
+            'username': 'lector', 'password': 'incorrecta', 'session_key': 'invitado',
+        })
+        self.assertEqual(response.status_code, 401)
+
+    def test_registro_fusiona_el_carrito_de_invitado(self):
+        CarritoItem.objects.create(session_key='invitado', producto=self.ubik, cantidad=1)
+        response = self.client.post('/api/auth/registro/', {
+            'username': 'nueva', 'email': 'nueva@example.com', 'session_key': 'invitado',
+            'password': 'clave-segura-123', 'password2': 'clave-segura-123',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.cantidades(usuario__username='nueva'), {'Ubik': 1})
+        self.assertEqual(self.cantidades(session_key='invitado'), {})
@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda import cola, trabajos
+from tienda.models import Categoria, CarritoItem, Trabajo
+
+from .utils import crear_producto
+
+hechos = []
+
+
+def anotar(valor):
+    hechos.append(valor)
+
+
+def fallar(**argumentos):
+    raise RuntimeError('sin servidor de correo')
+
+
+def tarea(funcion):
+    return f'{__name__}.{funcion.__name__}'
+
+
+class EncolarTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector', email='lector@example.com')
+        cls.dune = crear_producto(Categoria.objects.create(nombre='Ficción'), nombre='Dune', precio=Decimal('12.50'))
+
+    def test_checkout_encola_la_confirmacion(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=2)
+        self.client.force_authenticate(self.usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/carrito/checkout/')
+        self.assertEqual(response.status_code, 201)
+        trabajo = Trabajo.objects.get()
+        self.assertEqual((trabajo.tarea, trabajo.argumentos), ('tienda.trabajos.confirmar_compra', {'compra_id': response.data['compra']['id']}))
+
+        self.assertEqual(cola.procesar(), cola.ResultadoRonda(hechos=1))
+        self.assertFalse(Trabajo.objects.exists())
+        self.assertEqual(mail.outbox[0].to, ['lector@example.com'])
+        self.assertIn('Dune x2: $25.00', mail.outbox[0].body)
+
+    def test_checkout_fallido_no_encola_nada(self):
+        self.client.force_authenticate(self.usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/carrito/checkout/').status_code, 400)
+        self.assertFalse(Trabajo.objects.exists())
+
+    def test_registro_encola_la_bienvenida(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/registro/', {
+                'username': 'nueva', 'email': 'nueva@example.com',
+                'password': 'clave-segura-123', 'password2': 'clave-segura-123',
+            })
+        self.assertEqual(response.status_code, 201)
+        out = StringIO()
+        call_command('procesar_trabajos', '--una-vez', '--hilos', '1', stdout=out)
+        self.assertIn('[OK] 1 trabajos hechos, 0 con error', out.getvalue())
+        self.assertEqual(mail.outbox[0].to, ['nueva@example.com'])
+
+    def test_sin_email_no_se_envia_nada(self):
+        trabajos.dar_bienvenida(User.objects.create_user('sin-correo').pk)
+        self.assertEqual(mail.outbox, [])
+
+
+@override_settings(TIENDA_COLA={'ESPERA_BASE': 10, 'ESPERA_MAXIMA': 30})
+class ColaTests(TestCase):
+    def setUp(self):
+        hechos.clear()
+
+    def test_reintentos_con_espera_creciente(self):
+        trabajo = Trabajo.objects.create(tarea=tarea(fallar), max_intentos=3)
+        self.assertEqual([cola.espera(n) for n in (1, 2, 3, 4)], [10, 20, 30, 30])
+
+        with self.assertLogs('tienda.cola', 'WARNING') as logs:
+            self.assertEqual(cola.procesar(), cola.ResultadoRonda(fallidos=1))
+        self.assertIn('falló, se reintentará', logs.output[0])
+        self.assertIn('RuntimeError: sin servidor de correo', logs.output[0])
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.intentos), ('pendiente', 1))
+        self.assertIn('sin servidor de correo', trabajo.ultimo_error)
+        self.assertGreater(trabajo.visible_desde, timezone.now() + timedelta(seconds=9))
+        # Aún no toca
+        self.assertEqual(cola.procesar().tomados, 0)
+
+        with self.assertLogs('tienda.cola', 'WARNING') as logs:
+            for _ in range(2):
+                Trabajo.objects.update(visible_desde=timezone.now())
+                cola.procesar()
+        self.assertEqual([registro.levelname for registro in logs.records], ['WARNING', 'ERROR'])
+        self.assertIn('fallido tras 3 intentos', logs.output[1])
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.intentos), ('fallido', 3))
+        Trabajo.objects.update(visible_desde=timezone.now())
+        self.assertEqual(cola.procesar().tomados, 0)
+
+    def test_plazo_vencido_sin_intentos(self):
+        Trabajo.objects.create(tarea=tarea(anotar), argumentos={'valor': 1}, max_intentos=2)
+        cola.tomar('muerto', lote=10, visibilidad=60)
+        despues = timezone.now() + timedelta(seconds=61)
+        cola.tomar('muerto', lote=10, visibilidad=60, ahora=despues)
+        # El segundo worker también murió: no se toma una tercera vez
+        with self.assertLogs('tienda.cola', 'ERROR'):
+            self.assertEqual(cola.tomar('otro', lote=10, visibilidad=60, ahora=despues + timedelta(seconds=61)), [])
+        trabajo = Trabajo.objects.get()
+        self.assertEqual((trabajo.estado, trabajo.intentos), ('fallido', 2))
+        self.assertIn('no terminó', trabajo.ultimo_error)
+        self.assertEqual(hechos, [])
+
+    def test_lotes(self):
+        Trabajo.objects.bulk_create([
+            Trabajo(tarea=tarea(anotar), argumentos={'valor': n}) for n in range(5)
+        ])
+        self.assertEqual(cola.procesar(lote=2).hechos, 2)
+        self.assertEqual(cola.procesar(lote=10).hechos, 3)
+        self.assertEqual(sorted(hechos), [0, 1, 2, 3, 4])
+
+    def test_se_retoma_si_vence_la_visibilidad(self):
+        Trabajo.objects.create(tarea=tarea(anotar), argumentos={'valor': 1})
+        tomado, = cola.tomar('muerto', lote=10, visibilidad=60)
+        self.assertEqual(cola.tomar('otro', lote=10, visibilidad=60), [])
+
+        retomado, = cola.tomar('otro', lote=10, visibilidad=60, ahora=timezone.now() + timedelta(seconds=61))
+        self.assertEqual((retomado.trabajador, retomado.intentos), ('otro', 2))
+        # El worker que se pasó de plazo ya no toca la fila
+        cola.ejecutar(tomado)
+        self.assertTrue(Trabajo.objects.exists())
+        cola.ejecutar(retomado)
+        self.assertFalse(Trabajo.objects.exists())
+        self.assertEqual(hechos, [1, 1])
+
+
+class PoolDeHilosTests(TransactionTestCase):
+    def test_procesar_con_hilos(self):
+        hechos.clear()
+        Trabajo.objects.bulk_create([
+            Trabajo(tarea=tarea(anotar), argumentos={'valor': n}) for n in range(8)
+        ] + [Trabajo(tarea=tarea(fallar))])
+        with ThreadPoolExecutor(4) as pool, self.assertLogs('tienda.cola', 'WARNING') as logs:
+            resultado = cola.procesar(lote=20, pool=pool)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(resultado, cola.ResultadoRonda(hechos=8, fallidos=1))
+        self.assertEqual(sorted(hechos), list(range(8)))
+        self.assertEqual(list(Trabajo.objects.values_list('estado', flat=True)), ['pendiente'])
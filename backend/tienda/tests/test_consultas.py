@@ -0,0 +1,253 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import get_resolver
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda.autocompletar import get_indice, reiniciar_indice
+from tienda import analitica, recomendaciones, ventas
+from tienda.models import Categoria, CarritoItem, Compra, CompraItem
+
+from .utils import crear_producto, presupuesto_consultas, sin_cache_respuestas
+
+# Máximo de consultas SQL por endpoint (nombre de la URL y método). Un
+# endpoint nuevo debe declarar aquí su presupuesto;
+# test_todos_los_endpoints_tienen_presupuesto falla si falta alguno.
+PRESUPUESTOS = {
+    ('api-root', 'GET'): 0,
+    ('categoria-list', 'GET'): 1,
+    ('categoria-detail', 'GET'): 1,
+    ('categoria-mas-vendidos', 'GET'): 1,
+    ('producto-list', 'GET'): 2,
+    ('producto-detail', 'GET'): 1,
+    ('producto-facetas', 'GET'): 1,
+    ('producto-autocompletar', 'GET'): 0,
+    ('producto-relacionados', 'GET'): 1,
+    ('carrito-list', 'GET'): 2,
+    ('carrito-list', 'POST'): 6,  # una línea nueva comprueba el stock actual antes de crearse
+    ('carrito-detail', 'PATCH'): 2,
+    ('carrito-detail', 'DELETE'): 2,
+    ('carrito-total', 'GET'): 1,
+    ('carrito-resumen', 'GET'): 1,
+    ('carrito-lote', 'POST'): 8,
+    ('carrito-checkout', 'POST'): 9,
+    ('compra-list', 'GET'): 3,
+    ('compra-resumen', 'GET'): 1,
+    ('exportar-compras', 'GET'): 1,
+    ('analitica-ventas', 'GET'): 2,
+    ('compra-detail', 'GET'): 2,
+    ('registro', 'POST'): 8,
+    ('login', 'POST'): 6,
+    ('perfil', 'GET'): 0,
+    ('perfil', 'PATCH'): 1,
+    ('cambiar-password', 'POST'): 1,
+}
+
+
+@sin_cache_respuestas
+class PresupuestoConsultasTests(APITestCase):
+    """Cada endpoint ejecuta un número fijo de consultas sin importar el volumen de datos"""
+    # Cada endpoint se mide con al menos TAMANO_INICIAL elementos de cada tipo
+    # y otra vez tras añadir CRECIMIENTO más
+    TAMANO_INICIAL = 2
+    CRECIMIENTO = 13
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector', 'lector@example.com', 'clave-segura-123')
+
+    def setUp(self):
+        self.productos = []
+        self.tamano = 0
+
+    def poblar(self, tamano):
+        """Crear datos hasta llegar a ``tamano`` categorías, productos, líneas de carrito y compras"""
+        for i in range(self.tamano, tamano):
+            categoria = Categoria.objects.create(nombre=f'Categoría {i}')
+            nuevos = [crear_producto(categoria, nombre=f'Libro {i}-{j}', stock=100) for j in range(2)]
+            self.productos.extend(nuevos)
+            CarritoItem.objects.create(usuario=self.usuario, producto=nuevos[0], cantidad=1)
+            CarritoItem.objects.create(session_key='invitado', producto=nuevos[1], cantidad=1)
+            otro = User.objects.create_user(f'otro{i}')
+            for comprador in (self.usuario, otro):
+                compra = Compra.objects.create(usuario=comprador, total=Decimal('20.00'))
+                for producto in nuevos:
+                    CompraItem.objects.create(
+                        compra=compra, producto=producto, cantidad=1, precio_unitario=producto.precio
+                    )
+        self.tamano = tamano
+
+    def tamanos(self):
+        inicial = max(self.tamano, self.TAMANO_INICIAL)
+        return inicial, inicial + self.CRECIMIENTO
+
+    def medir(self, endpoint, peticion, autenticado=True, estado=200, preparar=None):
+        """
+        Ejecutar ``peticion()`` con dos volúmenes de datos y comprobar que no
+        supera el presupuesto de ``endpoint`` y que el número de consultas no crece.
+        Si se indica ``preparar``, su resultado se pasa a ``peticion`` y sus
+        consultas no cuentan.
+        """
+        self.client.force_authenticate(self.usuario if autenticado else None)
+        conteos = []
+        for tamano in self.tamanos():
+            self.poblar(tamano)
+            cache.clear()
+            argumentos = [preparar()] if preparar else []
+            with presupuesto_consultas(PRESUPUESTOS[endpoint]) as presupuesto:
+                response = peticion(*argumentos)
+            self.assertEqual(response.status_code, estado, getattr(response, 'data', None))
+            conteos.append(len(presupuesto))
+        self.assertEqual(len(set(conteos)), 1, f'{endpoint}: las consultas crecen con los datos {conteos}')
+
+    def test_todos_los_endpoints_tienen_presupuesto(self):
+        nombres = {nombre for nombre in get_resolver('tienda.urls').reverse_dict if isinstance(nombre, str)}
+        self.assertEqual(nombres - {nombre for nombre, _ in PRESUPUESTOS}, set())
+
+    def test_api_root(self):
+        self.medir(('api-root', 'GET'), lambda: self.client.get('/api/'), autenticado=False)
+
+    def test_categorias(self):
+        self.medir(('categoria-list', 'GET'), lambda: self.client.get('/api/categorias/'), autenticado=False)
+        categoria = Categoria.objects.first()
+        self.medir(('categoria-detail', 'GET'), lambda: self.client.get(f'/api/categorias/{categoria.id}/'),
+                   autenticado=False)
+        self.medir(('categoria-mas-vendidos', 'GET'), lambda _: self.client.get(
+            f'/api/categorias/{categoria.id}/mas-vendidos/', {'periodo': '7d'}
+        ), autenticado=False, preparar=ventas.recalcular)
+
+    def test_productos(self):
+        self.medir(('producto-list', 'GET'), lambda: self.client.get('/api/productos/'), autenticado=False)
+        self.medir(('producto-list', 'GET'), lambda: self.client.get('/api/productos/', {'search': 'libro'}),
+                   autenticado=False)
+        self.medir(('producto-list', 'GET'), lambda: self.client.get('/api/productos/', {'paginacion': 'cursor'}),
+                   autenticado=False)
+        self.medir(('producto-facetas', 'GET'), lambda: self.client.get(
+            '/api/productos/facetas/', {'search': 'libro', 'precio_min': '5', 'categoria': '1'}
+        ), autenticado=False)
+        # El índice se construye fuera de la medición; después no se consulta la base de datos
+        self.medir(('producto-autocompletar', 'GET'), lambda _: self.client.get(
+            '/api/productos/autocompletar/', {'q': 'lib'}
+        ), autenticado=False, preparar=lambda: reiniciar_indice() or get_indice())
+        def relacionados_calculados():
+            recomendaciones.actualizar(ahora=timezone.now() + timedelta(minutes=5))
+            return self.productos[0]
+        self.medir(('producto-relacionados', 'GET'), lambda producto: self.client.get(
+            f'/api/productos/{producto.id}/relacionados/'
+        ), autenticado=False, preparar=relacionados_calculados)
+        self.medir(('producto-detail', 'GET'), lambda: self.client.get(f'/api/productos/{self.productos[-1].id}/'),
+                   autenticado=False)
+
+    def test_carrito_lectura(self):
+        self.medir(('carrito-list', 'GET'), lambda: self.client.get('/api/carrito/'))
+        self.medir(('carrito-list', 'GET'), lambda: self.client.get('/api/carrito/', {'session_key': 'invitado'}),
+                   autenticado=False)
+        self.medir(('carrito-total', 'GET'), lambda: self.client.get('/api/carrito/total/'))
+        self.medir(('carrito-resumen', 'GET'), lambda: self.client.get('/api/carrito/resumen/'))
+        self.medir(('carrito-resumen', 'GET'), lambda: self.client.get(
+            '/api/carrito/resumen/', {'session_key': 'invitado'}
+        ), autenticado=False)
+
+    def test_carrito_escritura(self):
+        self.medir(('carrito-list', 'POST'), lambda: self.client.post(
+            '/api/carrito/', {'producto': self.productos[-1].id, 'cantidad': 1}
+        ), estado=201)
+
+        # Siempre las mismas operaciones: agregar un producto nuevo, cambiar y quitar líneas existentes
+        def operaciones():
+            CarritoItem.objects.filter(usuario=self.usuario, producto=self.productos[-2]).delete()
+            return [
+                {'accion': 'agregar', 'producto': self.productos[-2].id, 'cantidad': 1},
+                {'accion': 'fijar', 'producto': self.productos[0].id, 'cantidad': CarritoItem.objects.get(
+                    usuario=self.usuario, producto=self.productos[0]
+                ).cantidad + 1},
+                {'accion': 'quitar', 'producto': CarritoItem.objects.filter(usuario=self.usuario).exclude(
+                    producto__in=[self.productos[0], self.productos[-2]]
+                ).first().producto_id},
+            ]
+        self.medir(('carrito-lote', 'POST'), lambda ops: self.client.post(
+            '/api/carrito/lote/', {'operaciones': ops}, format='json'
+        ), preparar=operaciones)
+
+        def primer_item():
+            return CarritoItem.objects.filter(usuario=self.usuario).first()
+        self.medir(('carrito-detail', 'PATCH'), lambda item: self.client.patch(
+            f'/api/carrito/{item.id}/', {'cantidad': 2}
+        ), preparar=primer_item)
+        self.medir(('carrito-detail', 'DELETE'), lambda item: self.client.delete(
+            f'/api/carrito/{item.id}/'
+        ), estado=204, preparar=primer_item)
+
+    def test_checkout(self):
+        # El carrito lleva todo el catálogo: crece con él (4 líneas y después 30)
+        def carrito_con_todo():
+            CarritoItem.objects.filter(usuario=self.usuario).delete()
+            CarritoItem.objects.bulk_create(
+                CarritoItem(usuario=self.usuario, producto=producto, cantidad=1) for producto in self.productos
+            )
+
+        self.medir(('carrito-checkout', 'POST'), lambda _: self.client.post('/api/carrito/checkout/'),
+                   estado=201, preparar=carrito_con_todo)
+
+    def test_compras(self):
+        self.medir(('compra-list', 'GET'), lambda: self.client.get('/api/compras/'))
+        self.medir(('compra-resumen', 'GET'), lambda: self.client.get('/api/compras/resumen/'))
+
+    def test_exportacion(self):
+        def exportar():
+            response = self.client.get('/api/exportar/', {'tipo': 'lineas'})
+            b''.join(response.streaming_content)
+            return response
+
+        self.usuario.is_staff = True
+        self.medir(('exportar-compras', 'GET'), exportar)
+
+    def test_analitica(self):
+        self.usuario.is_staff = True
+        self.medir(('analitica-ventas', 'GET'), lambda _: self.client.get(
+            '/api/analitica/ventas/', {'agrupar': 'mes,categoria,metodo_pago'}
+        ), preparar=lambda: analitica.actualizar(ahora=timezone.now() + timedelta(minutes=5)))
+        self.medir(('compra-detail', 'GET'), lambda compra: self.client.get(f'/api/compras/{compra.id}/'),
+                   preparar=lambda: Compra.objects.filter(usuario=self.usuario).first())
+
+    def test_autenticacion(self):
+        def registro():
+            n = User.objects.count()
+            return self.client.post('/api/auth/registro/', {
+                'username': f'nuevo{n}', 'email': f'nuevo{n}@example.com',
+                'password': 'clave-segura-123', 'password2': 'clave-segura-123',
+            })
+        self.medir(('registro', 'POST'), registro, autenticado=False, estado=201)
+        self.medir(('login', 'POST'), lambda: self.client.post(
+            '/api/auth/login/', {'username': 'lector', 'password': 'clave-segura-123'}
+        ), autenticado=False)
+        self.medir(('login', 'POST'), lambda: self.client.post(
+            '/api/auth/login/', {'username': 'lector@example.com', 'password': 'clave-segura-123'}
+        ), autenticado=False)
+
+        # Con carrito de invitado: una línea que se suma a la del usuario y otra nueva
+        def carrito_invitado():
+            CarritoItem.objects.filter(session_key='fusion').delete()
+            for producto in (self.productos[0], self.productos[-1]):
+                CarritoItem.objects.create(session_key='fusion', producto=producto, cantidad=1)
+        self.medir(('login', 'POST'), lambda _: self.client.post(
+            '/api/auth/login/', {'username': 'lector', 'password': 'clave-segura-123', 'session_key': 'fusion'}
+        ), autenticado=False, preparar=carrito_invitado)
+
+        def registro_con_carrito(_):
+            n = User.objects.count()
+            return self.client.post('/api/auth/registro/', {
+                'username': f'nuevo{n}', 'email': f'nuevo{n}@example.com',
+                'password': 'clave-segura-123', 'password2': 'clave-segura-123', 'session_key': 'fusion',
+            })
+        self.medir(('registro', 'POST'), registro_con_carrito, autenticado=False, estado=201,
+                   preparar=carrito_invitado)
+        self.medir(('perfil', 'GET'), lambda: self.client.get('/api/auth/perfil/'))
+        self.medir(('perfil', 'PATCH'), lambda: self.client.patch('/api/auth/perfil/', {'first_name': 'Ana'}))
+        self.medir(('cambiar-password', 'POST'), lambda: self.client.post('/api/auth/cambiar-password/', {
+            'old_password': 'clave-segura-123',
+            'new_password': 'clave-segura-123', 'new_password2': 'clave-segura-123',
+        }))
@@ -0,0 +1,95 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda.exportacion import Exportacion
+from tienda.models import Categoria, Compra, CompraItem
+
+from .utils import crear_producto
+
+
+class ExportacionTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('finanzas', is_staff=True)
+        cls.cliente = User.objects.create_user('lector')
+        cls.dune = crear_producto(Categoria.objects.create(nombre='Ficción'), nombre='Dune, edición "especial"')
+        inicio = datetime(2024, 1, 1, 12, tzinfo=timezone.get_current_timezone())
+        for dia in range(5):
+            compra = Compra.objects.create(
+                usuario=cls.cliente, total=Decimal('12.50') * (dia + 1),
+                estado='cancelada' if dia == 2 else 'completada',
+            )
+            Compra.objects.filter(pk=compra.pk).update(fecha_compra=inicio + timedelta(days=dia))
+            CompraItem.objects.create(compra=compra, producto=cls.dune, cantidad=dia + 1,
+                                      precio_unitario=Decimal('12.50'), subtotal=Decimal('12.50') * (dia + 1))
+
+    def exportar(self, **params):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/exportar/', params)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_de_compras(self):
+        response, contenido = self.exportar()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertRegex(response['Content-Disposition'], r'attachment; filename="compras-\d{8}\.csv"')
+        filas = list(csv.DictReader(io.StringIO(contenido)))
+        self.assertEqual([fila['total'] for fila in filas], ['12.50', '25.00', '37.50', '50.00', '62.50'])
+        self.assertEqual(filas[0]['usuario'], 'lector')
+        self.assertEqual(filas[0]['fecha_compra'], '2024-01-01T12:00:00+00:00')
+
+    def test_ndjson_de_lineas_con_filtros(self):
+        response, contenido = self.exportar(tipo='lineas', formato='ndjson', desde='2024-01-02', hasta='2024-01-04',
+                                            estado='completada')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lineas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual([linea['cantidad'] for linea in lineas], [2, 4])
+        self.assertEqual(lineas[0]['producto'], 'Dune, edición "especial"')
+        self.assertEqual(lineas[0]['subtotal'], '25.00')
+
+    def test_una_sola_consulta_por_lotes(self):
+        exportacion = Exportacion(tipo='lineas', lote=2)
+        with CaptureQueriesContext(connection) as consultas:
+            trozos = list(exportacion)
+        self.assertEqual(len(consultas), 1)
+        self.assertNotIn('OFFSET', consultas[0]['sql'])
+        # Cabecera y un trozo por cada 2 filas
+        self.assertEqual((len(trozos), exportacion.filas), (4, 5))
+
+    def test_solo_staff(self):
+        self.client.force_authenticate(self.cliente)
+        self.assertEqual(self.client.get('/api/exportar/').status_code, 403)
+
+    def test_parametros_no_validos(self):
+        self.client.force_authenticate(self.staff)
+        for params in [{'tipo': 'productos'}, {'formato': 'xlsx'}, {'desde': 'ayer'}, {'estado': 'enviada'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/exportar/', params).status_code, 400)
+
+    def test_comando(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'lineas.csv')
+            out = StringIO()
+            call_command('exportar_compras', '--tipo', 'lineas', '--estado', 'cancelada', '--salida', ruta, stdout=out)
+            self.assertIn('[OK] 1 filas exportadas (lineas)', out.getvalue())
+            with open(ruta, encoding='utf-8', newline='') as fichero:
+                filas = list(csv.DictReader(fichero))
+        self.assertEqual([fila['cantidad'] for fila in filas], ['3'])
+
+        out, err = StringIO(), StringIO()
+        call_command('exportar_compras', '--formato', 'ndjson', '--hasta', '2024-01-01', stdout=out, stderr=err)
+        self.assertEqual(json.loads(out.getvalue())['total'], '12.50')
+        self.assertIn('[OK] 1 filas', err.getvalue())
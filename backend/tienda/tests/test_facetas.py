@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+
+from tienda import cache_respuestas
+from tienda.models import Categoria, Producto
+
+from .utils import crear_producto, presupuesto_consultas
+
+
+class FacetasTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ficcion = Categoria.objects.create(nombre='Ficción')
+        cls.mangas = Categoria.objects.create(nombre='Mangas')
+        crear_producto(cls.ficcion, nombre='Dune', precio=Decimal('21.99'), stock=9)
+        crear_producto(cls.ficcion, nombre='1984', precio=Decimal('15.99'), stock=0)
+        crear_producto(cls.ficcion, nombre='Cien Años de Soledad', precio=Decimal('18.99'), stock=12)
+        crear_producto(cls.mangas, nombre='Naruto Vol. 1', precio=Decimal('9.99'), stock=18)
+        crear_producto(cls.mangas, nombre='One Piece Vol. 1', precio=Decimal('9.99'), stock=20)
+
+    def setUp(self):
+        cache.clear()
+        cache_respuestas.get_backend().clear()
+
+    def facetas(self, **params):
+        with presupuesto_consultas(1):
+            response = self.client.get('/api/productos/facetas/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def conteos(self, data):
+        return (
+            {f['nombre']: (f['count'], f['disponibles']) for f in data['categorias']},
+            [(f['count'], f['disponibles']) for f in data['precios']],
+        )
+
+    def test_sin_filtros(self):
+        data = self.facetas()
+        self.assertEqual(data['total'], 5)
+        categorias, precios = self.conteos(data)
+        self.assertEqual(categorias, {'Ficción': (3, 2), 'Mangas': (2, 2)})
+        self.assertEqual(precios, [(2, 2), (0, 0), (2, 1), (1, 1), (0, 0)])
+
+    def test_cada_faceta_ignora_su_propio_filtro(self):
+        data = self.facetas(categoria=str(self.ficcion.id), precio_min='15', precio_max='20')
+        categorias, precios = self.conteos(data)
+        # Categorías: filtradas por precio, no por categoría
+        self.assertEqual(categorias, {'Ficción': (2, 1)})
+        # Precios: filtrados por categoría, no por precio
+        self.assertEqual(precios, [(0, 0), (0, 0), (2, 1), (1, 1), (0, 0)])
+        self.assertEqual(data['total'], 2)
+        listado = self.client.get('/api/productos/', {
+            'categoria': self.ficcion.id, 'precio_min': '15', 'precio_max': '20',
+        })
+        self.assertEqual(listado.data['count'], data['total'])
+
+    def test_con_busqueda(self):
+        categorias, precios = self.conteos(self.facetas(search='vol'))
+        self.assertEqual(categorias, {'Mangas': (2, 2)})
+        self.assertEqual(precios[0], (2, 2))
+
+    def test_cambios_de_stock_invalidan_la_cache(self):
+        self.client.get('/api/productos/facetas/')
+        producto = Producto.objects.get(nombre='Dune')
+        producto.stock = 0
+        producto.save()
+        categorias, _ = self.conteos(self.facetas())
+        self.assertEqual(categorias['Ficción'], (3, 1))
+
+    def test_parametros_no_validos(self):
+        for url in ('/api/productos/', '/api/productos/facetas/'):
+            for campo, valor in (('categoria', 'abc'), ('precio_min', 'abc'), ('precio_max', '1,5'), ('precio_min', 'NaN')):
+                with self.subTest(url=url, campo=campo, valor=valor):
+                    response = self.client.get(url, {campo: valor})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(campo, response.data)
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda.models import Categoria, Compra, CompraItem
+
+from .utils import crear_producto
+
+
+class HistorialComprasTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        cls.otro = User.objects.create_user('otra')
+        cls.dune = crear_producto(Categoria.objects.create(nombre='Ficción'), nombre='Dune', precio=Decimal('10.00'))
+        inicio = datetime(2024, 1, 1, 12, tzinfo=timezone.get_current_timezone())
+        # Una compra al día durante 10 días; la del día 3, cancelada
+        for dia in range(10):
+            compra = Compra.objects.create(
+                usuario=cls.usuario, total=Decimal('10.00') * (dia + 1),
+                estado='cancelada' if dia == 3 else 'completada',
+            )
+            Compra.objects.filter(pk=compra.pk).update(fecha_compra=inicio + timedelta(days=dia))
+            CompraItem.objects.bulk_create([
+                CompraItem(compra=compra, producto=cls.dune, cantidad=cantidad, precio_unitario=Decimal('10.00'),
+                           subtotal=Decimal('10.00') * cantidad)
+                for cantidad in (dia + 1, 2)
+            ])
+        Compra.objects.create(usuario=cls.otro, total=Decimal('5.00'))
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+
+    def fechas(self, data):
+        return [compra['fecha_compra'][:10] for compra in data['results']]
+
+    def test_paginas_por_cursor(self):
+        response = self.client.get('/api/compras/', {'page_size': 4})
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(self.fechas(response.data), ['2024-01-10', '2024-01-09', '2024-01-08', '2024-01-07'])
+        vistas = self.fechas(response.data)
+        siguiente = response.data['next']
+        while siguiente:
+            response = self.client.get(siguiente)
+            vistas += self.fechas(response.data)
+            siguiente = response.data['next']
+        self.assertEqual(len(vistas), 10)
+        self.assertEqual(vistas[-1], '2024-01-01')
+
+    def test_total_items_y_lineas_compactas(self):
+        compra = self.client.get('/api/compras/', {'page_size': 1}).data['results'][0]
+        self.assertEqual(compra['total_items'], 12)
+        self.assertEqual(set(compra['items'][0]), {
+            'id', 'producto', 'producto_nombre', 'producto_imagen', 'cantidad', 'precio_unitario', 'subtotal',
+        })
+        detalle = self.client.get(f'/api/compras/{compra["id"]}/').data
+        self.assertEqual(detalle['total_items'], 12)
+        self.assertEqual(detalle['items'][0]['producto']['nombre'], 'Dune')
+
+    def test_sin_lineas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get('/api/compras/', {'page_size': 5, 'omit': 'items'})
+        self.assertNotIn('items', response.data['results'][0])
+        self.assertEqual(response.data['results'][0]['total_items'], 12)
+        self.assertFalse([consulta for consulta in consultas if 'tienda_compraitem"."' in consulta['sql']])
+
+    def test_filtros(self):
+        response = self.client.get('/api/compras/', {'desde': '2024-01-03', 'hasta': '2024-01-05'})
+        self.assertEqual(self.fechas(response.data), ['2024-01-05', '2024-01-04', '2024-01-03'])
+        response = self.client.get('/api/compras/', {'hasta': '2024-01-02T12:00:00'})
+        self.assertEqual(self.fechas(response.data), ['2024-01-01'])
+        response = self.client.get('/api/compras/', {'estado': 'cancelada'})
+        self.assertEqual(self.fechas(response.data), ['2024-01-04'])
+        response = self.client.get('/api/compras/', {'estado': 'pendiente,cancelada', 'desde': '2024-01-05'})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_filtros_no_validos(self):
+        for params in [{'desde': 'ayer'}, {'hasta': '2024-02-30'}, {'estado': 'enviada'}]:
+            with self.subTest(params=params):
+                response = self.client.get('/api/compras/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(next(iter(params)), response.data)
+
+    def test_resumen(self):
+        self.assertEqual(self.client.get('/api/compras/resumen/').data, {
+            'compras': 10, 'total_gastado': Decimal('550.00'),
+        })
+        self.client.force_authenticate(User.objects.create_user('nueva'))
+        self.assertEqual(self.client.get('/api/compras/resumen/').data, {'compras': 0, 'total_gastado': 0})
+
+    def test_la_pagina_sale_del_indice(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get('/api/compras/', {'page_size': 3, 'desde': '2024-01-02'})
+        pagina = next(consulta['sql'] for consulta in consultas if 'LIMIT' in consulta['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + pagina)
+            plan = [fila[-1] for fila in cursor.fetchall()]
+        self.assertTrue(any('compra_usuario_fecha_idx' in paso for paso in plan), plan)
+        self.assertFalse([paso for paso in plan if 'TEMP B-TREE' in paso], plan)
@@ -0,0 +1,128 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda.idempotencia import purgar_claves
+from tienda.models import Categoria, CarritoItem, ClaveIdempotencia, Compra
+
+from .utils import crear_producto, presupuesto_consultas
+
+
+class IdempotenciaTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(categoria, nombre='Dune', precio=Decimal('12.50'), stock=5)
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+
+    def checkout(self, clave, **datos):
+        return self.client.post('/api/carrito/checkout/', datos, HTTP_IDEMPOTENCY_KEY=clave)
+
+    def test_reintento_de_checkout_devuelve_la_misma_compra(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=2)
+        primera = self.checkout('clave-1')
+        self.assertEqual(primera.status_code, 201)
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        # El reintento sólo lee la clave
+        with presupuesto_consultas(1):
+            reintento = self.checkout('clave-1')
+        self.assertEqual(reintento.status_code, 201)
+        self.assertEqual(reintento['Idempotent-Replayed'], 'true')
+        self.assertEqual(reintento.json(), primera.json())
+        self.assertEqual(Compra.objects.count(), 1)
+
+        # Otra clave es otra compra
+        self.assertEqual(self.checkout('clave-2').status_code, 201)
+        self.assertEqual(Compra.objects.count(), 2)
+
+    def test_la_clave_es_de_cada_usuario(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        self.assertEqual(self.checkout('clave').status_code, 201)
+        otro = User.objects.create_user('otra')
+        CarritoItem.objects.create(usuario=otro, producto=self.dune, cantidad=1)
+        self.client.force_authenticate(otro)
+        response = self.checkout('clave')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Compra.objects.filter(usuario=otro).count(), 1)
+
+    def test_otra_peticion_con_la_misma_clave(self):
+        self.assertEqual(self.checkout('clave').status_code, 400)
+        self.assertEqual(self.checkout('clave', metodo_pago='paypal').status_code, 422)
+
+    def test_en_curso(self):
+        # Reservada por otra petición que aún no ha terminado
+        ClaveIdempotencia.objects.create(
+            ambito=f'u:{self.usuario.id}', clave='clave', huella='h', caduca=timezone.now() + timedelta(hours=1)
+        )
+        with mock.patch('tienda.idempotencia.huella', return_value='h'):
+            self.assertEqual(self.checkout('clave').status_code, 409)
+
+    def test_en_curso_vence_si_el_proceso_murio(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        with mock.patch('tienda.idempotencia.huella', return_value='h'):
+            ClaveIdempotencia.objects.create(
+                ambito=f'u:{self.usuario.id}', clave='clave', huella='h', caduca=timezone.now() + timedelta(seconds=60)
+            )
+            self.assertEqual(self.checkout('clave').status_code, 409)
+            ClaveIdempotencia.objects.update(caduca=timezone.now() - timedelta(seconds=1))
+            self.assertEqual(self.checkout('clave').status_code, 201)
+        # Con respuesta, la clave dura TTL y no el plazo de la petición en curso
+        self.assertGreater(ClaveIdempotencia.objects.get().caduca, timezone.now() + timedelta(hours=23))
+
+    def test_error_libera_la_clave(self):
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        with mock.patch('tienda.views.vender', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout('clave')
+        self.assertFalse(ClaveIdempotencia.objects.exists())
+        self.assertEqual(self.checkout('clave').status_code, 201)
+
+    def test_clave_caducada_se_reutiliza(self):
+        self.checkout('clave')
+        ClaveIdempotencia.objects.update(caduca=timezone.now() - timedelta(seconds=1))
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=1)
+        response = self.checkout('clave', metodo_pago='paypal')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_clave_no_valida(self):
+        self.assertEqual(self.checkout('x' * 256).status_code, 400)
+
+    def test_anadir_al_carrito_como_invitado(self):
+        self.client.force_authenticate(None)
+        datos = {'producto': self.dune.id, 'cantidad': 2, 'session_key': 'invitado'}
+        for _ in range(3):
+            response = self.client.post('/api/carrito/', datos, HTTP_IDEMPOTENCY_KEY='clave')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(CarritoItem.objects.get(session_key='invitado').cantidad, 2)
+
+    def test_invitados_sin_carrito_no_comparten_clave(self):
+        self.client.force_authenticate(None)
+        datos = {'producto': self.dune.id, 'cantidad': 1}
+        primera = self.client.post('/api/carrito/', datos, HTTP_IDEMPOTENCY_KEY='1', REMOTE_ADDR='10.0.0.1')
+        reintento = self.client.post('/api/carrito/', datos, HTTP_IDEMPOTENCY_KEY='1', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(reintento.data['session_key'], primera.data['session_key'])
+        otro = self.client.post('/api/carrito/', datos, HTTP_IDEMPOTENCY_KEY='1', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(otro.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', otro)
+        self.assertNotEqual(otro.data['session_key'], primera.data['session_key'])
+
+    def test_purga(self):
+        self.checkout('vieja')
+        self.checkout('nueva')
+        ClaveIdempotencia.objects.filter(clave='vieja').update(caduca=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purgar_claves(), 1)
+        out = StringIO()
+        call_command('purgar_idempotencia', stdout=out)
+        self.assertIn('[OK] 0 claves', out.getvalue())
+        self.assertEqual(list(ClaveIdempotencia.objects.values_list('clave', flat=True)), ['nueva'])
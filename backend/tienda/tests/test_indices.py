@@ -0,0 +1,71 @@
+from itertools import product
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from tienda.models import Categoria
+from tienda.views import ProductoViewSet
+
+from .utils import crear_producto, sin_cache_respuestas
+
+
+@sin_cache_respuestas
+class IndicesProductoTests(APITestCase):
+    """Cada combinación de filtros y ordenamiento de /api/productos/ usa un índice"""
+    FILTROS = [
+        {},
+        {'categoria': 'CAT'},
+        {'precio_min': '12', 'precio_max': '18'},
+        {'categoria': 'CAT', 'precio_min': '12'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categorias = [Categoria.objects.create(nombre=f'Categoría {i}') for i in range(4)]
+        for i in range(40):
+            crear_producto(cls.categorias[i % 4], nombre=f'Libro {i}', precio=10 + i % 10)
+
+    def setUp(self):
+        cache.clear()
+
+    def planes(self, params):
+        """EXPLAIN QUERY PLAN de las consultas sobre tienda_producto de una petición"""
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get('/api/productos/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        planes = []
+        with connection.cursor() as cursor:
+            for consulta in consultas:
+                if 'FROM "tienda_producto"' in consulta['sql']:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + consulta['sql'])
+                    planes.append((consulta['sql'], [fila[-1] for fila in cursor.fetchall()]))
+        return planes
+
+    def test_filtros_y_ordenamientos_usan_indices(self):
+        ordenamientos = [None] + ProductoViewSet.ORDENAMIENTOS
+        paginaciones = [{}, {'paginacion': 'cursor'}]
+        for filtros, ordering, paginacion in product(self.FILTROS, ordenamientos, paginaciones):
+            params = {k: str(self.categorias[1].id) if v == 'CAT' else v for k, v in filtros.items()}
+            params.update(paginacion)
+            if ordering:
+                params['ordering'] = ordering
+            with self.subTest(params=params):
+                for sql, plan in self.planes(params):
+                    detalle = f'{sql}\n' + '\n'.join(plan)
+                    tabla = [paso for paso in plan if 'tienda_producto ' in paso or paso.endswith('tienda_producto')]
+                    self.assertTrue(tabla, detalle)
+                    for paso in tabla:
+                        # Nunca un recorrido completo de la tabla sin índice
+                        self.assertIn('INDEX', paso, detalle)
+                    if 'precio_min' not in params and 'ORDER BY' in sql:
+                        # Sin rango de precio, el índice ya entrega las filas ordenadas
+                        self.assertFalse([paso for paso in plan if 'TEMP B-TREE' in paso], detalle)
+
+    def test_ordenamiento_no_declarado(self):
+        for ordering in ['descripcion', 'categoria__nombre', '-stock', 'precio,nombre']:
+            with self.subTest(ordering=ordering):
+                response = self.client.get('/api/productos/', {'ordering': ordering})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('ordering', response.data)
@@ -0,0 +1,111 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from tienda.limpieza import limpiar_carritos_invitados
+from tienda.models import Categoria, CarritoItem
+from tienda.tareas import TareaPeriodica, tareas_configuradas
+
+from .utils import crear_producto
+
+
+class LimpiezaCarritosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.productos = [crear_producto(categoria, nombre=f'Libro {i}') for i in range(3)]
+        cls.usuario = User.objects.create_user('lector')
+
+    def linea(self, dias, **propietario):
+        producto = self.productos[CarritoItem.objects.filter(**propietario).count()]
+        item = CarritoItem.objects.create(producto=producto, **propietario)
+        CarritoItem.objects.filter(pk=item.pk).update(updated_at=timezone.now() - timedelta(days=dias))
+        return item
+
+    def test_borra_solo_los_carritos_de_invitados_inactivos(self):
+        for sesion in ('vieja-1', 'vieja-2'):
+            self.linea(40, session_key=sesion)
+            self.linea(35, session_key=sesion)
+        self.linea(40, session_key='activa')
+        self.linea(2, session_key='activa')
+        self.linea(10, session_key='reciente')
+        self.linea(90, usuario=self.usuario)
+
+        resultado = limpiar_carritos_invitados(ttl_dias=30, lote=2)
+        self.assertEqual(resultado.borrados, 4)
+        self.assertGreaterEqual(resultado.lotes, 2)
+        self.assertEqual(
+            sorted(CarritoItem.objects.values_list('session_key', flat=True), key=str),
+            [None, 'activa', 'activa', 'reciente'],
+        )
+        self.assertEqual(limpiar_carritos_invitados(ttl_dias=30).borrados, 0)
+
+    def test_usa_el_indice_de_sesion(self):
+        limite = timezone.now()
+        activas = CarritoItem.objects.filter(
+            session_key__isnull=False, updated_at__gte=limite
+        ).order_by().values('session_key')
+        with connection.cursor() as cursor:
+            sql, params = activas.query.sql_with_params()
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(fila[-1] for fila in cursor.fetchall())
+        self.assertIn('carrito_sesion_act_idx', plan)
+
+    def test_comando(self):
+        self.linea(40, session_key='vieja')
+        salida = StringIO()
+        call_command('limpiar_carritos', '--dias', '30', '--lote', '10', stdout=salida)
+        self.assertIn('1 líneas borradas en 1 lotes', salida.getvalue())
+        self.assertIn('líneas/s', salida.getvalue())
+        self.assertFalse(CarritoItem.objects.exists())
+
+
+class TareaPeriodicaTests(SimpleTestCase):
+    def test_ejecuta_cada_intervalo_y_sobrevive_a_errores(self):
+        llamadas = []
+        terminado = threading.Event()
+
+        def funcion():
+            llamadas.append(1)
+            if len(llamadas) == 1:
+                raise RuntimeError('fallo puntual')
+            if len(llamadas) == 3:
+                terminado.set()
+
+        tarea = TareaPeriodica(funcion, intervalo=0.01).iniciar()
+        with self.assertLogs('tienda.tareas', 'ERROR'):
+            self.assertTrue(terminado.wait(5))
+        tarea.detener(timeout=5)
+        self.assertGreaterEqual(len(llamadas), 3)
+
+
+class TareasPeriodicasTests(TestCase):
+    def test_django_no_arranca_tareas(self):
+        # Sólo tareas_periodicas las lanza, nunca el arranque de cada proceso
+        nombres = {hilo.name for hilo in threading.enumerate()}
+        self.assertFalse(nombres & {'limpiar_carritos', 'purgar_idempotencia', 'liberar_reservas', 'resumir_ventas'})
+
+    @override_settings(TIENDA_LIMPIEZA_CARRITOS={'INTERVALO': 3600}, TIENDA_IDEMPOTENCIA={},
+                       TIENDA_ANALITICA={}, TIENDA_RESERVAS={}, TIENDA_VENTAS={'INTERVALO_VENTANAS': None})
+    def test_solo_las_configuradas(self):
+        self.assertEqual([nombre for nombre, _, _ in tareas_configuradas()], ['limpiar_carritos'])
+
+    @override_settings(TIENDA_LIMPIEZA_CARRITOS={'INTERVALO': 3600, 'TTL_DIAS': 30})
+    def test_comando_una_vez(self):
+        categoria = Categoria.objects.create(nombre='Ficción')
+        item = CarritoItem.objects.create(producto=crear_producto(categoria), session_key='vieja')
+        CarritoItem.objects.filter(pk=item.pk).update(updated_at=timezone.now() - timedelta(days=40))
+        salida = StringIO()
+        call_command('tareas_periodicas', '--una-vez', '--solo', 'limpiar_carritos', stdout=salida)
+        self.assertIn('[OK] 1 tareas ejecutadas', salida.getvalue())
+        self.assertFalse(CarritoItem.objects.exists())
+
+    def test_comando_rechaza_tareas_sin_intervalo(self):
+        with self.assertRaises(CommandError):
+            call_command('tareas_periodicas', '--una-vez', '--solo', 'no_existe', stdout=StringIO())
@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from tienda.busqueda import get_backend
+from tienda.models import Categoria, Producto
+
+from .utils import crear_producto, sin_cache_respuestas
+
+
+@sin_cache_respuestas
+class PaginacionCursorTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ficcion = Categoria.objects.create(nombre='Ficción')
+        cls.mangas = Categoria.objects.create(nombre='Mangas')
+        # Precios repetidos para comprobar el desempate por id
+        for i in range(30):
+            crear_producto(
+                cls.ficcion if i % 2 else cls.mangas,
+                nombre=f'Libro {i}', precio=Decimal(10 + i % 5),
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def recorrer(self, params):
+        ids, url, params = [], '/api/productos/', dict(params, paginacion='cursor', page_size=4)
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['previous'])
+            ids.extend(p['id'] for p in response.data['results'])
+            url, params = response.data['next'], None
+        return ids, response.data['count']
+
+    def test_recorre_todo_sin_repetir_ni_saltar(self):
+        casos = [
+            ({}, Producto.objects.order_by('-created_at', '-id')),
+            ({'ordering': 'precio'}, Producto.objects.order_by('precio', 'id')),
+            ({'ordering': '-precio', 'categoria': self.ficcion.id},
+             Producto.objects.filter(categoria=self.ficcion).order_by('-precio', '-id')),
+            ({'precio_min': '11', 'precio_max': '13', 'ordering': 'precio'},
+             Producto.objects.filter(precio__gte=11, precio__lte=13).order_by('precio', 'id')),
+            ({'search': 'libro 1'}, get_backend().buscar(Producto.objects.all(), 'libro 1')),
+        ]
+        for params, esperado in casos:
+            with self.subTest(params=params):
+                ids, count = self.recorrer(params)
+                self.assertEqual(ids, list(esperado.values_list('id', flat=True)))
+                self.assertEqual(count, esperado.count())
+
+    def test_no_usa_offset_y_cachea_el_conteo(self):
+        response = self.client.get('/api/productos/', {'paginacion': 'cursor', 'ordering': 'precio'})
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(response.data['next'])
+        sql = ' '.join(q['sql'] for q in consultas)
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('COUNT', sql)
+
+    def test_cursor_invalido(self):
+        response = self.client.get('/api/productos/', {'paginacion': 'cursor', 'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_paginacion_por_numero_sigue_por_defecto(self):
+        response = self.client.get('/api/productos/', {'page': 2})
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual(len(response.data['results']), 12)
@@ -0,0 +1,62 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TransactionTestCase
+
+from tienda.models import Categoria, Compra, Producto
+from tienda.prueba_carga import percentil, simular_checkout
+
+
+class PercentilTests(SimpleTestCase):
+    def test_rango_mas_cercano(self):
+        valores = list(range(1, 101))
+        self.assertEqual([percentil(valores, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentil([7], 99), 7)
+        self.assertEqual(percentil([], 50), 0.0)
+
+
+class PruebaCargaTests(TransactionTestCase):
+    def test_no_se_vende_de_mas_y_se_limpia(self):
+        resultado = simular_checkout(compradores=12, stock=4, hilos=4, prefijo='prueba-')
+        self.assertTrue(resultado.correcto, str(resultado))
+        self.assertEqual(dict(resultado.estados), {201: 4, 400: 8})
+        self.assertEqual((resultado.vendidas, len(resultado.latencias)), (4, 12))
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Producto.objects.exists())
+
+    def test_conservar(self):
+        simular_checkout(compradores=3, stock=5, hilos=2, prefijo='prueba-', conservar=True)
+        self.assertEqual(Compra.objects.count(), 3)
+        # La siguiente prueba con el mismo prefijo empieza de cero
+        simular_checkout(compradores=2, stock=5, hilos=2, prefijo='prueba-', conservar=True)
+        self.assertEqual((Compra.objects.count(), Categoria.objects.count()), (2, 1))
+
+    def test_no_borra_usuarios_reales_con_el_prefijo(self):
+        real = User.objects.create_user('prueba-ana')
+        compra = Compra.objects.create(usuario=real, total=0)
+        simular_checkout(compradores=2, stock=1, hilos=2, prefijo='prueba-')
+        simular_checkout(compradores=2, stock=1, hilos=2, prefijo='prueba-', conservar=True)
+        simular_checkout(compradores=2, stock=1, hilos=2, prefijo='prueba-')
+        self.assertEqual(list(User.objects.all()), [real])
+        self.assertTrue(Compra.objects.filter(pk=compra.pk).exists())
+
+    def test_rechaza_prefijos_cortos(self):
+        for prefijo in ('', 'a'):
+            with self.subTest(prefijo=prefijo):
+                with self.assertRaises(CommandError):
+                    call_command('prueba_carga_checkout', '--prefijo', prefijo, stdout=StringIO())
+                with self.assertRaises(ValueError):
+                    simular_checkout(compradores=1, prefijo=prefijo)
+
+    def test_comando_detecta_la_venta_de_mas(self):
+        out = StringIO()
+        call_command('prueba_carga_checkout', '--compradores', '4', '--stock', '2', '--hilos', '2', stdout=out)
+        self.assertIn('[OK]', out.getvalue())
+
+        # Un checkout que no comprobara el stock
+        with mock.patch('tienda.views.vender', side_effect=lambda vendidos, reservadas=None: Producto.objects.filter(
+            pk__in=vendidos).update(stock=0)):
+            with self.assertRaises(CommandError):
+                call_command('prueba_carga_checkout', '--compradores', '4', '--stock', '2', '--hilos', '1', stdout=StringIO())
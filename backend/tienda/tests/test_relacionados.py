@@ -0,0 +1,137 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda import recomendaciones
+from tienda.models import Categoria, CoCompra, Compra, CompraItem, ProductoRelacionado, PuntoControl
+
+from .utils import crear_producto, presupuesto_consultas, sin_cache_respuestas
+
+HACE_UN_RATO = timezone.now() - timedelta(seconds=recomendaciones.MARGEN + 60)
+
+
+@sin_cache_respuestas
+class RelacionadosTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.a, cls.b, cls.c, cls.d = [crear_producto(categoria, nombre=nombre) for nombre in 'ABCD']
+
+    def comprar(self, *productos, estado='completada', reciente=False):
+        compra = Compra.objects.create(usuario=self.usuario, total=Decimal('10.00'), estado=estado)
+        for producto in productos:
+            CompraItem.objects.create(compra=compra, producto=producto, cantidad=1, precio_unitario=producto.precio)
+        if not reciente:
+            # De hace más de MARGEN segundos, para que se cuente ya
+            Compra.objects.filter(pk=compra.pk).update(fecha_compra=HACE_UN_RATO)
+        return compra
+
+    def relacionados(self, producto):
+        return list(
+            ProductoRelacionado.objects.filter(producto=producto).values_list('relacionado_id', 'veces')
+        )
+
+    def test_cuenta_los_pares_de_cada_cesta(self):
+        self.comprar(self.a, self.b, self.c)
+        self.comprar(self.a, self.c)
+        self.comprar(self.a, self.a)  # Producto repetido: no es un par
+        self.comprar(self.a, self.d, estado='cancelada')
+        self.assertEqual(recomendaciones.actualizar(), 3)
+        self.assertEqual(self.relacionados(self.a), [(self.c.id, 2), (self.b.id, 1)])
+        self.assertEqual(self.relacionados(self.b), [(self.a.id, 1), (self.c.id, 1)])
+        self.assertEqual(self.relacionados(self.d), [])
+        self.assertEqual(recomendaciones.actualizar(top_k=1), 0)
+
+    def test_incremental_equivale_a_completo(self):
+        self.comprar(self.a, self.b)
+        recomendaciones.actualizar()
+        self.comprar(self.a, self.c)
+        ultima = self.comprar(self.a, self.c, self.d)
+        # Sólo se recorren las compras nuevas y sólo cambian los productos afectados
+        self.assertEqual(recomendaciones.actualizar(), 3)
+        self.assertEqual(PuntoControl.objects.get(nombre=recomendaciones.PUNTO_CONTROL).ultimo_id, ultima.id)
+        incremental = {producto.id: self.relacionados(producto) for producto in (self.a, self.b, self.c, self.d)}
+        pares = set(CoCompra.objects.values_list('producto_id', 'otro_id', 'veces'))
+
+        recomendaciones.actualizar(completo=True)
+        self.assertEqual(
+            {producto.id: self.relacionados(producto) for producto in (self.a, self.b, self.c, self.d)}, incremental
+        )
+        self.assertEqual(set(CoCompra.objects.values_list('producto_id', 'otro_id', 'veces')), pares)
+        self.assertEqual(incremental[self.a.id], [(self.c.id, 2), (self.b.id, 1), (self.d.id, 1)])
+
+    def test_compras_recientes_esperan(self):
+        self.comprar(self.a, self.b)
+        # Una compra reciente con id menor que otra puede confirmarse después: se espera a ambas
+        self.comprar(self.a, self.c, reciente=True)
+        ultima = self.comprar(self.a, self.d)
+        self.assertEqual(recomendaciones.actualizar(), 2)
+        self.assertEqual(self.relacionados(self.a), [(self.b.id, 1)])
+        despues = timezone.now() + timedelta(seconds=recomendaciones.MARGEN + 1)
+        self.assertEqual(recomendaciones.actualizar(ahora=despues), 3)
+        self.assertEqual(PuntoControl.objects.get(nombre=recomendaciones.PUNTO_CONTROL).ultimo_id, ultima.id)
+        self.assertEqual(self.relacionados(self.a), [(self.b.id, 1), (self.c.id, 1), (self.d.id, 1)])
+        self.assertEqual(recomendaciones.actualizar(ahora=despues), 0)
+
+    def test_lotes_de_compras(self):
+        self.comprar(self.a, self.b)
+        self.comprar(self.a, self.c)
+        ultima = self.comprar(self.a, self.c, self.d)
+        # Una compra por transacción: el punto de control avanza con cada una
+        self.assertEqual(recomendaciones.actualizar(lote=1, lote_compras=1), 4)
+        self.assertEqual(PuntoControl.objects.get(nombre=recomendaciones.PUNTO_CONTROL).ultimo_id, ultima.id)
+        self.assertEqual(self.relacionados(self.a), [(self.c.id, 2), (self.b.id, 1), (self.d.id, 1)])
+
+    def test_completo_reemplaza_lo_cancelado(self):
+        self.comprar(self.a, self.b)
+        cancelada = self.comprar(self.c, self.d)
+        recomendaciones.actualizar()
+        Compra.objects.filter(pk=cancelada.pk).update(estado='cancelada')
+        self.assertEqual(recomendaciones.actualizar(completo=True, lote=1), 4)
+        self.assertEqual(self.relacionados(self.c), [])
+        self.assertFalse(CoCompra.objects.filter(producto=self.c).exists())
+        self.assertEqual(self.relacionados(self.a), [(self.b.id, 1)])
+
+    def test_completo_con_compras_incorporadas_a_la_vez(self):
+        self.comprar(self.a, self.b)
+        recomendaciones.actualizar()
+        cestas = recomendaciones.cestas
+
+        def cestas_con_otra_ejecucion(desde, hasta=None):
+            # Mientras se cuenta la reconstrucción, otra ejecución incorpora una compra nueva
+            if desde == 0:
+                self.comprar(self.a, self.b, self.c)
+                recomendaciones.incorporar()
+            return cestas(desde, hasta)
+
+        with mock.patch.object(recomendaciones, 'cestas', side_effect=cestas_con_otra_ejecucion):
+            recomendaciones.actualizar(completo=True, lote=1)
+        self.assertEqual(self.relacionados(self.a), [(self.b.id, 2), (self.c.id, 1)])
+        self.assertEqual(self.relacionados(self.c), [(self.a.id, 1), (self.b.id, 1)])
+
+    def test_comando(self):
+        self.comprar(self.a, self.b)
+        salida = StringIO()
+        call_command('calcular_relacionados', '--top', '1', stdout=salida)
+        self.assertIn('2 productos', salida.getvalue())
+        self.assertEqual(self.relacionados(self.a), [(self.b.id, 1)])
+
+    def test_endpoint(self):
+        self.comprar(self.a, self.b, self.c)
+        self.comprar(self.a, self.c)
+        recomendaciones.actualizar()
+        with presupuesto_consultas(1):
+            response = self.client.get(f'/api/productos/{self.a.id}/relacionados/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in response.data], [self.c.id, self.b.id])
+        self.assertEqual(response.data[0]['categoria'], {'id': self.c.categoria_id, 'nombre': 'Ficción'})
+        self.assertNotIn('descripcion', response.data[0])
+        self.assertEqual(self.client.get(f'/api/productos/{self.d.id}/relacionados/').data, [])
+        self.assertEqual(self.client.get('/api/productos/x/relacionados/').status_code, 404)
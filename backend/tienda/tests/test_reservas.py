@@ -0,0 +1,119 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda.models import Categoria, CarritoItem, Producto, Reserva
+from tienda.reservas import liberar_caducadas
+
+from .utils import crear_producto, sin_cache_respuestas
+
+
+@sin_cache_respuestas
+@override_settings(TIENDA_RESERVAS={'ACTIVAS': True, 'TTL': 60})
+class ReservasTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector', password='clave-segura-123')
+        categoria = Categoria.objects.create(nombre='Ficción')
+        cls.dune = crear_producto(categoria, nombre='Dune', precio=Decimal('12.50'), stock=3)
+        cls.ubik = crear_producto(categoria, nombre='Ubik', stock=10)
+
+    def anadir(self, producto, cantidad, session_key):
+        return self.client.post('/api/carrito/', {'producto': producto.id, 'cantidad': cantidad, 'session_key': session_key})
+
+    def stock(self, producto):
+        return Producto.objects.values_list('stock', 'reservado').get(pk=producto.pk)
+
+    def test_anadir_al_carrito_reserva_el_stock(self):
+        self.assertEqual(self.anadir(self.dune, 2, 'a').status_code, 201)
+        response = self.client.get(f'/api/productos/{self.dune.id}/')
+        self.assertEqual((response.data['stock'], response.data['reservado'], response.data['disponible']), (3, 2, 1))
+
+        response = self.anadir(self.dune, 2, 'b')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Solo hay 1 unidades disponibles', response.data['error'])
+        self.assertFalse(CarritoItem.objects.filter(session_key='b').exists())
+        self.assertEqual(self.anadir(self.dune, 1, 'b').status_code, 201)
+        self.assertEqual(self.stock(self.dune), (3, 3))
+
+        # Bajar la cantidad o quitar la línea devuelve las unidades
+        item = CarritoItem.objects.get(session_key='a')
+        self.assertEqual(self.client.patch(f'/api/carrito/{item.id}/?session_key=a', {'cantidad': 1}).status_code, 200)
+        self.assertEqual(self.stock(self.dune), (3, 2))
+        self.assertEqual(self.client.delete(f'/api/carrito/{item.id}/?session_key=a').status_code, 204)
+        self.assertEqual(self.stock(self.dune), (3, 1))
+        self.assertEqual(dict(Reserva.objects.values_list('propietario', 'cantidad')), {'s:b': 1})
+
+    def test_lote(self):
+        self.anadir(self.dune, 2, 'otro')
+        response = self.client.post('/api/carrito/lote/', {'session_key': 'a', 'operaciones': [
+            {'accion': 'agregar', 'producto': self.ubik.id, 'cantidad': 4},
+            {'accion': 'agregar', 'producto': self.dune.id, 'cantidad': 2},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data['productos']), [str(self.dune.id)])
+        self.assertFalse(Reserva.objects.filter(propietario='s:a').exists())
+        self.assertEqual(self.stock(self.ubik), (10, 0))
+
+    def test_checkout_vende_lo_reservado(self):
+        self.anadir(self.dune, 1, 'otro')
+        self.client.force_authenticate(self.usuario)
+        self.client.post('/api/carrito/', {'producto': self.dune.id, 'cantidad': 2})
+        self.client.post('/api/carrito/', {'producto': self.ubik.id, 'cantidad': 1})
+        # Lo reservado para un producto que ya no está en el carrito vuelve al stock
+        CarritoItem.objects.filter(usuario=self.usuario, producto=self.ubik).delete()
+        response = self.client.post('/api/carrito/checkout/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(self.dune), (1, 1))
+        self.assertEqual(self.stock(self.ubik), (10, 0))
+        self.assertEqual(list(Reserva.objects.values_list('propietario', flat=True)), ['s:otro'])
+
+    def test_checkout_respeta_las_reservas_de_otros(self):
+        # La reserva del comprador caducó y se liberó; otro carrito se llevó el stock libre
+        CarritoItem.objects.create(usuario=self.usuario, producto=self.dune, cantidad=2)
+        self.anadir(self.dune, 2, 'otro')
+        self.client.force_authenticate(self.usuario)
+        response = self.client.post('/api/carrito/checkout/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Solo hay 1 unidades disponibles', response.data['error'])
+        self.assertEqual(self.stock(self.dune), (3, 2))
+
+    def test_login_pasa_las_reservas_al_usuario(self):
+        self.anadir(self.dune, 1, 'invitado')
+        self.client.post('/api/auth/login/', {
+            'username': 'lector', 'password': 'clave-segura-123', 'session_key': 'invitado',
+        })
+        self.assertEqual(list(Reserva.objects.values_list('propietario', 'cantidad')), [(f'u:{self.usuario.id}', 1)])
+        self.assertEqual(self.stock(self.dune), (3, 1))
+
+    def test_liberar_caducadas(self):
+        for sesion in ('a', 'b', 'c'):
+            self.anadir(self.dune, 1, sesion)
+        self.anadir(self.ubik, 4, 'a')
+        Reserva.objects.exclude(propietario='s:c').update(caduca=timezone.now() - timedelta(seconds=1))
+        resultado = liberar_caducadas(lote=2)
+        self.assertEqual((resultado.liberadas, resultado.unidades, resultado.lotes), (3, 6, 2))
+        self.assertEqual(self.stock(self.dune), (3, 1))
+        self.assertEqual(self.stock(self.ubik), (10, 0))
+        # Las líneas del carrito siguen ahí
+        self.assertEqual(CarritoItem.objects.count(), 4)
+
+        out = StringIO()
+        call_command('liberar_reservas', stdout=out)
+        self.assertIn('[OK] 0 reservas caducadas liberadas', out.getvalue())
+
+
+@sin_cache_respuestas
+class SinReservasTests(APITestCase):
+    def test_no_se_reserva_nada(self):
+        producto = crear_producto(Categoria.objects.create(nombre='Ficción'), stock=3)
+        self.client.post('/api/carrito/', {'producto': producto.id, 'cantidad': 2, 'session_key': 'a'})
+        self.assertFalse(Reserva.objects.exists())
+        response = self.client.get(f'/api/productos/{producto.id}/')
+        self.assertEqual((response.data['reservado'], response.data['disponible']), (0, 3))
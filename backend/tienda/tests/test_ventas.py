@@ -0,0 +1,131 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tienda import ventas
+from tienda.models import Categoria, CarritoItem, Compra, CompraItem, Producto
+from tienda.tareas import tareas_configuradas
+
+from .utils import crear_producto, sin_cache_respuestas
+
+
+@sin_cache_respuestas
+class ContadoresVentasTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('lector')
+        cls.categoria = Categoria.objects.create(nombre='Ficción')
+        cls.otra = Categoria.objects.create(nombre='Ensayo')
+        cls.a = crear_producto(cls.categoria, nombre='A', precio=Decimal('10.00'), stock=50)
+        cls.b = crear_producto(cls.categoria, nombre='B', precio=Decimal('4.50'), stock=50)
+        cls.c = crear_producto(cls.otra, nombre='C', stock=50)
+
+    def checkout(self, **cantidades):
+        for nombre, cantidad in cantidades.items():
+            CarritoItem.objects.create(usuario=self.usuario, producto=getattr(self, nombre), cantidad=cantidad)
+        self.client.force_authenticate(self.usuario)
+        response = self.client.post('/api/carrito/checkout/')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Compra.objects.get(pk=response.data['compra']['id'])
+
+    def contadores(self, producto):
+        return Producto.objects.filter(pk=producto.pk).values(*Producto.CAMPOS_VENTAS, 'stock').get()
+
+    def test_checkout_incrementa_los_contadores(self):
+        self.checkout(a=2, b=1)
+        self.checkout(b=3)
+        self.assertEqual(self.contadores(self.a), {
+            'unidades_vendidas': 2, 'ingresos': Decimal('20.00'), 'unidades_30d': 2, 'unidades_7d': 2, 'stock': 48,
+        })
+        self.assertEqual(self.contadores(self.b)['ingresos'], Decimal('18.00'))
+        self.assertEqual(self.contadores(self.b)['unidades_vendidas'], 4)
+
+    def test_save_no_pisa_los_contadores(self):
+        obsoleto = Producto.objects.get(pk=self.a.pk)
+        self.checkout(a=2)
+        obsoleto.precio = Decimal('12.00')
+        obsoleto.save()
+        self.assertEqual(self.contadores(self.a)['unidades_vendidas'], 2)
+        self.assertEqual(Producto.objects.get(pk=self.a.pk).precio, Decimal('12.00'))
+
+    def test_save_con_campos_diferidos(self):
+        parcial = Producto.objects.only('precio').get(pk=self.a.pk)
+        Producto.objects.filter(pk=self.a.pk).update(stock=7)
+        parcial.precio = Decimal('11.00')
+        with CaptureQueriesContext(connection) as consultas:
+            parcial.save()
+        # Un solo UPDATE, sin leer los campos diferidos ni escribir el stock antiguo
+        self.assertEqual(len(consultas), 1, [consulta['sql'] for consulta in consultas])
+        self.assertNotIn('"stock"', consultas[0]['sql'])
+        self.assertEqual(self.contadores(self.a)['stock'], 7)
+        self.assertEqual(Producto.objects.get(pk=self.a.pk).precio, Decimal('11.00'))
+
+    def test_recalcular(self):
+        self.checkout(a=2, b=1)
+        antigua = self.checkout(a=1, c=5)
+        Compra.objects.filter(pk=antigua.pk).update(fecha_compra=timezone.now() - timedelta(days=10))
+        cancelada = self.checkout(b=7)
+        Compra.objects.filter(pk=cancelada.pk).update(estado='cancelada')
+        Producto.objects.filter(pk=self.b.pk).update(unidades_vendidas=99)
+
+        # Las ventanas descuentan lo que ya salió de ellas y no tocan el total
+        self.assertEqual(ventas.recalcular(ventanas=True), 3)
+        self.assertEqual(self.contadores(self.a)['unidades_30d'], 3)
+        self.assertEqual(self.contadores(self.a)['unidades_7d'], 2)
+        self.assertEqual(self.contadores(self.c)['unidades_7d'], 0)
+        self.assertEqual(self.contadores(self.b)['unidades_vendidas'], 99)
+
+        salida = StringIO()
+        call_command('recalcular_ventas', stdout=salida)
+        self.assertIn('3 productos', salida.getvalue())
+        self.assertEqual(self.contadores(self.b), {
+            'unidades_vendidas': 1, 'ingresos': Decimal('4.50'), 'unidades_30d': 1, 'unidades_7d': 1, 'stock': 42,
+        })
+        self.assertEqual(self.contadores(self.a)['unidades_vendidas'], 3)
+        self.assertEqual(CompraItem.objects.count(), 5)
+
+    def test_ordenar_por_mas_vendidos(self):
+        self.checkout(b=3, c=1)
+        response = self.client.get('/api/productos/', {'ordering': 'mas_vendidos'})
+        self.assertEqual([p['nombre'] for p in response.data['results']], ['B', 'C', 'A'])
+        response = self.client.get('/api/productos/', {'ordering': 'mas_vendidos', 'paginacion': 'cursor'})
+        self.assertEqual([p['nombre'] for p in response.data['results']], ['B', 'C', 'A'])
+
+    def test_mas_vendidos_por_categoria(self):
+        self.checkout(a=1, b=3)
+        antigua = self.checkout(a=5)
+        Compra.objects.filter(pk=antigua.pk).update(fecha_compra=timezone.now() - timedelta(days=10))
+        ventas.recalcular(ventanas=True)
+
+        url = f'/api/categorias/{self.categoria.id}/mas-vendidos/'
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+        self.assertEqual([(p['nombre'], p['unidades_vendidas']) for p in response.data], [('A', 6), ('B', 3)])
+        self.assertNotIn('descripcion', response.data[0])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + consultas[0]['sql'])
+            plan = ' '.join(fila[-1] for fila in cursor.fetchall())
+        self.assertIn('producto_cat_vendidos_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+        self.assertEqual([p['nombre'] for p in self.client.get(url, {'periodo': '7d'}).data], ['B', 'A'])
+        self.assertEqual(len(self.client.get(url, {'limit': 1}).data), 1)
+        self.assertEqual(self.client.get(f'/api/categorias/{self.otra.id}/mas-vendidos/').data, [])
+        self.assertEqual(self.client.get(url, {'periodo': 'anual'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/categorias/abc/mas-vendidos/').status_code, 404)
+        self.assertEqual(self.client.get('/api/categorias/999999/mas-vendidos/').status_code, 404)
+
+    def test_las_ventanas_se_recalculan_periodicamente(self):
+        self.assertIn('recalcular_ventanas', [nombre for nombre, _, _ in tareas_configuradas()])
+        antigua = self.checkout(a=2)
+        Compra.objects.filter(pk=antigua.pk).update(fecha_compra=timezone.now() - timedelta(days=10))
+        call_command('tareas_periodicas', '--una-vez', '--solo', 'recalcular_ventanas', stdout=StringIO())
+        a = Producto.objects.get(nombre='A')
+        self.assertEqual((a.unidades_vendidas, a.unidades_30d, a.unidades_7d), (2, 2, 0))
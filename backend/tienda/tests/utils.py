@@ -0,0 +1,62 @@
+from contextlib import ContextDecorator
+from decimal import Decimal
+
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from tienda.models import Producto
+
+# Para tests que miden consultas o cambian datos entre peticiones iguales
+sin_cache_respuestas = override_settings(TIENDA_CACHE_RESPUESTAS={'BACKEND': None})
+
+
+def crear_producto(categoria, **kwargs):
+    datos = {
+        'nombre': 'Libro',
+        'autor': 'Autor',
+        'descripcion': 'Descripción',
+        'contraportada': '',
+        'precio': Decimal('10.00'),
+        'imagen': 'libro.jpg',
+        'stock': 10,
+    }
+    datos.update(kwargs)
+    return Producto.objects.create(categoria=categoria, **datos)
+
+
+class presupuesto_consultas(ContextDecorator):
+    """
+    Falla si el bloque (o la función decorada) ejecuta más de ``maximo``
+    consultas SQL. Las consultas capturadas quedan en ``.consultas``.
+
+        with presupuesto_consultas(2):
+            self.client.get('/api/productos/')
+    """
+
+    def __init__(self, maximo, using='default'):
+        self.maximo = maximo
+        self.using = using
+
+    def __enter__(self):
+        self.captura = CaptureQueriesContext(connections[self.using])
+        self.captura.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.captura.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self) > self.maximo:
+            detalle = '\n'.join(
+                f'{i}. {consulta["sql"]}' for i, consulta in enumerate(self.consultas, start=1)
+            )
+            raise AssertionError(
+                f'{len(self)} consultas ejecutadas, el presupuesto es {self.maximo}:\n{detalle}'
+            )
+        return False
+
+    def __len__(self):
+        return len(self.captura)
+
+    @property
+    def consultas(self):
+        return self.captura.captured_queries
@@ -0,0 +1,37 @@
+"""
+Trabajos en segundo plano de la tienda. Se encolan con ``cola.encolar`` desde
+las vistas, así la petición no espera al correo (ver tienda/cola.py).
+"""
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+
+from .models import Compra
+
+
+def confirmar_compra(compra_id):
+    """Correo de confirmación de una compra"""
+    compra = Compra.objects.select_related('usuario').prefetch_related('items__producto').filter(pk=compra_id).first()
+    if compra is None or not compra.usuario.email:
+        return
+    lineas = '\n'.join(
+        f'- {item.producto.nombre} x{item.cantidad}: ${item.subtotal}' for item in compra.items.all()
+    )
+    send_mail(
+        f'Confirmación de tu compra #{compra.id}',
+        f'Hola {compra.usuario.username},\n\nGracias por tu compra:\n\n{lineas}\n\nTotal: ${compra.total}\n',
+        None,
+        [compra.usuario.email],
+    )
+
+
+def dar_bienvenida(usuario_id):
+    """Correo de bienvenida tras el registro"""
+    usuario = User.objects.filter(pk=usuario_id).first()
+    if usuario is None or not usuario.email:
+        return
+    send_mail(
+        'Bienvenido a la librería',
+        f'Hola {usuario.username},\n\nTu cuenta ya está lista. ¡Gracias por registrarte!\n',
+        None,
+        [usuario.email],
+    )
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    registro_usuario, login_usuario, perfil_usuario, cambiar_password,
+    registro_usuario, login_usuario, perfil_usuario, cambiar_password, exportar_compras,
+    analitica_ventas,
     CategoriaViewSet, ProductoViewSet, CarritoViewSet, CompraViewSet
 )
 
@@ -16,6 +17,8 @@ urlpatterns = [
     path('auth/login/', login_usuario, name='login'),
     path('auth/perfil/', perfil_usuario, name='perfil'),
     path('auth/cambiar-password/', cambiar_password, name='cambiar-password'),
+    path('exportar/', exportar_compras, name='exportar-compras'),
+    path('analitica/ventas/', analitica_ventas, name='analitica-ventas'),
     path('', include(router.urls)),
 ]
 
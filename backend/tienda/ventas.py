@@ -0,0 +1,117 @@
+"""
+Contadores de ventas por producto (unidades, ingresos y unidades de los
+últimos 30 y 7 días), guardados en el propio ``Producto`` para ordenar por
+popularidad con un índice en lugar de agregar ``CompraItem`` en cada petición.
+
+El checkout los incrementa con ``vender()``, en el mismo UPDATE que
+descuenta el stock. Las ventanas de 30 y 7 días sólo crecen con las ventas:
+``recalcular(ventanas=True)`` descuenta las que ya salieron de la ventana,
+cada ``INTERVALO_VENTANAS`` segundos con ``python manage.py
+tareas_periodicas`` (o con ``recalcular_ventas --ventanas`` desde cron). Sin
+``ventanas`` recalcula todo desde ``CompraItem`` para corregir desvíos.
+Configuración en ``TIENDA_VENTAS``.
+"""
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .cache_respuestas import incrementar_version
+from .configuracion import leer
+from .models import CompraItem, Producto
+
+# Ventanas (días) y contador de cada una
+VENTANAS = {30: 'unidades_30d', 7: 'unidades_7d'}
+
+CONFIGURACION_POR_DEFECTO = {
+    # Segundos entre recálculos de las ventanas en tareas_periodicas; None = sólo con el comando
+    'INTERVALO_VENTANAS': 3600,
+}
+
+
+def get_configuracion():
+    return leer('TIENDA_VENTAS', CONFIGURACION_POR_DEFECTO)
+
+
+def contadores_venta(cantidad, importe):
+    """Argumentos de ``QuerySet.update()`` que suman una venta a los contadores"""
+    contadores = {
+        'unidades_vendidas': F('unidades_vendidas') + cantidad,
+        'ingresos': F('ingresos') + importe,
+    }
+    for campo in VENTANAS.values():
+        contadores[campo] = F(campo) + cantidad
+    return contadores
+
+
+class StockAgotado(Exception):
+    """Algún producto ya no tiene stock suficiente para la venta"""
+
+
+def vender(lineas, reservadas=None):
+    """
+    Descontar el stock y sumar la venta de varios productos en un solo UPDATE.
+    ``lineas``: {producto_id: (cantidad, importe)}; ``reservadas``: {producto_id:
+    unidades} que el comprador tenía reservadas (ver tienda/reservas.py), que
+    pasan a vendidas. Sólo cambian los productos con stock suficiente sin
+    contar lo reservado por otros (``WHERE stock >= reservado - propias +
+    cantidad``); si falta alguno se lanza ``StockAgotado`` para que la
+    transacción de quien llama se deshaga.
+    """
+    reservadas = reservadas or {}
+    cambios = {}
+    for producto_id, (cantidad, importe) in lineas.items():
+        cambios[producto_id] = {'stock': F('stock') - cantidad, **contadores_venta(cantidad, importe)}
+        if reservadas.get(producto_id):
+            cambios[producto_id]['reservado'] = Greatest(F('reservado') - reservadas[producto_id], 0)
+    campos = ['stock', *contadores_venta(0, 0)]
+    if reservadas:
+        campos.append('reservado')
+    suficiente = reduce(or_, (
+        Q(pk=producto_id, stock__gte=F('reservado') - reservadas.get(producto_id, 0) + cantidad)
+        for producto_id, (cantidad, _) in lineas.items()
+    ))
+    vendidos = Producto.objects.filter(suficiente).update(**{
+        campo: Case(*(When(pk=producto_id, then=valores[campo])
+                      for producto_id, valores in cambios.items() if campo in valores),
+                    default=F(campo), output_field=Producto._meta.get_field(campo))
+        for campo in campos
+    })
+    if vendidos != len(lineas):
+        raise StockAgotado
+
+
+def recalcular(ventanas=False, ahora=None, lote=500):
+    """
+    Recalcular los contadores desde las compras no canceladas (con
+    ``ventanas``, sólo los de 30 y 7 días). Devuelve cuántos productos tienen ventas.
+    """
+    ahora = ahora or timezone.now()
+    campos = list(VENTANAS.values()) if ventanas else list(Producto.CAMPOS_VENTAS)
+    sumas = {
+        campo: Sum('cantidad', filter=Q(compra__fecha_compra__gte=ahora - timedelta(days=dias)), default=0)
+        for dias, campo in VENTANAS.items()
+    }
+    items = CompraItem.objects.exclude(compra__estado='cancelada')
+    if ventanas:
+        items = items.filter(compra__fecha_compra__gte=ahora - timedelta(days=max(VENTANAS)))
+    else:
+        sumas['unidades_vendidas'] = Sum('cantidad')
+        sumas['ingresos'] = Sum('subtotal')
+
+    with transaction.atomic():
+        filas = items.order_by().values('producto_id').annotate(**sumas)
+        productos = [
+            Producto(pk=fila['producto_id'], **{campo: fila[campo] for campo in campos})
+            for fila in filas
+        ]
+        # Sólo se escriben los productos con algún contador distinto de cero
+        a_cero = Producto.objects.filter(reduce(or_, (Q(**{f'{campo}__gt': 0}) for campo in campos)))
+        a_cero.update(**{campo: 0 for campo in campos})
+        Producto.objects.bulk_update(productos, campos, batch_size=lote)
+        transaction.on_commit(incrementar_version)
+    return len(productos)
@@ -1,18 +1,40 @@
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import api_view, permission_classes, action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
+from decimal import Decimal, InvalidOperation
+
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, IntegerField, Prefetch, Q, Sum, Value, When
+from django.db.models.functions import Substr
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
 from django.utils.crypto import get_random_string
 
-from .models import Categoria, Producto, CarritoItem, Compra, CompraItem
+from . import analitica, reservas, trabajos
+from .almacen_carrito import Propietario, get_almacen
+from .autocompletar import get_indice as get_indice_autocompletar
+from .busqueda import get_backend as get_busqueda_backend
+from .carrito import fusionar_carrito_invitado
+from .cola import encolar
+from .exportacion import ESTADOS as ESTADOS_COMPRA, Exportacion, filtro_compras, parsear_estados, parsear_fecha
+from .cache_respuestas import CacheRespuestasMixin, incrementar_version
+from .idempotencia import idempotente
+from .models import (
+    Categoria, Producto, CarritoItem, Compra, CompraItem, ProductoRelacionado, PuntoControl, unidades_por_compra
+)
+from .pagination import KeysetPagination
 from .serializers import (
     RegisterSerializer, UserSerializer, UserUpdateSerializer, ChangePasswordSerializer,
-    CategoriaSerializer, ProductoSerializer, CarritoItemSerializer, CarritoItemCreateSerializer,
-    CarritoItemUpdateSerializer, CompraSerializer, CompraCreateSerializer, CompraItemSerializer
+    CategoriaSerializer, ProductoSerializer, ProductoListSerializer, ProductoResumenSerializer,
+    ProductoVentasSerializer, CarritoItemSerializer, CarritoItemCreateSerializer, CarritoItemUpdateSerializer,
+    CarritoLoteSerializer,
+    CompraSerializer, CompraListSerializer, CompraCreateSerializer, CompraItemSerializer, campos_a_diferir
 )
+from .ventas import StockAgotado, vender
 
 
 @api_view(['POST'])
@@ -22,11 +44,14 @@ def registro_usuario(request):
     serializer = RegisterSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.save()
+        encolar(trabajos.dar_bienvenida, usuario_id=user.pk)
         refresh = RefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'refresh': str(refresh),
             'access': str(refresh.access_token),
+            # Carrito de invitado que se pasa a la nueva cuenta (opcional)
+            'carrito_fusionado': fusionar_carrito_invitado(user, request.data.get('session_key')),
         }, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -58,73 +83,309 @@ def login_usuario(request):
                 'user': UserSerializer(user).data,
                 'refresh': str(refresh),
                 'access': str(refresh.access_token),
+                # El carrito de invitado (si se envía su session_key) se suma al del usuario
+                'carrito_fusionado': fusionar_carrito_invitado(user, request.data.get('session_key')),
             }, status=status.HTTP_200_OK)
         return Response({'error': 'Credenciales inválidas'}, status=status.HTTP_401_UNAUTHORIZED)
     return Response({'error': 'Se requiere username/email y password'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoriaViewSet(viewsets.ReadOnlyModelViewSet):
+def parametro_entero(params, campo):
+    """Entero de ``params[campo]``; None si no viene. 400 con el nombre del campo si no es válido"""
+    valor = params.get(campo)
+    if not valor:
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValidationError({campo: 'Debe ser un número entero.'})
+
+
+def parametro_decimal(params, campo):
+    """Decimal finito de ``params[campo]``; None si no viene. 400 con el nombre del campo si no es válido"""
+    valor = params.get(campo)
+    if not valor:
+        return None
+    try:
+        numero = Decimal(valor)
+    except InvalidOperation:
+        numero = None
+    if numero is None or not numero.is_finite():
+        raise ValidationError({campo: 'Debe ser un número.'})
+    return numero
+
+
+class CategoriaViewSet(CacheRespuestasMixin, viewsets.ReadOnlyModelViewSet):
     """Listado y detalle de categorías"""
     queryset = Categoria.objects.all()
     serializer_class = CategoriaSerializer
     permission_classes = [AllowAny]
     pagination_class = None  # Desactivar paginación para categorías
 
+    def get_queryset(self):
+        return Categoria.objects.defer(*campos_a_diferir(self.get_serializer()))
+
+    # Contador por el que se ordena cada periodo de /categorias/{id}/mas-vendidos/
+    PERIODOS_VENTAS = {'total': 'unidades_vendidas', '30d': 'unidades_30d', '7d': 'unidades_7d'}
+    LIMITE_MAS_VENDIDOS = 50
 
-class ProductoViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=True, methods=['get'], url_path='mas-vendidos')
+    def mas_vendidos(self, request, pk=None):
+        """Productos más vendidos de la categoría (?periodo=total|30d|7d, ?limit=)"""
+        return self._respuesta_cacheada(self._mas_vendidos, request, pk=pk)
+
+    def _mas_vendidos(self, request, pk=None):
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise NotFound()
+        periodo = request.query_params.get('periodo', 'total')
+        if periodo not in self.PERIODOS_VENTAS:
+            raise ValidationError({'periodo': f'Opciones: {", ".join(self.PERIODOS_VENTAS)}'})
+        try:
+            limite = min(int(request.query_params.get('limit', 10)), self.LIMITE_MAS_VENDIDOS)
+        except ValueError:
+            raise ValidationError({'limit': 'Debe ser un número entero.'})
+        campo = self.PERIODOS_VENTAS[periodo]
+        serializer = ProductoVentasSerializer(many=True, context=self.get_serializer_context())
+        # Se recorre el índice (categoria, contador) en orden descendente
+        productos = (
+            Producto.objects.filter(categoria_id=pk, **{f'{campo}__gt': 0})
+            .select_related('categoria')
+            .defer(*campos_a_diferir(serializer))
+            .order_by(f'-{campo}', '-id')[:max(limite, 0)]
+        )
+        serializer.instance = productos
+        data = serializer.data
+        # Sólo una lista vacía necesita comprobar que la categoría existe
+        if not data and not Categoria.objects.filter(pk=pk).exists():
+            raise NotFound()
+        return Response(data)
+
+
+class ProductoViewSet(CacheRespuestasMixin, viewsets.ReadOnlyModelViewSet):
     """Listado y detalle de productos con filtros"""
     queryset = Producto.objects.all()
     serializer_class = ProductoSerializer
     permission_classes = [AllowAny]
+    # Filtros y ordenamiento se resuelven en get_queryset
+    filter_backends = []
+    # Valores aceptados en ?ordering=; cada uno tiene un índice en Producto.Meta.indexes
+    ORDENAMIENTOS = ['precio', '-precio', 'nombre', '-nombre', 'created_at', '-created_at', 'mas_vendidos']
+    # Ordenamientos que no son un nombre de campo
+    ALIAS_ORDENAMIENTO = {'mas_vendidos': '-unidades_vendidas'}
+
+    @property
+    def paginator(self):
+        """Paginación por cursor opcional (?paginacion=cursor) para scroll infinito"""
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('paginacion') == 'cursor':
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class() if self.pagination_class else None
+        return self._paginator
+
+    # Rangos de precio [min, max) de /productos/facetas/; None = sin límite
+    RANGOS_PRECIO = [(None, 10), (10, 15), (15, 20), (20, 30), (30, None)]
+
+    def parametros_filtro(self):
+        """``categoria``, ``precio_min`` y ``precio_max`` validados una vez por petición"""
+        if not hasattr(self, '_parametros_filtro'):
+            params = self.request.query_params
+            self._parametros_filtro = {
+                'categoria': parametro_entero(params, 'categoria'),
+                'precio_min': parametro_decimal(params, 'precio_min'),
+                'precio_max': parametro_decimal(params, 'precio_max'),
+            }
+        return self._parametros_filtro
+
+    def filtro_categoria(self):
+        """Filtro por categoría"""
+        categoria = self.parametros_filtro()['categoria']
+        return Q(categoria_id=categoria) if categoria is not None else Q()
+
+    def filtro_precio(self):
+        """Filtro por precio mínimo y máximo"""
+        filtro = Q()
+        precio_min = self.parametros_filtro()['precio_min']
+        if precio_min is not None:
+            filtro &= Q(precio__gte=precio_min)
+        precio_max = self.parametros_filtro()['precio_max']
+        if precio_max is not None:
+            filtro &= Q(precio__lte=precio_max)
+        return filtro
+
+    # Caracteres de la contraportada que se envían como ``resumen`` en el listado
+    LONGITUD_RESUMEN = 200
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProductoListSerializer
+        return ProductoSerializer
 
     def get_queryset(self):
-        queryset = Producto.objects.all()
-        
-        # Filtro por categoría
-        categoria = self.request.query_params.get('categoria', None)
-        if categoria:
-            queryset = queryset.filter(categoria_id=categoria)
-        
-        # Filtro por precio mínimo
-        precio_min = self.request.query_params.get('precio_min', None)
-        if precio_min:
-            queryset = queryset.filter(precio__gte=precio_min)
+        queryset = Producto.objects.select_related('categoria').filter(
+            self.filtro_categoria(), self.filtro_precio()
+        )
         
-        # Filtro por precio máximo
-        precio_max = self.request.query_params.get('precio_max', None)
-        if precio_max:
-            queryset = queryset.filter(precio__lte=precio_max)
+        # Sólo se leen las columnas que se van a devolver
+        serializer = self.get_serializer()
+        queryset = queryset.defer(*campos_a_diferir(serializer))
+        if 'resumen' in serializer.fields:
+            queryset = queryset.annotate(resumen=Substr('contraportada', 1, self.LONGITUD_RESUMEN))
         
-        # Búsqueda por nombre o autor
+        # Búsqueda de texto completo (nombre, autor, descripción y contraportada),
+        # ordenada por relevancia salvo que se pida otro orden
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                Q(nombre__icontains=search) | Q(autor__icontains=search)
-            )
+            queryset = get_busqueda_backend().buscar(queryset, search)
         
-        # Ordenamiento
+        # Ordenamiento (sólo los declarados); el id desempata en la misma dirección
         ordering = self.request.query_params.get('ordering', None)
         if ordering:
-            queryset = queryset.order_by(ordering)
+            if ordering not in self.ORDENAMIENTOS:
+                raise ValidationError({
+                    'ordering': f'Ordenamiento no válido. Opciones: {", ".join(self.ORDENAMIENTOS)}'
+                })
+            campo = self.ALIAS_ORDENAMIENTO.get(ordering, ordering)
+            desempate = '-id' if campo.startswith('-') else 'id'
+            queryset = queryset.order_by(campo, desempate)
+        elif not search:
+            queryset = queryset.order_by('-created_at', '-id')
         
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def facetas(self, request):
+        """Conteos por categoría y por rango de precio para los filtros actuales"""
+        return self._respuesta_cacheada(self._facetas, request)
+
+    def _facetas(self, request):
+        # Cada faceta ignora su propio filtro (los conteos por categoría respetan el
+        # precio y viceversa), así que se agrupa por (categoría, rango) sin filtrar
+        # por ninguno de los dos y se reparte en Python: una sola consulta
+        queryset = Producto.objects.all()
+        search = request.query_params.get('search', None)
+        if search:
+            queryset = get_busqueda_backend().filtrar(queryset, search)
+
+        rango = Case(*[
+            When(Q(**({'precio__gte': minimo} if minimo is not None else {}))
+                 & Q(**({'precio__lt': maximo} if maximo is not None else {})), then=Value(i))
+            for i, (minimo, maximo) in enumerate(self.RANGOS_PRECIO)
+        ], output_field=IntegerField())
+        en_stock = Q(stock__gt=0)
+        filtro_precio = self.filtro_precio()
+        conteos = {'total': Count('id'), 'disponibles': Count('id', filter=en_stock)}
+        if filtro_precio:
+            conteos['total_precio'] = Count('id', filter=filtro_precio)
+            conteos['disponibles_precio'] = Count('id', filter=filtro_precio & en_stock)
+        filas = list(
+            queryset.order_by()
+            .annotate(rango=rango)
+            .values('categoria_id', 'categoria__nombre', 'rango')
+            .annotate(**conteos)
+        )
+
+        categoria = self.parametros_filtro()['categoria']
+        categorias, total = {}, 0
+        precios = [
+            {'min': minimo, 'max': maximo, 'count': 0, 'disponibles': 0}
+            for minimo, maximo in self.RANGOS_PRECIO
+        ]
+        for fila in filas:
+            count = fila.get('total_precio', fila['total'])
+            disponibles = fila.get('disponibles_precio', fila['disponibles'])
+            faceta = categorias.setdefault(fila['categoria_id'], {
+                'id': fila['categoria_id'], 'nombre': fila['categoria__nombre'], 'count': 0, 'disponibles': 0,
+            })
+            faceta['count'] += count
+            faceta['disponibles'] += disponibles
+            if categoria is None or fila['categoria_id'] == categoria:
+                total += count
+                if fila['rango'] is not None:
+                    precios[fila['rango']]['count'] += fila['total']
+                    precios[fila['rango']]['disponibles'] += fila['disponibles']
+
+        return Response({
+            'total': total,
+            'categorias': sorted(
+                (faceta for faceta in categorias.values() if faceta['count']), key=lambda f: f['nombre']
+            ),
+            'precios': precios,
+        })
+
+    @action(detail=True, methods=['get'])
+    def relacionados(self, request, pk=None):
+        """Productos comprados a menudo junto a este (precalculados con calcular_relacionados)"""
+        return self._respuesta_cacheada(self._relacionados, request, pk=pk)
+
+    def _relacionados(self, request, pk=None):
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise NotFound()
+        serializer = ProductoResumenSerializer(many=True, context=self.get_serializer_context())
+        filas = (
+            ProductoRelacionado.objects.filter(producto_id=pk)
+            .select_related('relacionado__categoria')
+            .defer(*campos_a_diferir(serializer, 'relacionado__'))
+            .order_by('posicion')
+        )
+        serializer.instance = [fila.relacionado for fila in filas]
+        return Response(serializer.data)
+
+    # Sugerencias máximas de /productos/autocompletar/
+    LIMITE_AUTOCOMPLETAR = 20
+
+    @action(detail=False, methods=['get'])
+    def autocompletar(self, request):
+        """Sugerencias por prefijo de título o autor, desde el índice en memoria"""
+        try:
+            limite = min(int(request.query_params.get('limit', 8)), self.LIMITE_AUTOCOMPLETAR)
+        except ValueError:
+            raise ValidationError({'limit': 'Debe ser un número entero.'})
+        q = request.query_params.get('q', '')
+        return Response(get_indice_autocompletar().buscar(q, max(limite, 0)))
+
+
+def compras_con_detalle(diferir=None, items=None):
+    """Compras con usuario, items y productos cargados en un número fijo de consultas"""
+    if items is None:
+        if diferir is None:
+            diferir = campos_a_diferir(CompraItemSerializer())
+        items = CompraItem.objects.select_related('producto__categoria').defer(*diferir)
+    return Compra.objects.select_related('usuario').annotate(
+        total_items=unidades_por_compra()
+    ).prefetch_related(Prefetch('items', queryset=items))
+
 
 class CarritoViewSet(viewsets.ModelViewSet):
-    """Gestión del carrito"""
+    """Gestión del carrito (guardado en el almacén configurado, ver ``almacen_carrito``)"""
     serializer_class = CarritoItemSerializer
     permission_classes = [AllowAny]
+    # Con un almacén clave-valor los items son una lista, no un QuerySet
+    filter_backends = []
+
+    @property
+    def almacen(self):
+        return get_almacen()
+
+    def propietario(self, session_key=None):
+        """Dueño del carrito: el usuario autenticado o, si no hay, el invitado ``session_key``"""
+        return Propietario.de(self.request.user, session_key or self.request.query_params.get('session_key'))
+
+    def diferir(self):
+        return campos_a_diferir(CarritoItemSerializer(context=self.get_serializer_context()))
 
     def get_queryset(self):
-        user = self.request.user
-        session_key = self.request.query_params.get('session_key', None)
-        
-        if user.is_authenticated:
-            return CarritoItem.objects.filter(usuario=user)
-        elif session_key:
-            return CarritoItem.objects.filter(session_key=session_key)
-        else:
-            return CarritoItem.objects.none()
+        return self.almacen.items(self.propietario(), self.diferir())
+
+    def get_object(self):
+        instance = self.almacen.linea(self.propietario(), self.kwargs['pk'], self.diferir())
+        if instance is None:
+            raise NotFound()
+        return instance
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -133,6 +394,7 @@ class CarritoViewSet(viewsets.ModelViewSet):
             return CarritoItemUpdateSerializer
         return CarritoItemSerializer
 
+    @idempotente
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -152,38 +414,20 @@ class CarritoViewSet(viewsets.ModelViewSet):
         if not request.user.is_authenticated and not session_key:
             session_key = get_random_string(40)
         
-        # Buscar si ya existe el item en el carrito
-        if request.user.is_authenticated:
-            carrito_item, created = CarritoItem.objects.get_or_create(
-                usuario=request.user,
-                producto=producto,
-                defaults={'cantidad': cantidad}
-            )
-            if not created:
-                nueva_cantidad = carrito_item.cantidad + cantidad
-            else:
-                nueva_cantidad = cantidad
-        else:
-            carrito_item, created = CarritoItem.objects.get_or_create(
-                session_key=session_key,
-                producto=producto,
-                defaults={'cantidad': cantidad}
-            )
-            if not created:
-                nueva_cantidad = carrito_item.cantidad + cantidad
-            else:
-                nueva_cantidad = cantidad
-        
-        # Validar stock disponible
-        if nueva_cantidad > producto.stock:
-            return Response(
-                {'error': f'Stock insuficiente. Solo hay {producto.stock} unidades disponibles'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        stock_insuficiente = Response(
+            {'error': f'Stock insuficiente. Solo hay {producto.stock} unidades disponibles'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+        if cantidad > producto.stock:
+            return stock_insuficiente
         
-        if not created:
-            carrito_item.cantidad = nueva_cantidad
-            carrito_item.save()
+        propietario = self.propietario(session_key)
+        if not self.reservar(propietario, {producto.id: cantidad}):
+            return self.stock_insuficiente(producto, producto.disponible)
+        carrito_item = self.almacen.agregar(propietario, producto, cantidad)
+        if carrito_item is None:
+            self.reservar(propietario, {producto.id: -cantidad})
+            return stock_insuficiente
         
         response_serializer = CarritoItemSerializer(carrito_item)
         headers = self.get_success_headers(response_serializer.data)
@@ -197,25 +441,9 @@ class CarritoViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         """Actualizar cantidad del item del carrito"""
         partial = kwargs.pop('partial', False)
+        # Sólo se encuentran las líneas del propio carrito
         instance = self.get_object()
         
-        # Validar que el usuario tiene acceso a este item
-        user = request.user
-        session_key = request.query_params.get('session_key', None)
-        
-        if user.is_authenticated:
-            if instance.usuario != user:
-                return Response(
-                    {'error': 'No tienes permiso para modificar este item'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-        else:
-            if instance.session_key != session_key:
-                return Response(
-                    {'error': 'No tienes permiso para modificar este item'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-        
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         
@@ -228,7 +456,11 @@ class CarritoViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        serializer.save()
+        propietario = self.propietario()
+        if not self.reservar(propietario, {instance.producto_id: cantidad - instance.cantidad}):
+            return self.stock_insuficiente(instance.producto, instance.producto.disponible)
+        self.almacen.aplicar(propietario, {instance.producto_id: cantidad}, {instance.producto_id: instance})
+        instance.cantidad = cantidad
         
         # Retornar con el serializer completo
         response_serializer = CarritoItemSerializer(instance)
@@ -239,37 +471,141 @@ class CarritoViewSet(viewsets.ModelViewSet):
         kwargs['partial'] = True
         return self.update(request, *args, **kwargs)
 
+    def resumen_carrito(self, propietario=None):
+        """Items del carrito con el total, las unidades y los avisos de stock"""
+        items, total, unidades = self.almacen.resumen(propietario or self.propietario(), self.diferir())
+        avisos = [
+            {
+                'item': item.id,
+                'producto': item.producto_id,
+                'cantidad': item.cantidad,
+                'stock': item.producto.stock,
+                'mensaje': f'Stock insuficiente para {item.producto.nombre}. '
+                           f'Solo hay {item.producto.stock} unidades disponibles',
+            }
+            for item in items if item.cantidad > item.producto.stock
+        ]
+        return {
+            'items': items,
+            'total': total,
+            'cantidad_items': unidades,
+            'avisos_stock': avisos,
+        }
+
+    def respuesta_resumen(self, propietario=None, **extra):
+        resumen = self.resumen_carrito(propietario)
+        serializer = CarritoItemSerializer(resumen['items'], many=True, context=self.get_serializer_context())
+        return Response({
+            'items': serializer.data,
+            'total': float(resumen['total']),
+            'cantidad_items': resumen['cantidad_items'],
+            'avisos_stock': resumen['avisos_stock'],
+            **extra,
+        })
+
+    @action(detail=False, methods=['get'])
+    def resumen(self, request):
+        """Items, subtotales, total y avisos de stock del carrito en una sola respuesta"""
+        return self.respuesta_resumen()
+
+    @action(detail=False, methods=['post'])
+    def lote(self, request):
+        """Aplicar varias operaciones (agregar, fijar, quitar) al carrito en una transacción; todas o ninguna"""
+        serializer = CarritoLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operaciones = serializer.validated_data['operaciones']
+
+        session_key = serializer.validated_data.get('session_key')
+        if not request.user.is_authenticated:
+            session_key = session_key or get_random_string(40)
+        propietario = self.propietario(session_key)
+
+        ids = {operacion['producto'] for operacion in operaciones}
+        try:
+            with transaction.atomic():
+                existentes = self.almacen.lineas(propietario, ids)
+                # Todo el stock se valida con una sola consulta
+                productos = Producto.objects.only('id', 'nombre', 'stock', 'reservado').order_by().in_bulk(ids)
+
+                # Cantidades finales por producto (0 = fuera del carrito)
+                cantidades = {producto_id: item.cantidad for producto_id, item in existentes.items()}
+                for operacion in operaciones:
+                    producto_id = operacion['producto']
+                    if operacion['accion'] == 'agregar':
+                        cantidades[producto_id] = cantidades.get(producto_id, 0) + operacion['cantidad']
+                    elif operacion['accion'] == 'fijar':
+                        cantidades[producto_id] = operacion['cantidad']
+                    else:
+                        cantidades[producto_id] = 0
+
+                errores = {}
+                for producto_id, cantidad in cantidades.items():
+                    producto = productos.get(producto_id)
+                    if producto is None:
+                        if cantidad:
+                            errores[str(producto_id)] = 'El producto no existe'
+                    elif cantidad > producto.stock:
+                        errores[str(producto_id)] = (
+                            f'Stock insuficiente para {producto.nombre}. '
+                            f'Solo hay {producto.stock} unidades disponibles'
+                        )
+                reservas_lote = {
+                    producto_id: cantidad - (existentes[producto_id].cantidad if producto_id in existentes else 0)
+                    for producto_id, cantidad in cantidades.items()
+                }
+                if not errores and not self.reservar(propietario, reservas_lote):
+                    errores = {
+                        str(producto_id): (
+                            f'Stock insuficiente para {productos[producto_id].nombre}. '
+                            f'Solo hay {productos[producto_id].disponible} unidades disponibles'
+                        )
+                        for producto_id, delta in reservas_lote.items() if delta > 0 and delta > productos[producto_id].disponible
+                    } or {'reservas': 'El stock cambió mientras se reservaba, inténtalo de nuevo'}
+                if errores:
+                    return Response({'error': 'No se aplicó ningún cambio', 'productos': errores},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+                self.almacen.aplicar(propietario, cantidades, existentes)
+        except IntegrityError:
+            # Otra petición añadió a la vez alguno de estos productos
+            return Response({'error': 'El carrito cambió mientras se actualizaba, inténtalo de nuevo'},
+                            status=status.HTTP_409_CONFLICT)
+
+        extra = {} if request.user.is_authenticated else {'session_key': session_key}
+        return self.respuesta_resumen(propietario, **extra)
+
     @action(detail=False, methods=['get'])
     def total(self, request):
         """Obtener el total del carrito"""
-        queryset = self.get_queryset()
-        total = sum(item.subtotal for item in queryset)
-        return Response({'total': float(total)})
+        return Response({'total': float(self.resumen_carrito()['total'])})
 
     def destroy(self, request, *args, **kwargs):
-        """Eliminar item del carrito con validación de permisos"""
+        """Eliminar item del carrito (sólo se encuentran las líneas del propio carrito)"""
         instance = self.get_object()
-        
-        # Validar que el usuario tiene acceso a este item
-        user = request.user
-        session_key = request.query_params.get('session_key', None)
-        
-        if user.is_authenticated:
-            if instance.usuario != user:
-                return Response(
-                    {'error': 'No tienes permiso para eliminar este item'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-        else:
-            if instance.session_key != session_key:
-                return Response(
-                    {'error': 'No tienes permiso para eliminar este item'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-        
-        return super().destroy(request, *args, **kwargs)
+        propietario = self.propietario()
+        self.reservar(propietario, {instance.producto_id: -instance.cantidad})
+        self.almacen.aplicar(propietario, {instance.producto_id: 0}, {instance.producto_id: instance})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def reservar(self, propietario, cambios):
+        """Con las reservas activas, apartar (o devolver) ``cambios`` del stock; False si no hay suficiente"""
+        if not reservas.activas():
+            return True
+        try:
+            reservas.reservar(propietario, cambios)
+        except StockAgotado:
+            return False
+        return True
+
+    def stock_insuficiente(self, producto, disponible=None):
+        disponible = producto.stock if disponible is None else disponible
+        return Response(
+            {'error': f'Stock insuficiente para {producto.nombre}. Solo hay {disponible} unidades disponibles'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
     @action(detail=False, methods=['post'])
+    @idempotente
     def checkout(self, request):
         """Procesar checkout y crear compra"""
         if not request.user.is_authenticated:
@@ -278,70 +614,198 @@ class CarritoViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        # Obtener items del carrito del usuario
-        carrito_items = CarritoItem.objects.filter(usuario=request.user)
-        
-        if not carrito_items.exists():
-            return Response(
-                {'error': 'Tu carrito está vacío'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Calcular total
-        total = sum(item.subtotal for item in carrito_items)
-        
-        # Validar stock antes de crear la compra
-        for item in carrito_items:
-            if item.cantidad > item.producto.stock:
-                return Response(
-                    {'error': f'Stock insuficiente para {item.producto.nombre}. Solo hay {item.producto.stock} unidades disponibles'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        # Con write-behind, el carrito se vuelca antes de leerlo: la compra ve
+        # exactamente lo que hay en el almacén
+        propietario = self.propietario()
+        self.almacen.instantanea(propietario)
         
         # Obtener método de pago (por defecto 'stripe')
         metodo_pago = request.data.get('metodo_pago', 'stripe')
         
-        # Crear la compra
-        compra = Compra.objects.create(
-            usuario=request.user,
-            total=total,
-            metodo_pago=metodo_pago
-        )
-        
-        # Crear items de compra y actualizar stock
-        for item in carrito_items:
-            CompraItem.objects.create(
-                compra=compra,
-                producto=item.producto,
-                cantidad=item.cantidad,
-                precio_unitario=item.producto.precio
-            )
-            # Reducir stock
-            item.producto.stock -= item.cantidad
-            item.producto.save()
-        
-        # Eliminar items del carrito
-        carrito_items.delete()
+        # Todo o nada, con el mismo número de consultas sea cual sea el carrito:
+        # una lectura, la compra, un UPDATE del stock, un bulk_create y un borrado
+        try:
+            with transaction.atomic():
+                carrito_items = list(
+                    CarritoItem.objects.filter(usuario=request.user).select_related('producto').order_by('producto_id')
+                )
+                if not carrito_items:
+                    return Response(
+                        {'error': 'Tu carrito está vacío'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
+                # Lo reservado por este carrito ya es suyo; lo de otros no se puede vender
+                reservadas = reservas.reservadas(propietario) if reservas.activas() else {}
+                
+                # Validar stock antes de crear la compra
+                for item in carrito_items:
+                    disponible = item.producto.stock - item.producto.reservado + reservadas.get(item.producto_id, 0)
+                    if item.cantidad > disponible:
+                        return self.stock_insuficiente(item.producto, disponible)
+                
+                compra_items = [
+                    CompraItem(
+                        producto=item.producto,
+                        cantidad=item.cantidad,
+                        precio_unitario=item.producto.precio
+                    ).calcular_subtotal()
+                    for item in carrito_items
+                ]
+                compra = Compra.objects.create(
+                    usuario=request.user,
+                    total=sum(compra_item.subtotal for compra_item in compra_items),
+                    metodo_pago=metodo_pago
+                )
+                
+                # Reducir stock (sólo si sigue habiendo: otra compra pudo llevárselo
+                # desde la lectura) y sumar la venta a los contadores del producto
+                vendidos = {
+                    compra_item.producto_id: (compra_item.cantidad, compra_item.subtotal)
+                    for compra_item in compra_items
+                }
+                vender(vendidos, reservadas)
+                if reservadas:
+                    reservas.cerrar(propietario, reservadas, vendidos)
+                
+                for compra_item in compra_items:
+                    compra_item.compra = compra
+                CompraItem.objects.bulk_create(compra_items)
+                
+                # Eliminar items del carrito
+                CarritoItem.objects.filter(pk__in=[item.pk for item in carrito_items]).delete()
+                
+                # El correo de confirmación sale del worker, sólo si la compra se confirma
+                encolar(trabajos.confirmar_compra, compra_id=compra.pk)
+        except StockAgotado:
+            # Se deshizo todo; se informa del primer producto que ya no alcanza
+            cantidades = {item.producto_id: item.cantidad for item in carrito_items}
+            for producto in Producto.objects.filter(pk__in=cantidades).order_by('pk'):
+                disponible = producto.stock - producto.reservado + reservadas.get(producto.pk, 0)
+                if disponible < cantidades[producto.pk]:
+                    return self.stock_insuficiente(producto, disponible)
+            raise
+        
+        # El stock mostrado en el catálogo cambió
+        incrementar_version()
+        self.almacen.tras_compra(propietario, {item.producto_id: item.cantidad for item in carrito_items})
         
         # Serializar y retornar la compra
-        serializer = CompraSerializer(compra)
+        serializer = CompraSerializer(compras_con_detalle().get(pk=compra.pk))
         return Response({
             'message': 'Compra realizada exitosamente',
             'compra': serializer.data
         }, status=status.HTTP_201_CREATED)
 
 
+def filtros_compras(query_params):
+    """Filtros ``desde``, ``hasta`` y ``estado`` de la petición; 400 si no son válidos"""
+    filtros, errores = {}, {}
+    for parametro, fin_del_dia in (('desde', False), ('hasta', True)):
+        valor = query_params.get(parametro)
+        if valor:
+            try:
+                filtros[parametro] = parsear_fecha(valor, fin_del_dia)
+            except ValueError:
+                errores[parametro] = 'Fecha no válida. Formato: AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS'
+    estado = query_params.get('estado')
+    if estado:
+        try:
+            filtros['estados'] = parsear_estados(estado)
+        except ValueError:
+            errores['estado'] = f'Estado no válido. Opciones: {", ".join(ESTADOS_COMPRA)}'
+    if errores:
+        raise ValidationError(errores)
+    return filtros
+
+
 class CompraViewSet(viewsets.ReadOnlyModelViewSet):
-    """ViewSet para ver historial de compras"""
+    """Historial de compras del usuario, paginado por cursor y filtrable por fecha y estado"""
     serializer_class = CompraSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = None  # Desactivar paginación para compras
-    
+    pagination_class = KeysetPagination
+    filter_backends = []
+    # Columnas de las líneas que lee CompraItemResumenSerializer
+    COLUMNAS_ITEMS_LISTADO = ['id', 'compra_id', 'producto_id', 'cantidad', 'precio_unitario', 'subtotal',
+                              'producto__nombre', 'producto__imagen']
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return CompraListSerializer
+        return CompraSerializer
+
     def get_queryset(self):
         """Solo mostrar compras del usuario autenticado"""
         if not self.request.user.is_authenticated:
             return Compra.objects.none()
-        return Compra.objects.filter(usuario=self.request.user).prefetch_related('items__producto').order_by('-fecha_compra')
+        if self.action == 'list':
+            items = CompraItem.objects.select_related('producto').only(*self.COLUMNAS_ITEMS_LISTADO)
+            compras = compras_con_detalle(items=items).filter(
+                filtro_compras(**filtros_compras(self.request.query_params))
+            )
+            if 'items' not in self.get_serializer().fields:
+                # ?omit=items: ni siquiera se leen las líneas
+                compras = compras.prefetch_related(None)
+        else:
+            items = self.get_serializer().fields.get('items')
+            compras = compras_con_detalle(campos_a_diferir(items) if items is not None else None)
+        return compras.filter(usuario=self.request.user).order_by('-fecha_compra', '-id')
+
+    @action(detail=False, methods=['get'])
+    def resumen(self, request):
+        """Número de compras y total gastado por el usuario, en una consulta"""
+        totales = Compra.objects.filter(usuario=request.user).aggregate(
+            compras=Count('id'), total_gastado=Sum('total')
+        )
+        return Response({'compras': totales['compras'], 'total_gastado': totales['total_gastado'] or 0})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def exportar_compras(request):
+    """Exportación de compras o de sus líneas en CSV o NDJSON, en streaming"""
+    try:
+        exportacion = Exportacion(
+            tipo=request.query_params.get('tipo', 'compras'),
+            formato=request.query_params.get('formato', 'csv'),
+            **filtros_compras(request.query_params),
+        )
+    except ValueError as error:
+        raise ValidationError({'error': str(error)})
+    response = StreamingHttpResponse(exportacion, content_type=exportacion.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{exportacion.nombre_archivo}"'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def analitica_ventas(request):
+    """Ventas agrupadas por día, mes, categoría o método de pago, desde el resumen diario"""
+    fechas, errores = {}, {}
+    for parametro in ('desde', 'hasta'):
+        valor = request.query_params.get(parametro)
+        try:
+            fechas[parametro] = parse_date(valor) if valor else None
+            if valor and fechas[parametro] is None:
+                raise ValueError
+        except ValueError:
+            errores[parametro] = 'Fecha no válida. Formato: AAAA-MM-DD'
+    agrupar = [clave.strip() for clave in request.query_params.get('agrupar', 'dia').split(',') if clave.strip()]
+    if any(clave not in analitica.AGRUPACIONES for clave in agrupar):
+        errores['agrupar'] = f'Agrupación no válida. Opciones: {", ".join(analitica.AGRUPACIONES)}'
+    if errores:
+        raise ValidationError(errores)
+
+    filas = analitica.consultar(fechas['desde'], fechas['hasta'], agrupar)
+    punto = PuntoControl.objects.filter(nombre=analitica.PUNTO_CONTROL).first()
+    return Response({
+        'desde': fechas['desde'],
+        'hasta': fechas['hasta'],
+        'agrupar': agrupar,
+        'actualizado': punto.actualizado if punto else None,
+        'filas': filas,
+        'totales': {medida: sum(fila[medida] for fila in filas) for medida in analitica.MEDIDAS},
+    })
 
 
 @api_view(['GET', 'PUT', 'PATCH'])
@@ -54,7 +54,7 @@ const ProductCard = ({ producto, onFavoritoChange }) => {
           <p className="card-text">
             <span className="badge bg-primary">{producto.categoria.nombre}</span>
           </p>
-          {producto.contraportada && (
+          {(producto.resumen || producto.contraportada) && (
             <p className="card-text text-muted small mb-3" style={{ 
               display: '-webkit-box',
               WebkitLineClamp: 3,
@@ -63,7 +63,7 @@ const ProductCard = ({ producto, onFavoritoChange }) => {
               textOverflow: 'ellipsis',
               minHeight: '60px'
             }}>
-              {producto.contraportada}
+              {producto.resumen || producto.contraportada}
             </p>
           )}
           <div className="mt-auto">
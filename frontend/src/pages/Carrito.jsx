@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import { getCarrito, removeFromCarrito, updateCarritoItem, checkout } from '../services/cartService';
@@ -127,12 +127,17 @@ const Carrito = () => {
     },
   });
 
+  // Idempotency-Key del intento de compra en curso: un reintento tras un timeout
+  // o un doble clic reutiliza la clave y recibe la compra ya creada
+  const claveCheckout = useRef(null);
+
   // Mutación para checkout
   const checkoutMutation = useMutation({
-    mutationFn: async () => {
-      return await checkout('stripe');
+    mutationFn: async (idempotencyKey) => {
+      return await checkout('stripe', idempotencyKey);
     },
     onSuccess: (data) => {
+      claveCheckout.current = null;
       setNotification({
         message: data.message || 'Compra realizada exitosamente',
         type: 'success',
@@ -148,6 +153,13 @@ const Carrito = () => {
       }, 2000);
     },
     onError: (error) => {
+      // Sin respuesta, con 5xx o con 409 (la compra sigue en curso) se reintenta con la misma
+      // clave; una respuesta definitiva (p. ej. sin stock) queda guardada con ella, así que
+      // el siguiente intento, quizá con otro carrito, es una compra nueva
+      const estado = error.response?.status;
+      if (estado && estado < 500 && estado !== 409) {
+        claveCheckout.current = null;
+      }
       const message =
         error.response?.data?.error || 
         error.response?.data?.message || 
@@ -197,7 +209,11 @@ const Carrito = () => {
       }, 2000);
       return;
     }
-    checkoutMutation.mutate();
+    // La clave se crea antes de enviar: un doble clic manda la misma
+    if (!claveCheckout.current) {
+      claveCheckout.current = crypto.randomUUID();
+    }
+    checkoutMutation.mutate(claveCheckout.current);
   };
 
   // Prefetch producto al pasar el mouse
@@ -1,6 +1,6 @@
 import React from 'react';
 import { Link } from 'react-router-dom';
-import { useQuery } from '@tanstack/react-query';
+import { useInfiniteQuery } from '@tanstack/react-query';
 import { getCompras } from '../services/compraService';
 import { isAuthenticated } from '../services/authService';
 import Notification from '../components/Notification';
@@ -8,30 +8,25 @@ import Notification from '../components/Notification';
 const HistorialCompras = () => {
   const [notification, setNotification] = React.useState(null);
 
-  const { data: comprasData, isLoading, error } = useQuery({
-    queryKey: ['compras'],
-    queryFn: async () => {
-      try {
-        const data = await getCompras();
-        // Asegurar que siempre es un array
-        const compras = Array.isArray(data) ? data : [];
-        return compras;
-      } catch (err) {
-        console.error('Error obteniendo compras:', err);
-        // Si es 404, devolver array vacío en lugar de error
-        if (err.response?.status === 404) {
-          return [];
-        }
-        throw err;
-      }
-    },
+  // Historial paginado por cursor: cada página trae las siguientes compras
+  const {
+    data,
+    isLoading,
+    error,
+    fetchNextPage,
+    hasNextPage,
+    isFetchingNextPage,
+  } = useInfiniteQuery({
+    queryKey: ['compras', 'historial'],
+    queryFn: ({ pageParam }) => getCompras(pageParam ? { cursor: pageParam } : {}),
+    initialPageParam: null,
+    getNextPageParam: (ultimaPagina) => ultimaPagina.cursor ?? undefined,
     enabled: isAuthenticated(),
     retry: 1,
     staleTime: 30000, // Cache por 30 segundos
   });
 
-  // Asegurar que compras siempre es un array
-  const compras = Array.isArray(comprasData) ? comprasData : [];
+  const compras = data ? data.pages.flatMap((pagina) => pagina.results) : [];
 
   if (!isAuthenticated()) {
     return (
@@ -197,6 +192,17 @@ const HistorialCompras = () => {
                 </div>
               </div>
             ))}
+            {hasNextPage && (
+              <div className="text-center mt-4">
+                <button
+                  className="btn btn-outline-primary"
+                  onClick={() => fetchNextPage()}
+                  disabled={isFetchingNextPage}
+                >
+                  {isFetchingNextPage ? 'Cargando...' : 'Ver más compras'}
+                </button>
+              </div>
+            )}
           </div>
         ) : null}
       </div>
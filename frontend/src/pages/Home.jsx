@@ -331,6 +331,7 @@ const Home = () => {
                       <option value="-precio">Precio: Mayor a Menor</option>
                       <option value="nombre">Nombre: A-Z</option>
                       <option value="-nombre">Nombre: Z-A</option>
+                      <option value="mas_vendidos">Más vendidos</option>
                     </select>
                   </div>
                 </div>
@@ -2,11 +2,14 @@ import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { getCurrentUser, isAuthenticated, updatePerfil, cambiarPassword, getPerfil } from '../services/authService';
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
-import { getCompras } from '../services/compraService';
+import { getCompras, getResumenCompras } from '../services/compraService';
 import { getTotalFavoritos } from '../services/favoritosService';
 import { getCarritoItemCount } from '../services/cartService';
 import Notification from '../components/Notification';
 
+// Compras que se muestran en la pestaña "Mis Compras"
+const COMPRAS_RECIENTES = 5;
+
 const Perfil = () => {
   const navigate = useNavigate();
   const queryClient = useQueryClient();
@@ -20,7 +23,6 @@ const Perfil = () => {
     totalCarrito: 0,
     totalGastado: 0
   });
-  const [showAllCompras, setShowAllCompras] = useState(false);
 
   // Formulario de edición de perfil
   const [profileForm, setProfileForm] = useState({
@@ -69,12 +71,26 @@ const Perfil = () => {
     }
   }, [user]);
 
-  // Obtener compras del usuario
+  // Número de compras y total gastado (sin descargar el historial)
+  const { data: resumenCompras } = useQuery({
+    queryKey: ['compras', 'resumen'],
+    queryFn: async () => {
+      try {
+        return await getResumenCompras();
+      } catch (error) {
+        return null;
+      }
+    },
+    enabled: isAuthenticated(),
+  });
+
+  // Últimas compras (el historial completo, por páginas, está en /historial)
   const { data: compras = [] } = useQuery({
-    queryKey: ['compras'],
+    queryKey: ['compras', 'recientes'],
     queryFn: async () => {
       try {
-        return await getCompras();
+        const pagina = await getCompras({ page_size: COMPRAS_RECIENTES, omit: 'items' });
+        return pagina.results;
       } catch (error) {
         return [];
       }
@@ -84,12 +100,11 @@ const Perfil = () => {
 
   // Actualizar estadísticas
   useEffect(() => {
-    if (compras && compras.length > 0) {
-      const totalGastado = compras.reduce((sum, compra) => sum + parseFloat(compra.total || 0), 0);
+    if (resumenCompras && resumenCompras.compras > 0) {
       setStats(prev => ({
         ...prev,
-        totalCompras: compras.length,
-        totalGastado: totalGastado
+        totalCompras: resumenCompras.compras,
+        totalGastado: parseFloat(resumenCompras.total_gastado || 0)
       }));
     }
 
@@ -105,7 +120,7 @@ const Perfil = () => {
         totalCarrito: count
       }));
     });
-  }, [compras]);
+  }, [resumenCompras]);
 
   // Mutación para actualizar perfil
   const updateProfileMutation = useMutation({
@@ -522,7 +537,7 @@ const Perfil = () => {
                   </div>
                   {compras && compras.length > 0 ? (
                     <div className="perfil-compras-list">
-                      {(showAllCompras ? compras : compras.slice(0, 5)).map((compra) => (
+                      {compras.map((compra) => (
                         <div key={compra.id} className="perfil-compra-item">
                           <div className="perfil-compra-header">
                             <div>
@@ -549,24 +564,12 @@ const Perfil = () => {
                           </div>
                         </div>
                       ))}
-                      {compras.length > 5 && (
+                      {resumenCompras?.compras > compras.length && (
                         <div className="text-center mt-4">
-                          <button 
-                            className="btn btn-outline-primary"
-                            onClick={() => setShowAllCompras(!showAllCompras)}
-                          >
-                            {showAllCompras ? (
-                              <>
-                                <i className="fas fa-chevron-up me-2"></i>
-                                Ver Menos
-                              </>
-                            ) : (
-                              <>
-                                <i className="fas fa-chevron-down me-2"></i>
-                                Ver Todas las Compras ({compras.length})
-                              </>
-                            )}
-                          </button>
+                          <Link to="/historial" className="btn btn-outline-primary">
+                            <i className="fas fa-chevron-down me-2"></i>
+                            Ver Todas las Compras ({resumenCompras.compras})
+                          </Link>
                         </div>
                       )}
                     </div>
@@ -1,7 +1,13 @@
 import api from './api';
 
+// El carrito de invitado se pasa a la cuenta al iniciar sesión o registrarse
+const conCarritoInvitado = (datos) => {
+  const sessionKey = localStorage.getItem('cart_session_key');
+  return sessionKey ? { ...datos, session_key: sessionKey } : datos;
+};
+
 export const register = async (userData) => {
-  const response = await api.post('/auth/registro/', userData);
+  const response = await api.post('/auth/registro/', conCarritoInvitado(userData));
   if (response.data.access) {
     localStorage.setItem('access_token', response.data.access);
     localStorage.setItem('refresh_token', response.data.refresh);
@@ -11,7 +17,7 @@ export const register = async (userData) => {
 };
 
 export const login = async (credentials) => {
-  const response = await api.post('/auth/login/', credentials);
+  const response = await api.post('/auth/login/', conCarritoInvitado(credentials));
   if (response.data.access) {
     localStorage.setItem('access_token', response.data.access);
     localStorage.setItem('refresh_token', response.data.refresh);
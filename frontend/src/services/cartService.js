@@ -57,11 +57,40 @@ export const getCarritoTotal = async () => {
   return response.data;
 };
 
-export const checkout = async (metodoPago = 'stripe') => {
+/**
+ * Aplica varias operaciones al carrito en una sola petición (todas o ninguna).
+ * operaciones: [{ accion: 'agregar' | 'fijar' | 'quitar', producto, cantidad }]
+ */
+export const applyCarritoLote = async (operaciones) => {
+  const sessionKey = getSessionKey();
+  const response = await api.post('/carrito/lote/', {
+    operaciones,
+    session_key: sessionKey,
+  });
+
+  if (response.data.session_key) {
+    localStorage.setItem('cart_session_key', response.data.session_key);
+  }
+
+  return response.data;
+};
+
+/**
+ * Items, total, unidades y avisos de stock del carrito en una sola petición
+ */
+export const getCarritoResumen = async () => {
+  const sessionKey = getSessionKey();
+  const response = await api.get('/carrito/resumen/', { params: { session_key: sessionKey } });
+  return response.data;
+};
+
+export const checkout = async (metodoPago, idempotencyKey) => {
   // El checkout ahora requiere autenticación y crea una compra
+  // Con la misma clave, un reintento devuelve la compra ya creada en lugar de duplicarla:
+  // quien llama crea una clave por intento de compra y la reutiliza al reintentar
   const response = await api.post('/carrito/checkout/', {
     metodo_pago: metodoPago
-  });
+  }, { headers: { 'Idempotency-Key': idempotencyKey } });
   return response.data;
 };
 
@@ -70,10 +99,8 @@ export const checkout = async (metodoPago = 'stripe') => {
  */
 export const getCarritoItemCount = async () => {
   try {
-    const data = await getCarrito();
-    const itemsArray = Array.isArray(data) ? data : (data.results || []);
-    // Sumar las cantidades de todos los items
-    return itemsArray.reduce((total, item) => total + (item.cantidad || 1), 0);
+    const data = await getCarritoResumen();
+    return data.cantidad_items;
   } catch (error) {
     console.error('Error obteniendo cantidad del carrito:', error);
     return 0;
@@ -1,31 +1,37 @@
 import api from './api';
 
 /**
- * Obtener todas las compras del usuario autenticado
+ * Obtener una página del historial de compras del usuario autenticado.
+ * Devuelve { results, count, cursor }: `cursor` pide la página siguiente (null si no hay más)
  */
-export const getCompras = async () => {
+export const getCompras = async (params = {}) => {
   try {
-    const response = await api.get('/compras/');
-    // Asegurar que siempre devolvemos un array
-    if (Array.isArray(response.data)) {
-      return response.data;
-    }
-    // Si viene en formato de paginación
-    if (response.data && Array.isArray(response.data.results)) {
-      return response.data.results;
-    }
-    // Si viene vacío o null, devolver array vacío
-    return [];
+    const response = await api.get('/compras/', { params });
+    const data = response.data || {};
+    const next = data.next ? new URL(data.next, window.location.origin).searchParams.get('cursor') : null;
+    return {
+      results: Array.isArray(data.results) ? data.results : [],
+      count: data.count || 0,
+      cursor: next,
+    };
   } catch (error) {
-    // Si es 404 y el usuario está autenticado, devolver array vacío
+    // Si es 404 y el usuario está autenticado, devolver una página vacía
     if (error.response?.status === 404) {
       console.warn('Endpoint de compras no encontrado, devolviendo lista vacía');
-      return [];
+      return { results: [], count: 0, cursor: null };
     }
     throw error;
   }
 };
 
+/**
+ * Número de compras y total gastado del usuario autenticado
+ */
+export const getResumenCompras = async () => {
+  const response = await api.get('/compras/resumen/');
+  return response.data;
+};
+
 /**
  * Obtener una compra específica por ID
  */
@@ -37,10 +43,12 @@ export const getCompra = async (compraId) => {
 /**
  * Realizar checkout y crear compra
  */
-export const realizarCompra = async (metodoPago = 'stripe') => {
+export const realizarCompra = async (metodoPago, idempotencyKey) => {
+  // Con la misma clave, un reintento devuelve la compra ya creada en lugar de duplicarla:
+  // quien llama crea una clave por intento de compra y la reutiliza al reintentar
   const response = await api.post('/carrito/checkout/', {
     metodo_pago: metodoPago
-  });
+  }, { headers: { 'Idempotency-Key': idempotencyKey } });
   return response.data;
 };
 